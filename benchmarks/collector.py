@@ -0,0 +1,78 @@
+"""Load test of the collector fetch stage against the local Ocean stand-in: runs collector cycles for
+many addresses and vaults without saving them and reports throughput, request latency and the retries
+the faults caused"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import ocean_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    """Run collector cycles against the local Ocean stand-in"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cycles", type=int, default=20, help="collector cycles to run")
+    parser.add_argument("--tokens", type=int, default=10, help="synthetic tokens, DFI and DUSD included")
+    parser.add_argument("--lp-pairs", type=int, default=5, help="synthetic liquidity pool pairs with DFI")
+    parser.add_argument("--addresses", type=int, default=1, help="addresses collected per cycle")
+    parser.add_argument("--vaults", type=int, default=1, help="vaults collected per cycle")
+    parser.add_argument("--fixtures", help="JSON file with recorded fixtures, synthetic fixtures otherwise")
+    parser.add_argument("--workers", type=int, default=8, help="OCEAN_MAX_WORKERS of the collector")
+    parser.add_argument("--rate-limit", type=float, default=1000, help="OCEAN_RATE_LIMIT of the collector")
+    parser.add_argument("--retries", type=int, default=5, help="OCEAN_MAX_RETRIES of the collector")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="uniform jitter of the latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--server-rate-limit", type=float, help="requests per second the stand-in answers")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds of 429 responses")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        with open(args.fixtures, encoding="utf-8") as file:
+            fixtures = json.load(file)
+    else:
+        fixtures = ocean_server.synthetic_fixtures(args.tokens, args.lp_pairs)
+    faults = ocean_server.Faults(args.latency, args.jitter, args.error_rate, args.throttle_rate,
+                                 args.server_rate_limit, args.retry_after)
+    server = ocean_server.OceanServer(("127.0.0.1", 0), fixtures, faults)
+    server.start()
+
+    # the collector reads its Ocean settings from the environment on import
+    os.environ.update({"OCEAN_URL": server.url, "OCEAN_MAX_WORKERS": str(args.workers),
+                       "OCEAN_RATE_LIMIT": str(args.rate_limit), "OCEAN_MAX_RETRIES": str(args.retries)})
+    import get_data
+    from utils.ocean import OceanError
+
+    # synthetic fixtures answer any address and vault id
+    owners = {"address": [(i, f"address{i}") for i in range(1, args.addresses + 1)],
+              "vault": [(args.addresses + i, f"vault{i}") for i in range(1, args.vaults + 1)]}
+    print(f"Collector against {server.url} with {faults}")
+    failures = 0
+    start = time.perf_counter()
+    for _ in range(args.cycles):
+        for collect in get_data.COLLECTORS.values():
+            try:
+                collect(owners)
+            except OceanError as err:
+                failures += 1
+                print(err)
+    elapsed = time.perf_counter() - start
+    get_data.ocean.close()
+    server.shutdown()
+    server.server_close()
+
+    print(f"{args.cycles} cycles in {elapsed:.2f}s, {args.cycles / elapsed:.2f} cycles/s, {failures} failed jobs")
+    for endpoint, metrics in get_data.ocean.metrics.summary().items():
+        print(f"{endpoint:32} {metrics['requests']:>6} requests {metrics['errors']:>5} errors "
+              f"p50 {metrics['p50']:.3f}s p95 {metrics['p95']:.3f}s max {metrics['max']:.3f}s")
+    for endpoint, statuses in server.stats().items():
+        print(f"{endpoint:32} {statuses}")
+
+
+if __name__ == "__main__":
+    main()
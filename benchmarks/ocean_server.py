@@ -0,0 +1,301 @@
+"""Local stand-in for the Ocean API: serves recorded or synthetic responses of the endpoints the
+collector uses, with injectable latency, errors and 429 responses. Point the collector to it with
+OCEAN_URL=http://127.0.0.1:8999/v0/mainnet"""
+import argparse
+import json
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.ocean import OCEAN_URL, OceanClient  # noqa: E402
+from utils.ratelimit import TokenBucket  # noqa: E402
+
+# Ocean paths start with the API version and network, the stand-in serves every network
+PREFIX = re.compile(r"^/v0/[a-z]+")
+# endpoints with an id that fixtures can match with '*', to serve any address or vault
+WILDCARDS = [
+    (re.compile(r"^/address/[^/]+/tokens$"), "/address/*/tokens"),
+    (re.compile(r"^/loans/vaults/[^/]+$"), "/loans/vaults/*"),
+]
+# page size of paginated endpoints, like Ocean's default
+PAGE_SIZE = 30
+# path of the request counters of the stand-in itself
+STATS_PATH = "/_stats"
+
+# token ids the collector treats specially
+DFI_ID = "0"
+DUSD_ID = "15"
+
+
+def amount(value):
+    """ Format a number like Ocean does, as string with 8 decimals """
+    return f"{value:.8f}"
+
+
+def synthetic_fixtures(tokens=10, lp_pairs=5):
+    """ Build fixtures with an address holding `tokens` tokens and `lp_pairs` liquidity pool tokens
+    paired with DFI, a vault with DFI and DUSD collateral and a loan of every loan token, and
+    prices of all tokens. Address and vault are served for any id """
+    token_list = [{"id": DFI_ID, "symbol": "DFI", "name": "Default Defi token", "isLoanToken": False},
+                  {"id": DUSD_ID, "symbol": "DUSD", "name": "Decentralized USD", "isLoanToken": True}]
+    others = [token_id for token_id in range(1, tokens + 1) if str(token_id) not in (DFI_ID, DUSD_ID)]
+    token_list += [{"id": str(token_id), "symbol": f"T{token_id}", "name": f"Token {token_id}",
+                    "isLoanToken": token_id % 2 == 0} for token_id in others[:tokens - 2]]
+    price = {token["id"]: 1.0 if token["id"] == DUSD_ID else 2 + int(token["id"]) / 10 for token in token_list}
+
+    fixtures = {}
+    holdings = [dict(token, amount=amount(10 + int(token["id"])), isDAT=True, isLPS=False)
+                for token in token_list]
+    for i, token in enumerate(token_list[1:lp_pairs + 1]):
+        pair_id = str(100 + i)
+        holdings.append({"id": pair_id, "symbol": f"{token['symbol']}-DFI",
+                         "name": f"{token['name']}-Default Defi token", "amount": amount(5 + i),
+                         "isDAT": True, "isLPS": True, "isLoanToken": False})
+        fixtures[f"/poolpairs/{pair_id}"] = {
+            "id": pair_id, "symbol": f"{token['symbol']}-DFI",
+            "tokenA": {"id": token["id"], "reserve": amount(1e6 * price[DFI_ID] / price[token["id"]])},
+            "tokenB": {"id": DFI_ID, "reserve": amount(1e6)},
+            "priceRatio": {"ab": amount(price[token["id"]] / price[DFI_ID]),
+                           "ba": amount(price[DFI_ID] / price[token["id"]])},
+            "totalLiquidity": {"token": amount(7e5), "usd": amount(2e6 * price[DFI_ID])},
+            "apr": {"reward": 0.3 + i / 100, "commission": 0.01, "total": 0.31 + i / 100},
+            "volume": {"h24": 1e5, "d30": 3e6},
+        }
+    fixtures["/address/*/tokens"] = holdings
+
+    def vault_amount(token, value):
+        return {"id": token["id"], "symbol": token["symbol"], "name": token["name"], "amount": amount(value),
+                "activePrice": {"key": f"{token['symbol']}/USD",
+                                "active": {"amount": amount(price[token["id"]])},
+                                "next": {"amount": amount(price[token["id"]] * 1.01)}}}
+
+    collateral = [vault_amount(token, 1000) for token in token_list if token["id"] in (DFI_ID, DUSD_ID)]
+    loans = [vault_amount(token, 100) for token in token_list if token["isLoanToken"]]
+    collateral_value = sum(float(item["amount"]) * price[item["id"]] for item in collateral)
+    loan_value = sum(float(item["amount"]) * price[item["id"]] for item in loans)
+    fixtures["/loans/vaults/*"] = {
+        "vaultId": "*", "informativeRatio": amount(100 * collateral_value / loan_value),
+        "collateralValue": amount(collateral_value), "loanValue": amount(loan_value),
+        "interestValue": amount(loan_value / 1000),
+        "collateralAmounts": collateral, "loanAmounts": loans,
+    }
+    fixtures["/prices"] = [{"id": f"{token['symbol']}-USD",
+                            "price": {"token": token["symbol"], "currency": "USD",
+                                      "aggregated": {"amount": amount(price[token["id"]])}}}
+                           for token in token_list if token["id"] != DUSD_ID]
+    return fixtures
+
+
+def record_fixtures(client, address, vault_id):
+    """ Record the responses the collector gets for an address and a vault from the Ocean API """
+    holdings = list(client.paginate("/address/{address}/tokens", address=address))
+    fixtures = {f"/address/{address}/tokens": holdings,
+                f"/loans/vaults/{vault_id}": client.get("/loans/vaults/{vault_id}", vault_id=vault_id)["data"],
+                "/prices": list(client.paginate("/prices"))}
+    for token in holdings:
+        if token["isLPS"]:
+            fixtures[f"/poolpairs/{token['id']}"] = client.get("/poolpairs/{token_id}", token_id=token["id"])["data"]
+    return fixtures
+
+
+class Faults():
+    """ Faults injected into the responses of the stand-in: latency in seconds with uniform jitter,
+    a share of 503 and 429 responses and an optional rate limit answered with 429 """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, rate_limit=None,
+                 retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limiter = TokenBucket(rate_limit) if rate_limit else None
+        self.retry_after = retry_after
+
+    def status(self):
+        """ Sleep for the latency of one request, returns the status code to answer it with """
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire():
+            return 429
+        draw = random.random()
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 503
+        return 200
+
+    def __str__(self):
+        return (f"[Faults] {self.latency}s ± {self.jitter}s latency, {self.error_rate:.0%} errors, "
+                f"{self.throttle_rate:.0%} throttled, rate limit {self.rate_limiter}")
+
+
+class OceanHandler(BaseHTTPRequestHandler):
+    """ Request handler answering from the fixtures of its server """
+    # keep-alive, like Ocean, so the pooled connections of the collector are reused
+    protocol_version = "HTTP/1.1"
+    # headers and body leave in one write, flushed after every request
+    wbufsize = -1
+
+    def do_GET(self):  # noqa: N802
+        """ Answer a GET request from the fixtures """
+        url = urlsplit(self.path)
+        path = PREFIX.sub("", url.path).rstrip("/")
+        if path == STATS_PATH:
+            self.send_json(200, self.server.stats())
+            return
+        status = self.server.faults.status()
+        self.server.count(path, status)
+        if status == 429:
+            self.send_json(status, {"error": {"code": 429, "type": "TooManyRequests"}},
+                           {"Retry-After": str(self.server.faults.retry_after)})
+            return
+        if status != 200:
+            self.send_json(status, {"error": {"code": status, "type": "ServiceUnavailable"}})
+            return
+        data = self.server.lookup(path)
+        if data is None:
+            self.send_json(404, {"error": {"code": 404, "type": "NotFound", "url": path}})
+            return
+        if not isinstance(data, list):
+            self.send_json(200, {"data": data})
+            return
+        # paginated endpoint, the next token is the offset of the next page
+        offset = int(parse_qs(url.query).get("next", ["0"])[0])
+        size = int(parse_qs(url.query).get("size", [self.server.page_size])[0])
+        body = {"data": data[offset:offset + size]}
+        if offset + size < len(data):
+            body["page"] = {"next": str(offset + size)}
+        self.send_json(200, body)
+
+    def send_json(self, status, body, headers=None):
+        """ Send a JSON response with content length, the connection stays open """
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):  # noqa: A002
+        """ Keep the output of load tests clean, the stats endpoint counts every request """
+
+
+class OceanServer(ThreadingHTTPServer):
+    """ Threaded HTTP server with the fixtures, faults and request counters of the stand-in """
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, faults=None, page_size=PAGE_SIZE):
+        super().__init__(address, OceanHandler)
+        self.fixtures = fixtures
+        self.faults = faults or Faults()
+        self.page_size = page_size
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        """ Base URL to give the Ocean client """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v0/mainnet"
+
+    def lookup(self, path):
+        """ Get the fixture of a path, endpoints with an id fall back to their '*' fixture """
+        if path in self.fixtures:
+            return self.fixtures[path]
+        for pattern, wildcard in WILDCARDS:
+            if pattern.match(path):
+                data = self.fixtures.get(wildcard)
+                if isinstance(data, dict) and data.get("vaultId") == "*":
+                    # every vault served by the wildcard answers with its own id
+                    data = dict(data, vaultId=path.rsplit("/", 1)[1])
+                return data
+        return None
+
+    def count(self, path, status):
+        """ Count a request by endpoint and status code """
+        endpoint = next((wildcard for pattern, wildcard in WILDCARDS if pattern.match(path)),
+                        re.sub(r"^/poolpairs/[^/]+$", "/poolpairs/*", path))
+        with self.lock:
+            self.counts[(endpoint, status)] += 1
+
+    def stats(self):
+        """ Get request counts per endpoint and status code """
+        with self.lock:
+            stats = {}
+            for (endpoint, status), count in sorted(self.counts.items()):
+                stats.setdefault(endpoint, {})[str(status)] = count
+            return stats
+
+    def start(self):
+        """ Serve from a background thread, returns the thread """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    """Serve recorded or synthetic Ocean API responses, or record them from the Ocean API"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record = subparsers.add_parser("record", help="record the responses of an address and a vault")
+    record.add_argument("--url", default=OCEAN_URL, help="base URL of the Ocean API")
+    record.add_argument("--address", required=True, help="DeFiChain address")
+    record.add_argument("--vault", required=True, help="DeFiChain vault id")
+    record.add_argument("--output", required=True, help="JSON file to save the fixtures to")
+    serve = subparsers.add_parser("serve", help="serve fixtures")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8999)
+    serve.add_argument("--fixtures", help="JSON file with recorded fixtures, synthetic fixtures otherwise")
+    serve.add_argument("--tokens", type=int, default=10, help="synthetic tokens, DFI and DUSD included")
+    serve.add_argument("--lp-pairs", type=int, default=5, help="synthetic liquidity pool pairs with DFI")
+    serve.add_argument("--page-size", type=int, default=PAGE_SIZE, help="items per page of paginated endpoints")
+    serve.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    serve.add_argument("--jitter", type=float, default=0.0, help="uniform jitter of the latency in seconds")
+    serve.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    serve.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    serve.add_argument("--rate-limit", type=float, help="requests per second, more are answered with 429")
+    serve.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds of 429 responses")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        client = OceanClient(base_url=args.url)
+        fixtures = record_fixtures(client, args.address, args.vault)
+        client.close()
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(fixtures, file, indent=1)
+        print(f"Recorded {len(fixtures)} fixtures to {args.output}")
+        return
+
+    if args.fixtures:
+        with open(args.fixtures, encoding="utf-8") as file:
+            fixtures = json.load(file)
+    else:
+        fixtures = synthetic_fixtures(args.tokens, args.lp_pairs)
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.rate_limit,
+                    args.retry_after)
+    server = OceanServer((args.host, args.port), fixtures, faults, args.page_size)
+    print(f"Serving {len(fixtures)} fixtures at {server.url} with {faults}")
+    # print the request counts on SIGTERM too
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats(), indent=1))
+
+
+if __name__ == "__main__":
+    main()
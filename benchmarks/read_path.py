@@ -0,0 +1,168 @@
+"""Benchmark of the DataFrame read paths on a synthetic holdings history: pd.read_sql,
+a plain cursor fetch and COPY TO STDOUT parsed by Arrow"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+import sqlalchemy
+from dotenv import load_dotenv
+
+# sibling benchmark modules and the dashboard utils, whatever the working directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import synthetic  # noqa: E402
+from utils import export  # noqa: E402
+
+# load environment variables
+load_dotenv()
+
+# scratch table filled with synthetic rows, dropped after the benchmark
+TABLE = "benchmark_holdings"
+
+SQL = f"""
+    select created_at, token_id, amount, tokena_reserve, tokenb_reserve, total_liquidity_token,
+    apr_reward, apr_commission
+    from {TABLE};
+    """
+
+DTYPES = {
+    "created_at": "datetime64[ns, UTC]",
+    "token_id": "int64",
+    "amount": "float64",
+    "tokena_reserve": "float64",
+    "tokenb_reserve": "float64",
+    "total_liquidity_token": "float64",
+    "apr_reward": "float64",
+    "apr_commission": "float64",
+}
+
+SCHEMA = pa.schema([
+    ("created_at", pa.timestamp("us", tz="UTC")),
+    ("token_id", pa.int64()),
+    ("amount", pa.float64()),
+    ("tokena_reserve", pa.float64()),
+    ("tokenb_reserve", pa.float64()),
+    ("total_liquidity_token", pa.float64()),
+    ("apr_reward", pa.float64()),
+    ("apr_commission", pa.float64()),
+])
+
+
+def create_database(database):
+    """ Create the benchmark database unless it exists, the scratch table needs none of the migrations """
+    if database == os.getenv('POSTGRESQL_DB'):
+        raise ValueError(f"refusing to create tables in the dashboard database {database}")
+    admin = psycopg2.connect(**synthetic.connection_params("postgres"))
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (database,))
+        if cur.fetchone() is None:
+            cur.execute(f'CREATE DATABASE "{database}";')
+    admin.close()
+
+
+def create_history(sqlalchemy_engine, rows, tokens=20):
+    """ Fill the scratch table with `rows` holdings rows of `tokens` tokens at 5 minute resolution,
+    with the column types of defichain_holdings """
+    with sqlalchemy_engine.begin() as con:
+        con.exec_driver_sql(f"DROP TABLE IF EXISTS {TABLE};")
+        con.exec_driver_sql(f'''
+            CREATE TABLE {TABLE}
+            (
+                snapshot_id INTEGER,
+                token_id SMALLINT,
+                created_at TIMESTAMP WITH TIME ZONE,
+                amount NUMERIC,
+                tokenA_reserve NUMERIC,
+                tokenB_reserve NUMERIC,
+                total_liquidity_token NUMERIC,
+                apr_reward REAL,
+                apr_commission REAL,
+                owner_id SMALLINT NOT NULL
+            );
+        ''')
+        con.exec_driver_sql(f'''
+            INSERT INTO {TABLE} (snapshot_id, token_id, created_at, amount, tokenA_reserve, tokenB_reserve,
+                                 total_liquidity_token, apr_reward, apr_commission, owner_id)
+            SELECT s, t, now() - make_interval(mins => 5 * s), 10 + random() * 100,
+                   1e6 * (1 + random()), 5e5 * (1 + random()), 7e5, random() / 2, random() / 100, 1
+            FROM generate_series(1, %(snapshots)s) s, generate_series(1, %(tokens)s) t;
+        ''', {"snapshots": rows // tokens, "tokens": tokens})
+        con.exec_driver_sql(f"ANALYZE {TABLE};")
+
+
+def read_sql(sqlalchemy_engine):
+    """ pd.read_sql through SQLAlchemy, like the dashboard used to """
+    return pd.read_sql(SQL, con=sqlalchemy_engine)
+
+
+def read_fetchall(sqlalchemy_engine):
+    """ Plain cursor fetch of all rows into a DataFrame with explicit dtypes """
+    con = sqlalchemy_engine.raw_connection()
+    try:
+        cursor = con.cursor()
+        cursor.execute(SQL)
+        df = pd.DataFrame(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+        con.commit()
+    finally:
+        con.close()
+    df["created_at"] = pd.to_datetime(df["created_at"], utc=True)
+    return df.astype({column: dtype for column, dtype in DTYPES.items() if column != "created_at"})
+
+
+def read_copy(sqlalchemy_engine):
+    """ COPY TO STDOUT parsed by Arrow, the read path of the query layer for long results """
+    con = sqlalchemy_engine.raw_connection()
+    try:
+        df = export.copy_arrow(con.cursor(), SQL, SCHEMA).to_pandas()
+        con.commit()
+    finally:
+        con.close()
+    return df
+
+
+READ_PATHS = {
+    "pd.read_sql": read_sql,
+    "fetchall": read_fetchall,
+    "copy": read_copy,
+}
+
+
+def main():
+    """Compare the read paths on a synthetic holdings history"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database", default=f"{os.getenv('POSTGRESQL_DB')}_benchmark",
+                        help="database of the scratch table, never the dashboard database")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="number of synthetic holdings rows")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per read path, the fastest is reported")
+    parser.add_argument("--keep", action="store_true", help=f"keep the {TABLE} table afterwards")
+    args = parser.parse_args()
+
+    create_database(args.database)
+    connection_url = f"postgresql://{os.getenv('POSTGRESQL_USER')}:{os.getenv('POSTGRESQL_PW')}@{os.getenv('POSTGRESQL_IP')}/{args.database}"
+    sqlalchemy_engine = sqlalchemy.create_engine(connection_url)
+    create_history(sqlalchemy_engine, args.rows)
+    try:
+        baseline = None
+        for name, read_path in READ_PATHS.items():
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                df = read_path(sqlalchemy_engine)
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            baseline = baseline or best
+            print(f"{name:>12}: {len(df):,} rows in {best:.2f}s, {len(df) / best:,.0f} rows/s, "
+                  f"{baseline / best:.1f}x, {df.memory_usage(deep=True).sum() / 2 ** 20:.0f} MB")
+    finally:
+        if not args.keep:
+            with sqlalchemy_engine.begin() as con:
+                con.exec_driver_sql(f"DROP TABLE IF EXISTS {TABLE};")
+
+
+if __name__ == "__main__":
+    main()
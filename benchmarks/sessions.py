@@ -0,0 +1,178 @@
+"""Load test of many concurrent dashboard sessions on a synthetic database: every round appends a snapshot,
+waits until the dashboard can see it and reruns the dashboard script of all sessions at once. Reports
+the session latencies and the transactions and rows the database served per round. Use --root to run
+the dashboard of another checkout, e.g. a git worktree of an earlier commit, with the same load.
+
+Create the database first with: python synthetic.py --database <database>"""
+import argparse
+import ast
+import concurrent.futures
+import os
+import statistics
+import sys
+import threading
+import time
+import types
+
+import psycopg2
+from dotenv import load_dotenv
+
+# load environment variables
+load_dotenv()
+
+# PostgreSQL backends report their statistics when they exit and after at most this many idle seconds
+STATS_FLUSH = 11
+
+
+def connect(database):
+    """ Open a connection to the synthetic database """
+    return psycopg2.connect(user=os.getenv('POSTGRESQL_USER'), password=os.getenv('POSTGRESQL_PW'),
+                            host=os.getenv('POSTGRESQL_IP'), port="5432", database=database)
+
+
+def append_snapshot(con, current):
+    """ Append a snapshot that repeats the latest one at the current time, move the current state tables to
+    it and announce it like the collector does, current is the utils.current module. Returns the id of the
+    new snapshot """
+    with con.cursor() as cur:
+        cur.execute("SELECT max(id) FROM snapshots;")
+        previous = cur.fetchone()[0]
+        for table in ["defichain_holdings", "vault_amounts", "coin_prices"]:
+            cur.execute("SELECT create_monthly_partitions(%s, now(), now());", (table,))
+        cur.execute("INSERT INTO snapshots (created_at) VALUES (now()) RETURNING id, created_at;")
+        snapshot_id, created_at = cur.fetchone()
+        cur.execute('''
+            INSERT INTO defichain_holdings (snapshot_id, created_at, token_id, amount, tokenA_reserve,
+                                            tokenB_reserve, total_liquidity_token, apr_reward, apr_commission,
+                                            owner_id)
+            SELECT %(id)s, %(created_at)s, token_id, amount, tokenA_reserve, tokenB_reserve,
+                   total_liquidity_token, apr_reward, apr_commission, owner_id
+            FROM defichain_holdings WHERE snapshot_id = %(previous)s;
+
+            INSERT INTO vaults (vault_id, snapshot_id, created_at, collateral_ratio, collateral_value, loan_value,
+                                interest_value, owner_id)
+            SELECT vault_id, %(id)s, %(created_at)s, collateral_ratio, collateral_value, loan_value,
+                   interest_value, owner_id
+            FROM vaults WHERE snapshot_id = %(previous)s;
+
+            INSERT INTO vault_amounts (vault_id, snapshot_id, created_at, token_id, token_type, amount,
+                                       price_key_id, active_price, next_price, owner_id)
+            SELECT v.id, %(id)s, %(created_at)s, va.token_id, va.token_type, va.amount, va.price_key_id,
+                   va.active_price, va.next_price, va.owner_id
+            FROM vault_amounts va
+            INNER JOIN vaults v ON v.snapshot_id = %(id)s AND v.owner_id = va.owner_id
+            WHERE va.snapshot_id = %(previous)s;
+
+            INSERT INTO coin_prices (symbol, snapshot_id, created_at, pair, price)
+            SELECT symbol, %(id)s, %(created_at)s, pair, price
+            FROM coin_prices WHERE snapshot_id = %(previous)s;
+        ''', {"id": snapshot_id, "created_at": created_at, "previous": previous})
+        current.update_current_state(cur, types.SimpleNamespace(snapshot_id=snapshot_id, created_at=created_at),
+                                     list(current.CURRENT_TABLES))
+        # announce it on the channel of the collector, dashboards of checkouts that poll ignore it
+        cur.execute("SELECT pg_notify('snapshots', %s);", (str(snapshot_id),))
+    con.commit()
+    return snapshot_id
+
+
+def database_stats(database):
+    """ Get committed transactions and returned rows of a database so far, on a connection of its own
+    that reports its statistics when it is closed """
+    con = connect(database)
+    with con.cursor() as cur:
+        cur.execute("SELECT xact_commit, tup_returned + tup_fetched FROM pg_stat_database WHERE datname = %s;",
+                    (database,))
+        transactions, rows = cur.fetchone()
+    con.close()
+    return transactions, rows
+
+
+def patch_apptest():
+    """ Let the sessions of Streamlit's AppTest run concurrently: Python 3.11 fails on concurrent ast.parse
+    with "AST constructor recursion depth mismatch" and Streamlit parses the script of every session, and
+    every run sets up a mock runtime and the global.appTest option that it removes at its end while other
+    sessions still use them """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+
+    config.set_option("global.appTest", True)
+
+    lock = threading.Lock()
+    parse = ast.parse
+
+    def locked_parse(*args, **kwargs):
+        with lock:
+            return parse(*args, **kwargs)
+    ast.parse = locked_parse
+
+    instance = Runtime.instance
+    shared = []
+
+    def shared_instance():
+        if not shared:
+            shared.append(instance())
+        return shared[0]
+    Runtime.instance = staticmethod(shared_instance)
+
+
+def run_round(apps, workers):
+    """ Rerun the dashboard script of all sessions at once, returns the seconds of every run """
+    def run(app):
+        start = time.perf_counter()
+        app.run()
+        if app.exception or not app.title:
+            raise RuntimeError(f"dashboard failed: {app.exception[0].value if app.exception else 'no page'}")
+        return time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, apps))
+
+
+def main():
+    """Run rounds of concurrent dashboard sessions"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=f"{os.getenv('POSTGRESQL_DB')}_benchmark",
+                        help="synthetic database, never the dashboard database")
+    parser.add_argument("--root", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="checkout whose dashboard is tested, this one by default")
+    parser.add_argument("--sessions", type=int, default=50, help="concurrent dashboard sessions")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds after the cold first one")
+    parser.add_argument("--poll", type=float, default=2, help="DASHBOARD_SNAPSHOT_POLL of the dashboard")
+    args = parser.parse_args()
+    if args.database == os.getenv('POSTGRESQL_DB'):
+        raise ValueError(f"refusing to append snapshots to the dashboard database {args.database}")
+
+    # the dashboard reads its settings from the environment and imports utils from its checkout
+    os.environ.update({"POSTGRESQL_DB": args.database, "DASHBOARD_SNAPSHOT_POLL": str(args.poll)})
+    sys.path.insert(0, args.root)
+    from streamlit.testing.v1 import AppTest
+    from utils import current
+    patch_apptest()
+
+    script = os.path.join(args.root, "defichain_dashboard_streamlit.py")
+    apps = [AppTest.from_file(script, default_timeout=600) for _ in range(args.sessions)]
+
+    print(f"{args.sessions} sessions of {script}")
+    print(f"{'round':>6} {'wall':>9} {'p50':>9} {'p95':>9} {'max':>9} {'xacts':>7} {'rows':>10}")
+    time.sleep(STATS_FLUSH)
+    for round_number in range(args.rounds + 1):
+        # the rounds count the new snapshot and the stats connections too, the same for every checkout
+        transactions, rows = database_stats(args.database)
+        if round_number:
+            con = connect(args.database)
+            append_snapshot(con, current)
+            con.close()
+            # let the dashboard notice the new snapshot before the sessions rerun
+            time.sleep(args.poll + 1)
+        start = time.perf_counter()
+        timings = sorted(run_round(apps, args.sessions))
+        wall = time.perf_counter() - start
+        time.sleep(STATS_FLUSH)
+        transactions_after, rows_after = database_stats(args.database)
+        print(f"{'cold' if not round_number else round_number:>6} {wall:>8.2f}s "
+              f"{statistics.median(timings):>8.2f}s {timings[int(len(timings) * 0.95) - 1]:>8.2f}s "
+              f"{timings[-1]:>8.2f}s {transactions_after - transactions:>7} {rows_after - rows:>10}")
+
+
+if __name__ == "__main__":
+    main()
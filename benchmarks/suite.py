@@ -0,0 +1,254 @@
+"""End-to-end benchmark suite: generates a synthetic history and times every dashboard query, every
+transform stage of the dashboard on the query results, the dashboard script with cold and warm caches
+and the write path of the collector.
+The report is saved as JSON and can be compared with the report of an earlier commit"""
+import argparse
+import datetime as dt
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import sqlalchemy
+from dotenv import load_dotenv
+
+# sibling benchmark modules and the dashboard utils, whatever the working directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import synthetic  # noqa: E402
+from utils import datasets, history, portfolio, queries, store, timeseries  # noqa: E402
+
+# load environment variables
+load_dotenv()
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def best_of(repeat, function, *args):
+    """ Run function `repeat` times, returns seconds of the fastest run """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def query_params(sqlalchemy_engine):
+    """ Get the parameters the dashboard runs its named queries with on first load """
+    snapshot_range = queries.read(sqlalchemy_engine, "snapshot_range")
+    first = snapshot_range.first_created_at.iloc[0]
+    last = snapshot_range.last_created_at.iloc[0]
+    num_of_lp_tokens = max(int(queries.read(sqlalchemy_engine, "tokens").islps.sum()), 1)
+    apr_since = max(first, last - dt.timedelta(days=7))
+    apr_bucket = timeseries.bucket_seconds(apr_since, last, 2000 // num_of_lp_tokens)
+    history_bucket = timeseries.bucket_seconds(first, last, 500)
+    return {
+        "historical_amounts": {"bucket": history_bucket},
+        "historical_prices": {"bucket": history_bucket},
+        "rewards": {"bucket": apr_bucket, "since": apr_since.floor(f"{apr_bucket}s")},
+    }
+
+
+def bench_queries(sqlalchemy_engine, repeat):
+    """ Time every named query of the dashboard, the raw history queries at collector resolution too """
+    results = {}
+    params = query_params(sqlalchemy_engine)
+    for name in queries.QUERIES:
+        results[f"query/{name}"] = best_of(repeat, queries.read, sqlalchemy_engine, name, params.get(name))
+        if "history" in queries.QUERIES[name]:
+            raw = dict(params[name], bucket=timeseries.BUCKET_SIZES[0])
+            results[f"query/{name}@raw"] = best_of(repeat, queries.read, sqlalchemy_engine, name, raw)
+    return results
+
+
+def bench_history(sqlalchemy_engine, repeat):
+    """ Time a full read of the whole history queries against a refresh of their in-memory results, which
+    only reads the buckets from the last one on, and check that both give the same rows """
+    results = {}
+    params = query_params(sqlalchemy_engine)
+    snapshot_ids = itertools.count()
+
+    def read(name, query_params):
+        return queries.read(sqlalchemy_engine, name, query_params)
+
+    for name in ["historical_amounts", "historical_prices"]:
+        results[f"history/{name}/full"] = best_of(repeat, read, name, params[name])
+        state = history.History(name, params[name])
+        state.refresh(read, next(snapshot_ids))
+        results[f"history/{name}/refresh"] = best_of(repeat, lambda: state.refresh(read, next(snapshot_ids)))
+        full = read(name, params[name]).sort_values(["created_at", "symbol"]).reset_index(drop=True)
+        refreshed = state.df.sort_values(["created_at", "symbol"]).reset_index(drop=True)
+        # sums over the refreshed bucket may be added up in another order
+        pd.testing.assert_frame_equal(full, refreshed, check_exact=False, obj=f"refreshed {name}")
+    return results
+
+
+def bench_stages(sqlalchemy_engine, repeat):
+    """ Time every transform stage of the dashboard on its own: the valuations of the portfolio module
+    and the dataset functions, on query results that are read once beforehand """
+    results = {}
+    params = query_params(sqlalchemy_engine)
+    portfolio_params = {"portfolio": None}
+    # a store that stays at one snapshot, so every query is read once and served from memory after
+    data_store = store.SnapshotStore(lambda: 0, poll=float("inf"))
+    for name in queries.QUERIES:
+        data_store.register(name, lambda query_params, name=name: queries.read(sqlalchemy_engine, name, query_params))
+
+    df_vault = data_store.get("vault", portfolio_params)
+    results["stage/holdings_value"] = best_of(
+        repeat, portfolio.holdings_value, data_store.get("tokens", portfolio_params),
+        data_store.get("prices").set_index("symbol"),
+        df_vault[df_vault["token_type"] == "collateral"][["symbol", "amount"]])
+    results["stage/valuate_asof"] = best_of(
+        repeat, portfolio.valuate_asof, data_store.get("historical_amounts", dict(params["historical_amounts"],
+                                                                               **portfolio_params)),
+        data_store.get("historical_prices", params["historical_prices"]))
+
+    dataset_params = {
+        "vault_values": portfolio_params,
+        "holdings": portfolio_params,
+        "historical_holdings": dict(params["historical_amounts"], **portfolio_params),
+        "apr": dict(params["rewards"], **portfolio_params),
+    }
+    for name, function in datasets.DATASETS.items():
+        # the first run reads the queries of the dataset
+        function(data_store, dataset_params[name])
+        results[f"stage/dataset/{name}"] = best_of(repeat, function, data_store, dataset_params[name])
+    return results
+
+
+def bench_dashboard(repeat):
+    """ Time a run of the dashboard script with empty caches, and reruns that only transform and
+    render the cached query results """
+    from streamlit.testing.v1 import AppTest
+
+    results = {}
+    app = AppTest.from_file(os.path.join(ROOT, "defichain_dashboard_streamlit.py"), default_timeout=600)
+    start = time.perf_counter()
+    app.run()
+    results["dashboard/cold"] = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(f"dashboard failed: {app.exception[0].value}")
+    results["dashboard/warm"] = best_of(repeat, app.run)
+    return results
+
+
+def bench_collector(repeat, snapshots):
+    """ Time saving a snapshot with the holdings, vault amounts and prices of the synthetic tokens
+    for all synthetic addresses and vaults, and a rollup refresh afterwards """
+    import get_data
+    from classes import models
+
+    get_data.connect_database()
+    owners = get_data.get_owners()
+    get_data.cursor.execute("SELECT token_id, symbol, isLPS, isLoanToken FROM defichain_tokens;")
+    tokens = get_data.cursor.fetchall()
+    get_data.con.commit()
+
+    def save():
+        get_data.save_snapshot(
+            token_amounts=[models.TokenAmount(token_id, "10.12345678", "1000000.0", "2000000.0", 2, 0.5,
+                                              "1400000.0", 1e6, 0.3, 0.01, 1e5, 3e6, owner_id=owner_id)
+                           if is_lps else models.TokenAmount(token_id, "10.12345678", owner_id=owner_id)
+                           for owner_id, _ in owners["address"] for token_id, _, is_lps, _ in tokens],
+            vaults=[(models.VaultDetail(vault_id, 300, 3000, 1000, 1, owner_id=owner_id),
+                     [models.VaultAmount(None, "collateral", synthetic.DFI_ID, "100", "DFI/USD", "2.5", "2.6",
+                                         owner_id=owner_id)]
+                     + [models.VaultAmount(None, "loan", token_id, "10", f"{symbol}/USD", "2.0", "2.1",
+                                           owner_id=owner_id)
+                        for token_id, symbol, _, is_loan_token in tokens if is_loan_token])
+                    for owner_id, vault_id in owners["vault"]],
+            prices=[models.CoinPrice(symbol, f"{symbol}-USD", "2.0")
+                    for _, symbol, is_lps, _ in tokens if not is_lps],
+            owner_ids=[owner_id for owner_type in owners.values() for owner_id, _ in owner_type])
+
+    results = {"collector/save_snapshot": best_of(max(repeat, snapshots), save),
+               "collector/rollup": best_of(repeat, get_data.run_rollups)}
+    get_data.con.close()
+    return results
+
+
+def commit_id():
+    """ Get id of the checked out commit, None outside a git checkout """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """ Print the timings of a report next to those of a baseline report """
+    print(f"{'':40} {baseline['commit'] or 'baseline':>10} {report['commit'] or 'report':>10}")
+    for name, seconds in report["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:40} {'-':>10} {seconds:>9.3f}s")
+        else:
+            print(f"{name:40} {before:>9.3f}s {seconds:>9.3f}s {seconds / before:>6.2f}x")
+
+
+def main():
+    """Benchmark the dashboard and the collector on a synthetic history"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database", default=f"{os.getenv('POSTGRESQL_DB')}_benchmark",
+                        help="database to (re)create, never the dashboard database")
+    parser.add_argument("--tokens", type=int, default=10, help="number of tokens, DFI and DUSD included")
+    parser.add_argument("--lp-pairs", type=int, default=5, help="number of liquidity pool pairs with DFI")
+    parser.add_argument("--addresses", type=int, default=1, help="number of addresses")
+    parser.add_argument("--vaults", type=int, default=1, help="number of vaults")
+    parser.add_argument("--portfolios", type=int, default=1, help="number of portfolios")
+    parser.add_argument("--days", type=int, default=90, help="days of history at 5 minute resolution")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the fastest is reported")
+    parser.add_argument("--snapshots", type=int, default=20, help="snapshots saved to time the collector")
+    parser.add_argument("--skip-dashboard", action="store_true", help="do not time the dashboard script")
+    parser.add_argument("--output", help="path of the JSON report, default benchmark-<commit>.json")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare with")
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key)
+              for key in ["tokens", "lp_pairs", "addresses", "vaults", "portfolios", "days", "repeat"]}
+    results = {}
+    start = time.perf_counter()
+    con = synthetic.create_database(args.database)
+    synthetic.generate(con, args.tokens, args.lp_pairs, args.vaults, args.days,
+                       addresses=args.addresses, portfolios=args.portfolios)
+    con.close()
+    results["generate"] = time.perf_counter() - start
+
+    # the dashboard and the collector read the database from the environment
+    os.environ["POSTGRESQL_DB"] = args.database
+    connection_url = f"postgresql://{os.getenv('POSTGRESQL_USER')}:{os.getenv('POSTGRESQL_PW')}@{os.getenv('POSTGRESQL_IP')}/{args.database}"
+    sqlalchemy_engine = sqlalchemy.create_engine(connection_url)
+    results.update(bench_queries(sqlalchemy_engine, args.repeat))
+    results.update(bench_history(sqlalchemy_engine, args.repeat))
+    results.update(bench_stages(sqlalchemy_engine, args.repeat))
+    sqlalchemy_engine.dispose()
+    if not args.skip_dashboard:
+        results.update(bench_dashboard(args.repeat))
+    results.update(bench_collector(args.repeat, args.snapshots))
+
+    report = {"commit": commit_id(), "created_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+              "config": config, "results": results}
+    output = args.output or f"benchmark-{report['commit'] or 'local'}.json"
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline["config"] != config:
+            print(f"Warning: baseline was run with {baseline['config']}")
+        compare(report, baseline)
+    else:
+        for name, seconds in results.items():
+            print(f"{name:40} {seconds:>9.3f}s")
+    print(f"Report saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Synthetic history generator: fills a database with the schema of the migrations with tokens,
+liquidity pool pairs, addresses, vaults and snapshots at 5 minute resolution"""
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from classes import models  # noqa: E402
+from utils import current, migrations, partitions, rollup  # noqa: E402
+
+# load environment variables
+load_dotenv()
+
+# token ids the dashboard and the collector treat specially
+DFI_ID = 0
+DUSD_ID = 15
+# liquidity pool tokens get ids from here on
+LP_FIRST_ID = 100
+
+
+def connection_params(database):
+    """ Get connection parameters of a database on the PostgreSQL server of the environment """
+    return {
+        "user": os.getenv('POSTGRESQL_USER'),
+        "password": os.getenv('POSTGRESQL_PW'),
+        "host": os.getenv('POSTGRESQL_IP'),
+        "port": "5432",
+        "database": database,
+    }
+
+
+def create_database(database):
+    """ Drop and create a database and apply all migrations, returns an open connection to it """
+    if database == os.getenv('POSTGRESQL_DB'):
+        raise ValueError(f"refusing to overwrite the dashboard database {database}")
+    admin = psycopg2.connect(**connection_params("postgres"))
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{database}";')
+        cur.execute(f'CREATE DATABASE "{database}";')
+    admin.close()
+    con = psycopg2.connect(**connection_params(database))
+    migrations.migrate(con)
+    return con
+
+
+def generate(con, tokens=10, lp_pairs=5, vaults=1, days=30, interval=300, addresses=1, portfolios=1):
+    """ Fill the history of `days` days with a snapshot every `interval` seconds: holdings of `tokens`
+    tokens and `lp_pairs` liquidity pool tokens in each of `addresses` addresses, `vaults` vaults with
+    collateral and loans and prices of all tokens. Addresses and vaults are spread over `portfolios`
+    portfolios. Returns the number of snapshots """
+    cur = con.cursor()
+    # DFI, DUSD and tokens - 2 other tokens, every liquidity pool pairs one of them with DFI
+    others = [token_id for token_id in range(1, tokens + 1) if token_id not in (DFI_ID, DUSD_ID)][:tokens - 2]
+    cur.execute('''
+        INSERT INTO defichain_tokens (token_id, symbol, name, isDAT, isLPS, isLoanToken)
+        VALUES (%s, 'DFI', 'Default Defi token', TRUE, FALSE, FALSE),
+               (%s, 'DUSD', 'Decentralized USD', TRUE, FALSE, TRUE);
+    ''', (DFI_ID, DUSD_ID))
+    for token_id in others:
+        cur.execute('''
+            INSERT INTO defichain_tokens (token_id, symbol, name, isDAT, isLPS, isLoanToken)
+            VALUES (%s, %s, %s, TRUE, FALSE, %s);
+        ''', (token_id, f"T{token_id}", f"Token {token_id}", token_id % 2 == 0))
+    pairs = ([DUSD_ID] + others)[:lp_pairs]
+    for i, token_a_id in enumerate(pairs):
+        cur.execute('''
+            INSERT INTO defichain_tokens (token_id, symbol, name, isDAT, isLPS, isLoanToken, tokenA_id, tokenB_id)
+            SELECT %s, symbol || '-DFI', name || '-Default Defi token', TRUE, TRUE, FALSE, token_id, %s
+            FROM defichain_tokens WHERE token_id = %s;
+        ''', (LP_FIRST_ID + i, DFI_ID, token_a_id))
+    cur.execute('''
+        INSERT INTO price_keys (price_key)
+        SELECT symbol || '/USD' FROM defichain_tokens WHERE NOT isLPS ORDER BY token_id;
+    ''')
+    cur.execute('''
+        INSERT INTO owners (owner_type, owner_key, portfolio)
+        SELECT 'address', 'address' || a, 'portfolio' || (a - 1) %% %(portfolios)s + 1
+        FROM generate_series(1, %(addresses)s) a;
+        INSERT INTO owners (owner_type, owner_key, portfolio)
+        SELECT 'vault', 'vault' || v, 'portfolio' || (v - 1) %% %(portfolios)s + 1
+        FROM generate_series(1, %(vaults)s) v;
+    ''', {"addresses": addresses, "vaults": vaults, "portfolios": portfolios})
+
+    for table in partitions.PARTITIONED_TABLES:
+        cur.execute("SELECT create_monthly_partitions(%s, now() - make_interval(days => %s), now());",
+                    (table, days))
+    cur.execute('''
+        INSERT INTO snapshots (created_at)
+        SELECT g FROM generate_series(now() - make_interval(days => %s), now(), make_interval(secs => %s)) g;
+    ''', (days, interval))
+    # every value follows a slow sine wave with some noise, so charts and rollups have something to show
+    cur.execute('''
+        INSERT INTO defichain_holdings (snapshot_id, token_id, created_at, amount, tokenA_reserve,
+                                        tokenB_reserve, total_liquidity_token, apr_reward, apr_commission,
+                                        owner_id)
+        SELECT s.id, t.token_id, s.created_at,
+               round((10 + sin(s.id / 500.0 + t.token_id + o.id) + random() / 10)::numeric, 8),
+               CASE WHEN t.isLPS THEN round((1e6 * (1.5 + sin(s.id / 800.0)))::numeric, 8) END,
+               CASE WHEN t.isLPS THEN round((2e6 * (1.5 + cos(s.id / 800.0)))::numeric, 8) END,
+               CASE WHEN t.isLPS THEN 1.4e6 END,
+               CASE WHEN t.isLPS THEN 0.3 + sin(s.id / 300.0 + t.token_id) / 10 END,
+               CASE WHEN t.isLPS THEN 0.01 + random() / 1000 END,
+               o.id
+        FROM snapshots s CROSS JOIN defichain_tokens t CROSS JOIN owners o
+        WHERE o.owner_type = 'address';
+    ''')
+    cur.execute('''
+        INSERT INTO vaults (vault_id, snapshot_id, created_at, collateral_ratio, collateral_value, loan_value,
+                            interest_value, owner_id)
+        SELECT o.owner_key, s.id, s.created_at, 300 + 50 * sin(s.id / 400.0 + o.id), 3000, 1000, 1, o.id
+        FROM snapshots s CROSS JOIN owners o
+        WHERE o.owner_type = 'vault'
+        ORDER BY s.id, o.id;
+    ''')
+    # every vault has DFI and DUSD as collateral and a loan of DUSD and of every loan token
+    cur.execute('''
+        INSERT INTO vault_amounts (vault_id, snapshot_id, created_at, token_id, token_type, amount,
+                                   price_key_id, active_price, next_price, owner_id)
+        SELECT v.id, v.snapshot_id, v.created_at, t.token_id, c.token_type, 100 + t.token_id,
+               p.id,
+               CASE WHEN t.token_id = %s THEN 1 ELSE round((2 + sin(v.snapshot_id / 200.0 + t.token_id))::numeric, 8) END,
+               CASE WHEN t.token_id = %s THEN 1
+                    ELSE round((2 + sin((v.snapshot_id + 12) / 200.0 + t.token_id))::numeric, 8) END,
+               v.owner_id
+        FROM vaults v
+        CROSS JOIN (VALUES ('collateral'::vault_token_type), ('loan'::vault_token_type)) c (token_type)
+        INNER JOIN defichain_tokens t ON CASE WHEN c.token_type = 'collateral' THEN t.token_id IN (%s, %s)
+                                              ELSE t.isLoanToken END
+        INNER JOIN price_keys p ON p.price_key = t.symbol || '/USD';
+    ''', (DUSD_ID, DUSD_ID, DFI_ID, DUSD_ID))
+    cur.execute('''
+        INSERT INTO coin_prices (symbol, snapshot_id, created_at, pair, price)
+        SELECT t.symbol, s.id, s.created_at, t.symbol || '-USD',
+               CASE WHEN t.token_id = %s THEN 1 ELSE round((2 + sin(s.id / 200.0 + t.token_id))::numeric, 8) END
+        FROM snapshots s CROSS JOIN defichain_tokens t
+        WHERE NOT t.isLPS;
+    ''', (DUSD_ID,))
+
+    rollup.refresh_rollups(cur)
+    cur.execute("SELECT id, created_at FROM snapshots ORDER BY id DESC LIMIT 1;")
+    snapshot_id, created_at = cur.fetchone()
+    current.update_current_state(cur, models.Snapshot(created_at, snapshot_id), list(current.CURRENT_TABLES))
+    con.commit()
+    cur.execute("ANALYZE;")
+    cur.close()
+    return snapshot_id
+
+
+def main():
+    """Create a database with a synthetic DeFiChain history"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database", default=f"{os.getenv('POSTGRESQL_DB')}_benchmark",
+                        help="database to (re)create, never the dashboard database")
+    parser.add_argument("--tokens", type=int, default=10, help="number of tokens, DFI and DUSD included")
+    parser.add_argument("--lp-pairs", type=int, default=5, help="number of liquidity pool pairs with DFI")
+    parser.add_argument("--addresses", type=int, default=1, help="number of addresses")
+    parser.add_argument("--vaults", type=int, default=1, help="number of vaults")
+    parser.add_argument("--portfolios", type=int, default=1, help="number of portfolios")
+    parser.add_argument("--days", type=int, default=30, help="days of history at 5 minute resolution")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    con = create_database(args.database)
+    snapshots = generate(con, args.tokens, args.lp_pairs, args.vaults, args.days,
+                         addresses=args.addresses, portfolios=args.portfolios)
+    con.close()
+    print(f"Generated {snapshots:,} snapshots in {args.database} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Benchmark of the portfolio valuation on a synthetic in-memory history: the pandas pipeline the dashboard
+used before (split, groupby, concat, merge and astype) against the NumPy engine of utils.portfolio,
+for a single snapshot and for time-indexed batches of growing length, and the as-of join of the
+engine that values a history with the prices of the time against pandas merge_asof and a plain merge
+on symbol that filters the cartesian product"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import portfolio  # noqa: E402
+
+
+def create_history(snapshots, tokens=10, lp_pairs=5, addresses=1, vaults=1, seed=0):
+    """ Get holdings rows shaped like the tokens query and collateral rows for `snapshots` snapshots at
+    5 minute resolution, and the prices of the plain tokens """
+    rng = np.random.default_rng(seed)
+    plain = ["DFI", "DUSD"] + [f"T{i}" for i in range(1, tokens - 1)]
+    lps = [f"{symbol}-DFI" for symbol in plain[1:lp_pairs + 1]]
+    symbols = np.array(plain + lps, dtype=object)
+    is_lps = np.array([False] * len(plain) + [True] * len(lps))
+    tokena = np.array([None] * len(plain) + plain[1:lp_pairs + 1], dtype=object)
+    tokenb = np.array([None] * len(plain) + ["DFI"] * len(lps), dtype=object)
+    created_at = pd.date_range("2022-01-01", periods=snapshots, freq="5min", tz="UTC")
+
+    per_snapshot = len(symbols) * addresses
+    rows = snapshots * per_snapshot
+    token_index = np.tile(np.arange(len(symbols)), snapshots * addresses)
+    lp_rows = is_lps[token_index]
+    holdings = pd.DataFrame({
+        "created_at": created_at.repeat(per_snapshot),
+        "token_symbol": pd.array(symbols[token_index], dtype="string"),
+        "islps": lp_rows,
+        "amount": rng.uniform(1, 100, rows),
+        "tokena_symbol": pd.array(tokena[token_index], dtype="string"),
+        "tokenb_symbol": pd.array(tokenb[token_index], dtype="string"),
+        "tokena_reserve": np.where(lp_rows, rng.uniform(1e6, 2e6, rows), np.nan),
+        "tokenb_reserve": np.where(lp_rows, rng.uniform(5e5, 1e6, rows), np.nan),
+        "total_liquidity_token": np.where(lp_rows, 7e5, np.nan),
+    })
+    collateral = pd.DataFrame({
+        "created_at": created_at.repeat(vaults),
+        "symbol": pd.array(["DFI"] * snapshots * vaults, dtype="string"),
+        "amount": rng.uniform(100, 1000, snapshots * vaults),
+    })
+    prices = pd.DataFrame({"symbol": pd.array(plain, dtype="string"),
+                           "pair": pd.array([f"{symbol}-USD" for symbol in plain], dtype="string"),
+                           "price": rng.uniform(0.5, 3, len(plain))}).set_index("symbol")
+    return holdings, collateral, prices
+
+
+def pandas_pipeline(tokens, collateral, prices, time_column=None):
+    """ Value holdings the way the dashboard did inline before the portfolio module """
+    keys = [time_column] if time_column else []
+    tokens = tokens.copy()
+    tokens["tokena_amount"] = (tokens["amount"] / tokens["total_liquidity_token"]) * tokens["tokena_reserve"]
+    tokens["tokenb_amount"] = (tokens["amount"] / tokens["total_liquidity_token"]) * tokens["tokenb_reserve"]
+    df_tokena = tokens[keys + ["tokena_symbol", "tokena_amount"]].groupby(keys + ["tokena_symbol"]).sum(
+    ).reset_index().rename(columns={"tokena_symbol": "symbol", "tokena_amount": "amount"})
+    df_tokenb = tokens[keys + ["tokenb_symbol", "tokenb_amount"]].groupby(keys + ["tokenb_symbol"]).sum(
+    ).reset_index().rename(columns={"tokenb_symbol": "symbol", "tokenb_amount": "amount"})
+    df_token_wallet = tokens[tokens["islps"] == False][keys + [  # noqa: E712
+        "token_symbol", "amount"]].rename(columns={"token_symbol": "symbol"})
+    df_token_all = pd.concat([df_tokena, df_tokenb, df_token_wallet, collateral]).groupby(
+        keys + ["symbol"]).sum().reset_index().set_index("symbol")
+    df = pd.merge(df_token_all, prices, left_index=True, right_index=True)[keys + ["amount", "pair", "price"]]
+    df.reset_index(inplace=True)
+    df = df.astype({"price": "float64", "amount": "float64"})
+    df["value"] = df["amount"] * df["price"]
+    return df
+
+
+def numpy_engine(tokens, collateral, prices, time_column=None):
+    """ Value holdings with the portfolio module """
+    return portfolio.holdings_value(tokens, prices, collateral, time_column)
+
+
+def create_price_history(snapshots, symbols=10, missing=0.1, seed=0):
+    """ Get an exposure history of `symbols` symbols for `snapshots` snapshots at 5 minute resolution and
+    a price history of the same symbols collected a minute later, with a share of the prices missing """
+    rng = np.random.default_rng(seed)
+    created_at = pd.date_range("2022-01-01", periods=snapshots, freq="5min", tz="UTC").repeat(symbols)
+    symbol = pd.array([f"T{i}" for i in range(symbols)] * snapshots, dtype="string")
+    exposure = pd.DataFrame({"created_at": created_at, "symbol": symbol,
+                             "amount": rng.uniform(1, 100, len(symbol))})
+    prices = pd.DataFrame({"created_at": created_at + pd.Timedelta(minutes=1), "symbol": symbol,
+                           "price": rng.uniform(0.5, 3, len(symbol))})
+    # ordered by symbol and time like the historical prices query
+    prices = prices[rng.random(len(prices)) >= missing].sort_values(["symbol", "created_at"])
+    return exposure, prices.reset_index(drop=True)
+
+
+def merge_asof(exposure, prices):
+    """ Value a history with the prices of the time with pandas merge_asof """
+    df = pd.merge_asof(exposure.sort_values("created_at"), prices.sort_values("created_at"),
+                       on="created_at", by="symbol").dropna(subset=["price"])
+    df["value"] = df["amount"] * df["price"]
+    return df
+
+
+def merge_filter(exposure, prices):
+    """ Value a history with the prices of the time by pairing every row with every price of its symbol """
+    df = pd.merge(exposure, prices.rename(columns={"created_at": "price_created_at"}), on="symbol")
+    df = df[df["price_created_at"] <= df["created_at"]]
+    df = df.loc[df.groupby(["created_at", "symbol"])["price_created_at"].idxmax()]
+    df["value"] = df["amount"] * df["price"]
+    return df
+
+
+def best_of(repeat, function, *args):
+    """ Run function `repeat` times, returns seconds of the fastest run and its result """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def check(expected, actual, keys):
+    """ Raise if both pipelines do not value the same symbols at the same amounts """
+    expected = expected.sort_values(keys).reset_index(drop=True)
+    actual = actual.sort_values(keys).reset_index(drop=True)
+    if len(expected) != len(actual) or not np.allclose(expected["value"], actual["value"]):
+        raise RuntimeError("pandas pipeline and NumPy engine disagree")
+
+
+def main():
+    """Benchmark the portfolio valuation of the pandas pipeline and the NumPy engine"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--snapshots", type=int, nargs="+", default=[1, 2016, 8640, 25920],
+                        help="history lengths to time, 1 is a single snapshot, 8640 are 30 days")
+    parser.add_argument("--tokens", type=int, default=10, help="number of tokens, DFI and DUSD included")
+    parser.add_argument("--lp-pairs", type=int, default=5, help="number of liquidity pool pairs with DFI")
+    parser.add_argument("--addresses", type=int, default=1, help="number of addresses")
+    parser.add_argument("--vaults", type=int, default=1, help="number of vaults")
+    parser.add_argument("--asof-snapshots", type=int, nargs="+", default=[288, 2016, 8640, 25920],
+                        help="history lengths to time the as-of join with, 25920 are 90 days")
+    parser.add_argument("--filter-limit", type=int, default=2016,
+                        help="longest history to time the merge that filters the cartesian product with")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the fastest is reported")
+    args = parser.parse_args()
+
+    print(f"{'snapshots':>10} {'rows':>10} {'pandas':>10} {'numpy':>10} {'speedup':>8}")
+    for snapshots in args.snapshots:
+        tokens, collateral, prices = create_history(snapshots, args.tokens, args.lp_pairs,
+                                                    args.addresses, args.vaults)
+        # a single snapshot is valued like the current holdings, without time column
+        time_column = "created_at" if snapshots > 1 else None
+        if time_column is None:
+            tokens, collateral = tokens.drop(columns="created_at"), collateral.drop(columns="created_at")
+        pandas_seconds, expected = best_of(args.repeat, pandas_pipeline, tokens, collateral, prices, time_column)
+        numpy_seconds, actual = best_of(args.repeat, numpy_engine, tokens, collateral, prices, time_column)
+        check(expected, actual, ([time_column] if time_column else []) + ["symbol"])
+        print(f"{snapshots:>10} {len(tokens) + len(collateral):>10} {pandas_seconds:>9.4f}s "
+              f"{numpy_seconds:>9.4f}s {pandas_seconds / numpy_seconds:>7.1f}x")
+
+    print(f"\n{'snapshots':>10} {'rows':>10} {'filter':>10} {'merge_asof':>10} {'numpy':>10}")
+    for snapshots in args.asof_snapshots:
+        exposure, prices = create_price_history(snapshots, args.tokens)
+        numpy_seconds, actual = best_of(args.repeat, portfolio.valuate_asof, exposure, prices)
+        asof_seconds, expected = best_of(args.repeat, merge_asof, exposure, prices)
+        check(expected, actual, ["created_at", "symbol"])
+        timings = [asof_seconds, numpy_seconds]
+        if snapshots <= args.filter_limit:
+            filter_seconds, expected = best_of(args.repeat, merge_filter, exposure, prices)
+            check(expected, actual, ["created_at", "symbol"])
+            timings.insert(0, filter_seconds)
+        else:
+            timings.insert(0, None)
+        print(f"{snapshots:>10} {len(exposure):>10} "
+              + " ".join(f"{seconds:>9.4f}s" if seconds is not None else f"{'-':>10}" for seconds in timings))
+
+
+if __name__ == "__main__":
+    main()
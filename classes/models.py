@@ -1,6 +1,23 @@
 """Classes that hold all data from Ocean API"""
 
 
+class Snapshot():
+    """ Snapshot object shared by all rows saved in one collector run """
+
+    def __init__(self, created_at, snapshot_id=None):
+        self.snapshot_id = snapshot_id
+        self.created_at = created_at
+
+    def stamp(self, row):
+        """ Set snapshot id and timestamp of a row object """
+        row.snapshot_id = self.snapshot_id
+        row.created_at = self.created_at
+        return row
+
+    def __str__(self):
+        return f"[Snapshot] {self.snapshot_id} created at {self.created_at}"
+
+
 class TokenDetail():
     """ Token Details object to save API call info """
 
@@ -38,7 +55,8 @@ class TokenAmount():
     def __init__(self, token_id=None, amount=None,  token_a_reserve=None, token_b_reserve=None,
                  priceratio_ab=None, priceratio_ba=None, total_liquidity_token=None,
                  total_liquidity_usd=None, apr_reward=None, apr_commission=None, volume_h24=None,
-                 volume_d30=None, created_at=None):
+                 volume_d30=None, created_at=None, snapshot_id=None, owner_id=None):
+        self.snapshot_id = snapshot_id
         self.created_at = created_at
         self.token_id = token_id
         self.amount = amount
@@ -52,8 +70,11 @@ class TokenAmount():
         self.apr_commission = apr_commission
         self.volume_h24 = volume_h24
         self.volume_d30 = volume_d30
+        # address the tokens are held by
+        self.owner_id = owner_id
 
     def __iter__(self):
+        yield self.snapshot_id
         yield self.created_at
         yield self.token_id
         yield self.amount
@@ -67,6 +88,7 @@ class TokenAmount():
         yield self.apr_commission
         yield self.volume_h24
         yield self.volume_d30
+        yield self.owner_id
 
     def __str__(self):
         return f"[TokenAmount] Token id {self.token_id} with amount {self.amount}"
@@ -76,22 +98,26 @@ class VaultDetail():
     """ Vault Details object to save API call info """
 
     def __init__(self, vault_id, colleteral_ratio, collateral_value, loan_value,
-                 interest_value, created_at=None):
+                 interest_value, created_at=None, snapshot_id=None, owner_id=None):
         self.vault_id = vault_id
+        self.snapshot_id = snapshot_id
         self.created_at = created_at
         self.colleteral_ratio = colleteral_ratio
         self.collateral_value = collateral_value
         self.loan_value = loan_value
         self.interest_value = interest_value
+        self.owner_id = owner_id
 
     def __iter__(self):
         """ Creating an iterator to convert object attributes to tuple """
         yield self.vault_id
+        yield self.snapshot_id
         yield self.created_at
         yield self.colleteral_ratio
         yield self.collateral_value
         yield self.loan_value
         yield self.interest_value
+        yield self.owner_id
 
     def __str__(self):
         return f"[VaultDetail] {self.vault_id} with colleteral ratio {self.colleteral_ratio} and collateral value {self.collateral_value}"
@@ -101,8 +127,9 @@ class VaultAmount():
     """ Vault Amounts object to save API call info """
 
     def __init__(self, vault_id, token_type, token_id, amount,
-                 price_key, active_price, next_price, created_at=None):
+                 price_key, active_price, next_price, created_at=None, snapshot_id=None, owner_id=None):
         self.vault_id = vault_id
+        self.snapshot_id = snapshot_id
         self.created_at = created_at
         self.token_type = token_type
         self.token_id = token_id
@@ -110,10 +137,12 @@ class VaultAmount():
         self.price_key = price_key
         self.active_price = active_price
         self.next_price = next_price
+        self.owner_id = owner_id
 
     def __iter__(self):
         """ Creating an iterator to convert object attributes to tuple """
         yield self.vault_id
+        yield self.snapshot_id
         yield self.created_at
         yield self.token_type
         yield self.token_id
@@ -121,6 +150,29 @@ class VaultAmount():
         yield self.price_key
         yield self.active_price
         yield self.next_price
+        yield self.owner_id
 
     def __str__(self):
         return f"[VaultAmount] {self.token_id} with amount {self.amount}"
+
+
+class CoinPrice():
+    """ Coin Price object to save API call info """
+
+    def __init__(self, symbol, pair, price, created_at=None, snapshot_id=None):
+        self.symbol = symbol
+        self.snapshot_id = snapshot_id
+        self.created_at = created_at
+        self.pair = pair
+        self.price = price
+
+    def __iter__(self):
+        """ Creating an iterator to convert object attributes to tuple """
+        yield self.symbol
+        yield self.snapshot_id
+        yield self.created_at
+        yield self.pair
+        yield self.price
+
+    def __str__(self):
+        return f"[CoinPrice] {self.symbol} with price {self.price}"
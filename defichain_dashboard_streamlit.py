@@ -1,17 +1,13 @@
 """Streamlit app showcasing a DeFiChain Portfolio Dashboard powered by a PostgreSQL Database"""
 import os
-import time
-from datetime import datetime, timedelta
-import json
+import threading
+from datetime import timedelta
 import pandas as pd
-import pytz
-import requests
 import streamlit as st
 import sqlalchemy
 
-from streamlit_autorefresh import st_autorefresh
 from dotenv import load_dotenv
-from utils import chart
+from utils import chart, datasets, history, postgresql, queries, store, timeseries
 
 # load environment variables
 load_dotenv()
@@ -20,9 +16,6 @@ load_dotenv()
 st.set_page_config(layout="centered", page_icon="↗️",
                    page_title="DefiChain Dashboard")
 
-# update dashboard every 10 mins
-st_autorefresh(interval=10 * 60 * 1000, key="dataframerefresh")
-
 # function to create space between elements
 
 
@@ -32,157 +25,145 @@ def space(num_lines=1):
         st.write("")
 
 
-@st.cache(allow_output_mutation=True)
+@st.cache_resource
 def connect_engine(url):
     """Initiate sqlalchemy engine"""
     sqlalchemy_engine = sqlalchemy.create_engine(url)
     return sqlalchemy_engine
 
 
-# @st.cache(hash_funcs={sqlalchemy.engine.base.Engine: id})
-def get_data(sql, sqlalchemy_engine):
-    """Get data from PostgreSQL database server"""
-    df = pd.read_sql(sql, con=sqlalchemy_engine)
-    return df
+# seconds between checks for a new snapshot when the collector announced none, e.g. while the listening
+# connection is reopened
+SNAPSHOT_POLL = float(os.getenv('DASHBOARD_SNAPSHOT_POLL', '60'))
+# seconds between checks of every open page for a newer snapshot than it shows, without database queries
+RERUN_CHECK = float(os.getenv('DASHBOARD_RERUN_CHECK', '5'))
+# directory of the Parquet history export of the collector, history charts are read from it when set
+HISTORY_CACHE = os.getenv('DASHBOARD_HISTORY_CACHE')
+# datasets kept in the shared store, one per dataset and parameters
+STORE_MAX_ENTRIES = int(os.getenv('DASHBOARD_STORE_MAX_ENTRIES', '256'))
+# whole history results kept in memory, one per query, portfolio and bucket size
+HISTORY_STATES = int(os.getenv('DASHBOARD_HISTORY_STATES', '32'))
+
+
+def read_data(name, params, sqlalchemy_engine):
+    """Get data of a named query from PostgreSQL database server, or of a history query from the Parquet export"""
+    if HISTORY_CACHE and "history" in queries.QUERIES[name]:
+        return queries.read_cache(HISTORY_CACHE, name, params)
+    return queries.read(sqlalchemy_engine, name, params)
+
+
+@st.cache_resource
+def get_store(_sqlalchemy_engine):
+    """Get the data store shared by all sessions of the server, its refresher thread listens for the
+    snapshots the collector commits and computes their datasets once for all sessions"""
+    def connect_listener():
+        # a connection of its own outside the pool, it stays open to receive notifications
+        cargs, cparams = _sqlalchemy_engine.dialect.create_connect_args(_sqlalchemy_engine.url)
+        return _sqlalchemy_engine.dialect.connect(*cargs, **cparams)
+
+    listener = postgresql.Listener(connect_listener, postgresql.SNAPSHOT_CHANNEL)
+
+    def wait_snapshot(timeout):
+        payloads = listener.wait(timeout)
+        return max(int(payload) for payload in payloads) if payloads else None
+
+    data_store = store.SnapshotStore(
+        lambda: queries.read(_sqlalchemy_engine, "latest_snapshot_id").id.iloc[0], SNAPSHOT_POLL, STORE_MAX_ENTRIES,
+        wait_snapshot)
+
+    def read(name, params):
+        return read_data(name, params, _sqlalchemy_engine)
+
+    # whole history results stay in memory, a new snapshot only reads the buckets it changed
+    histories = {}
+    histories_lock = threading.Lock()
+
+    def read_history(name, params):
+        key = (name, tuple(sorted(params.items())))
+        with histories_lock:
+            if key not in histories:
+                # the oldest result is dropped, e.g. of a bucket size the snapshot range grew out of
+                if len(histories) >= HISTORY_STATES:
+                    del histories[next(iter(histories))]
+                histories[key] = history.History(name, params)
+            state = histories[key]
+        return state.refresh(read, data_store.current_snapshot_id())
+
+    for name, query in queries.QUERIES.items():
+        reader = read_history if "since" in query.get("defaults", {}) else read
+        data_store.register(name, lambda params, name=name, reader=reader: reader(name, params))
+    for name, function in datasets.DATASETS.items():
+        data_store.register(name, lambda params, function=function: function(data_store, params))
+    data_store.start()
+    return data_store
 
 
 connection_url = f"postgresql://{os.getenv('POSTGRESQL_USER')}:{os.getenv('POSTGRESQL_PW')}@{os.getenv('POSTGRESQL_IP')}/{os.getenv('POSTGRESQL_DB')}"
 engine = connect_engine(connection_url)
+data_store = get_store(engine)
+
+
+def get_data(name, params=None):
+    """Get a dataset at the latest snapshot from the shared store, the result must not be modified"""
+    return data_store.get(name, params)
+
+
+@st.fragment(run_every=RERUN_CHECK)
+def rerun_on_new_snapshot():
+    """Rerun the page once the store has the datasets of a newer snapshot than the page shows"""
+    if data_store.ready_snapshot_id != st.session_state.get("snapshot_id"):
+        st.rerun()
+
 
-# get pool_prices from ocean api
-poolprices_url = "https://ocean.defichain.com/v0/mainnet/prices"
-
-# paginate over all prices in ocean api
-# dict to store results
-all_pool_prices = []
-# get first page
-while True:
-    pool_prices_page_1 = requests.get(poolprices_url, timeout=10)
-    if pool_prices_page_1.status_code == 200:
-        pool_prices = json.loads(pool_prices_page_1.text)
-        break
-    time.sleep(1)
-
-# get rest of pages, while loop will run as long as we have a next page in the dict
-_run = True
-while _run:
-    # merge dicts
-    all_pool_prices.append(pd.json_normalize(pool_prices["data"]))
-    if "page" in pool_prices:
-        while True:
-            pool_prices_page_n = requests.get(
-                f"{poolprices_url}?next={pool_prices['page']['next']}", timeout=10)
-            if pool_prices_page_n.status_code == 200:
-                pool_prices = json.loads(pool_prices_page_n.text)
-                break
-            time.sleep(1)
-    else:
-        _run = False
-# concatenate all df's
-df_prices = pd.concat(all_pool_prices, ignore_index=True)
-df_prices.set_index("price.token", inplace=True)
-df_prices = df_prices[['id', 'price.aggregated.amount']]
-df_prices.loc['DUSD'] = ['DUSD-USD', '1.000000']
+# the page shows the snapshot the store is ready with, it reruns by itself after the next one
+st.session_state["snapshot_id"] = data_store.ready_snapshot_id
+rerun_on_new_snapshot()
 
 st.title("DefiChain Dashboard")
-# query to get vault token amounts
-sql_vault = """
-    with vault_CTE (id, collateral_ratio, collateral_value, loan_value)
-    as
-    (
-        select id, collateral_ratio, collateral_value, loan_value
-        from vaults
-        order by created_at desc limit 1
-    )
-    select id, vault_amounts.token_id, name, symbol, token_type, amount, active_price, next_price
-    from vault_CTE
-    inner join vault_amounts on vault_CTE.id = vault_amounts.vault_id
-    inner join defichain_tokens on vault_amounts.token_id=defichain_tokens.token_id;
-    """
-df_vault = get_data(sql_vault, engine)
-# create active and next value columns
-df_vault["active_value"] = df_vault["amount"] * df_vault["active_price"]
-df_vault["next_value"] = df_vault["amount"] * df_vault["next_price"]
-# group by token_type (loan or collateral) to get total sum
-df_vault_details = df_vault.groupby("token_type").sum()
-df_vault_details.reset_index(inplace=True)
-
-df_vault_coll = df_vault[df_vault["token_type"]
-                         == 'collateral'][["symbol", "amount"]]
-# get active, next and delta collateral ratios
-coll_ratio_active = df_vault_details[df_vault_details["token_type"] == 'collateral'] \
-    .active_value.iloc[0] / df_vault_details[df_vault_details["token_type"] == 'loan'] \
-    .active_value.iloc[0]
-coll_ratio_next = df_vault_details[df_vault_details["token_type"] == 'collateral'] \
-    .next_value.iloc[0] / df_vault_details[df_vault_details["token_type"] == 'loan'] \
-    .next_value.iloc[0]
-coll_ratio_delta = coll_ratio_next - coll_ratio_active
+# filter all holdings, vaults and history by portfolio when the collector tracks more than one,
+# None sums over all addresses and vaults
+portfolios = get_data("portfolios").portfolio.tolist()
+selected_portfolio = None
+if len(portfolios) > 1:
+    selected_portfolio = st.selectbox("Portfolio", ["All"] + portfolios)
+    selected_portfolio = None if selected_portfolio == "All" else selected_portfolio
+portfolio_params = {"portfolio": selected_portfolio}
+
+# get vault token amounts of the latest vault snapshots with their active and next value,
+# kept current by the collector
+df_vault = get_data("vault_values", portfolio_params)
+# group by token_type (loan or collateral) to get total sum, a portfolio without vaults or loans sums to 0
+df_vault_details = df_vault.groupby("token_type")[["active_value", "next_value"]].sum() \
+    .reindex(["collateral", "loan"], fill_value=0)
 
 # get active, next and delta collateral values
-active_collateral_value = df_vault_details[df_vault_details["token_type"]
-                                           == 'collateral'].active_value.iloc[0]
-next_collateral_value = df_vault_details[df_vault_details["token_type"]
-                                         == 'collateral'].next_value.iloc[0]
+active_collateral_value = df_vault_details.active_value["collateral"]
+next_collateral_value = df_vault_details.next_value["collateral"]
 collateral_delta = next_collateral_value - active_collateral_value
 
 # get active, next and delta loan values
-active_loan_value = df_vault_details[df_vault_details["token_type"]
-                                     == 'loan'].active_value.iloc[0]
-next_loan_value = df_vault_details[df_vault_details["token_type"]
-                                   == 'loan'].next_value.iloc[0]
+active_loan_value = df_vault_details.active_value["loan"]
+next_loan_value = df_vault_details.next_value["loan"]
 loan_delta = next_loan_value - active_loan_value
 
-# query to get 24 hours worth of DFI dex prices
-d = (datetime.now(pytz.utc) - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
-sql_dfi_prices = f"""
-    select created_at, active_price
-    from vault_amounts
-    where token_id = 0 and created_at > '{d}'
-    order by created_at desc;
-    """
-df_dfi_dex_prices_24h = get_data(sql_dfi_prices, engine)
-
-# get active, 24h ago and delta dfi prices
-dfi_price_active = df_dfi_dex_prices_24h.active_price.iloc[0]
-dfi_price_24h_ago = df_dfi_dex_prices_24h.active_price.iloc[-1]
+# get active, next and delta collateral ratios, not a number without loans
+coll_ratio_active = active_collateral_value / active_loan_value if active_loan_value else float("nan")
+coll_ratio_next = next_collateral_value / next_loan_value if next_loan_value else float("nan")
+coll_ratio_delta = coll_ratio_next - coll_ratio_active
+
+# get 24 hours worth of DFI prices, empty before the collector saved prices for a day
+df_dfi_prices_24h = get_data("dfi_prices_24h")
+
+# get active, 24h ago and delta dfi prices, not a number without prices
+dfi_price_active = df_dfi_prices_24h.price.iloc[0] if not df_dfi_prices_24h.empty else float("nan")
+dfi_price_24h_ago = df_dfi_prices_24h.price.iloc[-1] if not df_dfi_prices_24h.empty else float("nan")
 delta_dfi_price = dfi_price_active / dfi_price_24h_ago * 100 - 100
 
-# get only holdings from the last 30 minutes
-d = (datetime.now(pytz.utc) - timedelta(minutes=30)).strftime("%Y-%m-%d %H:%M:%S")
-# query to get current token holdings in the wallet
-sql_tokens = f"""
-    select distinct on (dt1.token_id) dt1.token_id, dt1.symbol as token_symbol, dt1.islps, amount, dt2.symbol as tokena_symbol, dt3.symbol as tokenb_symbol, tokena_reserve, tokenb_reserve, total_liquidity_token
-    from defichain_tokens dt1
-    left join defichain_tokens dt2 on dt1.tokena_id=dt2.token_id
-    left join defichain_tokens dt3 on dt1.tokenb_id=dt3.token_id
-    inner join defichain_holdings dh on dh.token_id=dt1.token_id
-    where dh.created_at > '{d}'
-    order by dt1.token_id, dh.created_at desc;
-    """
-df_tokens = get_data(sql_tokens, engine)
-df_tokens["tokena_amount"] = (
-    df_tokens["amount"] / df_tokens["total_liquidity_token"]) * df_tokens["tokena_reserve"]
-df_tokens["tokenb_amount"] = (
-    df_tokens["amount"] / df_tokens["total_liquidity_token"]) * df_tokens["tokenb_reserve"]
-df_tokena = df_tokens[["tokena_symbol", "tokena_amount"]].groupby('tokena_symbol').sum(
-).reset_index().rename(columns={'tokena_symbol': 'symbol', 'tokena_amount': 'amount'})
-df_tokenb = df_tokens[["tokenb_symbol", "tokenb_amount"]].groupby('tokenb_symbol').sum(
-).reset_index().rename(columns={'tokenb_symbol': 'symbol', 'tokenb_amount': 'amount'})
-
-df_token_wallet = df_tokens[df_tokens["islps"] == False][[
-    "token_symbol", "amount"]].rename(columns={'token_symbol': 'symbol'})
-df_token_all = pd.concat(
-    [df_tokena, df_tokenb, df_token_wallet, df_vault_coll]).groupby('symbol').sum()
-# merge with prices
-all_tokens_with_price = pd.merge(df_token_all, df_prices, left_index=True, right_index=True)[
-    ['amount', 'id', 'price.aggregated.amount']]
-all_tokens_with_price.reset_index(inplace=True)
-# change type to float and rename columns
-all_tokens_with_price = all_tokens_with_price.astype({'price.aggregated.amount': 'float64', 'amount': 'float64'}).rename(
-    columns={'index': 'Coin', 'amount': 'Amount', 'price.aggregated.amount': 'price'})
-# create USD column
-all_tokens_with_price['Amount (USD)'] = all_tokens_with_price["Amount"] * \
-    all_tokens_with_price["price"]
+# get current token holdings in the wallets, kept current by the collector
+df_tokens = get_data("tokens", portfolio_params)
+# get current holdings of wallets and vault collateral per coin valued with the latest prices,
+# coins without price are left out
+all_tokens_with_price = get_data("holdings", portfolio_params)
 
 # create 5 columns
 col1, col2, col3, col4, col5 = st.columns(5)
@@ -190,14 +171,14 @@ col1, col2, col3, col4, col5 = st.columns(5)
 # fill columns with correct formatting enabled
 col1.metric("All holdings ($)", "{:,.0f}".format((all_tokens_with_price['Amount (USD)'].sum(
 )-active_loan_value)), "excl. loan value", delta_color="off")
-col2.metric("DFI-price (dUSD)", "{:,.2f}".format(dfi_price_active),
-            "{:,.1f}% (24h %)".format(delta_dfi_price))
+col2.metric("DFI-price (dUSD)", "{:,.2f}".format(dfi_price_active) if not df_dfi_prices_24h.empty else "-",
+            "{:,.1f}% (24h %)".format(delta_dfi_price) if not df_dfi_prices_24h.empty else None)
 col3.metric("Collateral ($)", "{:,.0f}".format(active_collateral_value),
             "{:,.1f} (next)".format(collateral_delta))
 col4.metric("Loans ($)", "{:,.0f}".format(active_loan_value),
             "{:,.1f} (next)".format(loan_delta))
-col5.metric("Coll. Ratio", f"{(coll_ratio_active * 100).round(1)}%",
-            f"{(coll_ratio_delta * 100).round(1)}% (next)")
+col5.metric("Coll. Ratio", f"{coll_ratio_active * 100:.1f}%" if active_loan_value else "-",
+            f"{coll_ratio_delta * 100:.1f}% (next)" if active_loan_value else None)
 
 st.header("Holdings")
 col1, col2 = st.columns((45, 55))
@@ -211,56 +192,18 @@ token_sorted_price_index_reset.reset_index(inplace=True)
 chart_holdings = chart.get_holdings_chart(token_sorted_price_index_reset)
 col2.altair_chart(chart_holdings, use_container_width=True)
 
-# query to get historical token amounts
-sql_historical_amount_tokens = """
-    select dt1.token_id, dh.created_at, dt1.symbol as token_symbol, dt1.islps, amount, dt2.symbol as tokena_symbol, dt3.symbol as tokenb_symbol, tokena_reserve, tokenb_reserve, total_liquidity_token
-    from defichain_tokens dt1
-    left join defichain_tokens dt2 on dt1.tokena_id=dt2.token_id
-    left join defichain_tokens dt3 on dt1.tokenb_id=dt3.token_id
-    inner join defichain_holdings dh on dh.token_id=dt1.token_id
-    order by dh.created_at desc;
-    """
-df_historical_amount_tokens = get_data(sql_historical_amount_tokens, engine)
-
-sql_historical_vault_token = """
-    select va.created_at, va.amount, dt.symbol
-    from vault_amounts va
-    inner join defichain_tokens dt on va.token_id=dt.token_id
-    where va.token_type='collateral'
-    order by created_at desc;
-    """
-
-df_historical_vault_tokens = get_data(sql_historical_vault_token, engine)
-# round down to 5 minutely precision
-df_historical_amount_tokens['created_at'] = df_historical_amount_tokens['created_at'].dt.floor(
-    '5T')
-df_historical_vault_tokens['created_at'] = df_historical_vault_tokens['created_at'].dt.floor(
-    '5T')
-# calculate Token A and B amount
-df_historical_amount_tokens["tokena_amount"] = df_historical_amount_tokens["amount"] / \
-    df_historical_amount_tokens["total_liquidity_token"] * \
-    df_historical_amount_tokens["tokena_reserve"]
-df_historical_amount_tokens["tokenb_amount"] = df_historical_amount_tokens["amount"] / \
-    df_historical_amount_tokens["total_liquidity_token"] * \
-    df_historical_amount_tokens["tokenb_reserve"]
-# group tokens by datetime for timeseries chart
-df_tokena_by_datetime = df_historical_amount_tokens[["created_at", "tokena_symbol", "tokena_amount"]].groupby(
-    ['created_at', 'tokena_symbol']).sum().reset_index().rename(columns={'tokena_symbol': 'symbol', 'tokena_amount': 'amount'})
-df_tokenb_by_datetime = df_historical_amount_tokens[["created_at", "tokenb_symbol", "tokenb_amount"]].groupby(
-    ['created_at', 'tokenb_symbol']).sum().reset_index().rename(columns={'tokenb_symbol': 'symbol', 'tokenb_amount': 'amount'})
-df_token_wallet_by_datetime = df_historical_amount_tokens[df_historical_amount_tokens["islps"] == False][[
-    "created_at", "token_symbol", "amount"]].rename(columns={'token_symbol': 'symbol'})
-df_token_wallet_by_datetime = pd.concat([df_tokena_by_datetime, df_tokenb_by_datetime, df_token_wallet_by_datetime,
-                                        df_historical_vault_tokens]).groupby(['created_at', 'symbol']).sum().reset_index()
-df_token_wallet_by_datetime.set_index('symbol', inplace=True)
-# merge with current prices
-all_tokens_with_price = pd.merge(df_token_wallet_by_datetime, df_prices, left_index=True, right_index=True)[
-    ['created_at', 'amount', 'id', 'price.aggregated.amount']]
-all_tokens_with_price.reset_index(inplace=True)
-all_tokens_with_price = all_tokens_with_price.astype({'price.aggregated.amount': 'float64', 'amount': 'float64'}).rename(
-    columns={'index': 'Coin', 'amount': 'Amount', 'price.aggregated.amount': 'price'})
-all_tokens_with_price['Amount (USD)'] = (
-    all_tokens_with_price["Amount"]*all_tokens_with_price["price"]).round(2)
+# max number of points per coin in the historical holdings chart
+HISTORY_MAX_POINTS = int(os.getenv('DASHBOARD_HISTORY_MAX_POINTS', '500'))
+
+# get time range of all snapshots, to choose the bucket size of the historical holdings chart
+df_snapshot_range = get_data("snapshot_range")
+history_bucket = timeseries.bucket_seconds(df_snapshot_range.first_created_at.iloc[0],
+                                           df_snapshot_range.last_created_at.iloc[0],
+                                           HISTORY_MAX_POINTS)
+
+# get historical holdings of wallet and vault together per time bucket, valued with the prices of the
+# time. Rows are read from the coarsest rollup table that still has buckets of at most history_bucket
+all_tokens_with_price = get_data("historical_holdings", {"bucket": history_bucket, **portfolio_params})
 # get list of all tokens to use in multiselect box
 all_holdings_symbols = all_tokens_with_price.Coin.unique()
 all_holdings_symbols = st.multiselect(
@@ -277,7 +220,7 @@ st.header('Collateral')
 df_coll = df_vault[df_vault["token_type"] == 'collateral']
 # get number of collateral tokens
 num_of_coll_tokens = len(df_coll.index)
-cols_coll = st.columns(num_of_coll_tokens)
+cols_coll = st.columns(num_of_coll_tokens) if num_of_coll_tokens else []
 
 for i, col in enumerate(cols_coll):
     col.markdown(f"<p><b>{df_coll.symbol.iloc[i]}</b><br>"
@@ -290,7 +233,7 @@ st.header('Loans')
 
 df_loans = df_vault[df_vault["token_type"] == 'loan']
 num_of_loan_tokens = len(df_loans.index)
-cols_loan = st.columns(num_of_loan_tokens)
+cols_loan = st.columns(num_of_loan_tokens) if num_of_loan_tokens else []
 
 for i, col in enumerate(cols_loan):
     col.markdown(f"<p><b>{df_loans.symbol.iloc[i]}</b><br>"
@@ -301,17 +244,31 @@ for i, col in enumerate(cols_loan):
 space(2)
 
 st.header("Liquidity Mining")
-# query to get reward APR%
-sql_rewards = """
-    select defichain_holdings.token_id, defichain_holdings.created_at,
-    defichain_holdings.apr_reward, defichain_holdings.apr_commission, defichain_tokens.symbol
-    from defichain_holdings
-    inner join defichain_tokens on defichain_holdings.token_id=defichain_tokens.token_id
-    where defichain_tokens.isLPS = True;
-    """
-df_rewards = get_data(sql_rewards, engine)
-df_rewards["apr_total"] = (
-    (df_rewards["apr_reward"] + df_rewards["apr_commission"])).round(3)
+# time ranges to choose from for the APR chart, None shows all history
+APR_RANGES = {
+    "24h": timedelta(days=1),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+    "All": None,
+}
+# max number of points of the APR chart over all dTokens together
+APR_MAX_POINTS = int(os.getenv('DASHBOARD_APR_MAX_POINTS', '2000'))
+
+apr_range = st.radio("Time range", list(APR_RANGES), index=1, horizontal=True)
+apr_until = df_snapshot_range.last_created_at.iloc[0]
+apr_since = df_snapshot_range.first_created_at.iloc[0]
+if APR_RANGES[apr_range] is not None and pd.notna(apr_until):
+    apr_since = max(apr_since, apr_until - APR_RANGES[apr_range])
+# split the point budget over all liquidity pool tokens
+num_of_lp_tokens = max(int(df_tokens["islps"].sum()), 1)
+apr_bucket = timeseries.bucket_seconds(
+    apr_since, apr_until, APR_MAX_POINTS // num_of_lp_tokens)
+# round the start down to a whole bucket so the query parameters, and with them the cache key,
+# only change when a new bucket starts. Without snapshots the range is NaT and the whole history is read
+apr_since = apr_since.floor(f"{apr_bucket}s") if pd.notna(apr_since) else queries.EPOCH
+
+# get reward APR% per time bucket within the chosen time range
+df_rewards = get_data("apr", {"bucket": apr_bucket, "since": apr_since, **portfolio_params})
 
 
 all_symbols = df_rewards.symbol.unique()
@@ -1,35 +1,41 @@
 """ Saving DeFiChain portfolio details to PostgreSQL database"""
+import argparse
+import signal
 import sys
-import time
-import json
 import os
 import datetime as dt
-import pandas as pd
-import requests
+from concurrent.futures import ThreadPoolExecutor
 import pytz
-import sqlalchemy
 
 from dotenv import load_dotenv
 from psycopg2 import OperationalError
+from psycopg2.extras import execute_values
 
 from classes import models
-from utils import postgresql
+from utils import current, export, partitions, postgresql, rollup
+from utils.ocean import OCEAN_URL, OceanClient, OceanError
+from utils.ratelimit import TokenBucket
+from utils.scheduler import Scheduler
 
 # load environment variables
 load_dotenv()
 
+# base URL of the Ocean API, point it to a local stand-in to collect without hitting mainnet
+OCEAN_BASE_URL = os.getenv('OCEAN_URL', OCEAN_URL)
+# max number of concurrent requests to the Ocean API
+OCEAN_MAX_WORKERS = int(os.getenv('OCEAN_MAX_WORKERS', '8'))
+# max number of requests per second to the Ocean API (token bucket refill rate and burst size)
+OCEAN_RATE_LIMIT = float(os.getenv('OCEAN_RATE_LIMIT', '5'))
+OCEAN_BURST = int(os.getenv('OCEAN_BURST', str(OCEAN_MAX_WORKERS)))
 
-def connect_engine(url):
-    """ Define a connect function for PostgreSQL database server through sqlalchemy """
-    sqlalchemy_engine = sqlalchemy.create_engine(url)
-    return sqlalchemy_engine
+# max number of retries per Ocean API request
+OCEAN_MAX_RETRIES = int(os.getenv('OCEAN_MAX_RETRIES', '5'))
 
+# Ocean API client with keep-alive connection pool, retries and circuit breaker,
+# all requests share one rate limiter
+ocean = OceanClient(base_url=OCEAN_BASE_URL, max_retries=OCEAN_MAX_RETRIES, pool_size=OCEAN_MAX_WORKERS,
+                    rate_limiter=TokenBucket(OCEAN_RATE_LIMIT, OCEAN_BURST))
 
-# sqlalchemy connection_url
-connection_url = f"postgresql://{os.getenv('POSTGRESQL_USER')}:{os.getenv('POSTGRESQL_PW')}@{os.getenv('POSTGRESQL_IP')}/{os.getenv('POSTGRESQL_DB')}"
-
-# iniialize sqlalchemy engine
-engine = connect_engine(connection_url)
 
 # create dict with PostgreSQL connection params
 conn_params_dict = {
@@ -40,146 +46,343 @@ conn_params_dict = {
     "database": os.getenv('POSTGRESQL_DB')
 }
 
-# initialize connection
-con = postgresql.connect(conn_params_dict)
-
-# exit process if connect() returned error
-if con is None:
-    sys.exit(0)
-
-
-cursor = con.cursor()
-
+# DeFiChain address and vault id collected when none are configured
+ADDRESS = "df1q9qtltnhkn3f5wnjmjddq02tw32lfk0tuu9zl8h"
+VAULT_ID = "f8f7333cb0d81dd4293c49ce2101328ecf297678ec442f7a7131f2ed088f8601"
+
+# comma separated addresses and vault ids to collect, an entry can name its portfolio as <portfolio>:<id>.
+# They are registered in the owners table on start, every active owner in that table is collected
+DEFICHAIN_ADDRESSES = os.getenv('DEFICHAIN_ADDRESSES', ADDRESS)
+DEFICHAIN_VAULTS = os.getenv('DEFICHAIN_VAULTS', VAULT_ID)
+# portfolio of configured owners that do not name one
+DEFAULT_PORTFOLIO = "default"
+
+# collection intervals in seconds per endpoint and of the maintenance jobs, used when running as a resident collector
+COLLECTOR_INTERVALS = {
+    "tokens": float(os.getenv('COLLECTOR_INTERVAL_TOKENS', '300')),
+    "vault": float(os.getenv('COLLECTOR_INTERVAL_VAULT', '300')),
+    "prices": float(os.getenv('COLLECTOR_INTERVAL_PRICES', '300')),
+    "rollup": float(os.getenv('COLLECTOR_INTERVAL_ROLLUP', '3600')),
+    "partitions": float(os.getenv('COLLECTOR_INTERVAL_PARTITIONS', '86400')),
+}
 
-def add_token_entry(token, token_amount=None, holding_save=True):
-    """ define function to add defichain_token holdings to psql database """
+# directory the history tables are exported to as Parquet files, no export when not set
+HISTORY_EXPORT_DIR = os.getenv('HISTORY_EXPORT_DIR')
+if HISTORY_EXPORT_DIR:
+    COLLECTOR_INTERVALS["export"] = float(os.getenv('COLLECTOR_INTERVAL_EXPORT', '3600'))
+
+# monthly partitions of the history tables are created this many months ahead
+PARTITIONS_AHEAD = int(os.getenv('PARTITIONS_AHEAD', '2'))
+
+# raw history partitions older than this many days are dropped once covered by the rollup tables, 0 keeps them forever
+RAW_RETENTION_DAYS = int(os.getenv('RAW_RETENTION_DAYS', '90'))
+
+# connection and cursor are opened by connect_database() and kept warm between runs
+con = None
+cursor = None
+
+
+def connect_database():
+    """ Open the PostgreSQL connection, or reopen it when it was closed or broken """
+    global con, cursor
+    if con is not None and not con.closed:
+        return con
+    con = postgresql.connect(conn_params_dict)
+    cursor = con.cursor() if con is not None else None
+    return con
+
+
+# timezone used for all created_at timestamps
+TIMEZONE = pytz.timezone('Europe/Amsterdam')
+
+# multi-row insert statements, the VALUES %s placeholder is expanded by execute_values
+POSTGRESQL_INSERT_TOKENS = '''
+                              INSERT INTO defichain_tokens
+                              (
+                                  created_at,
+                                  token_id,
+                                  symbol,
+                                  name,
+                                  isDAT,
+                                  isLPS,
+                                  isLoanToken,
+                                  tokenA_id,
+                                  tokenB_id
+                              )
+                              VALUES %s
+                              ON CONFLICT ON CONSTRAINT defichain_tokens_token_id_key
+                              DO NOTHING;
+                           '''
+
+POSTGRESQL_INSERT_HOLDINGS = '''
+                                INSERT INTO defichain_holdings
+                                (
+                                    snapshot_id,
+                                    created_at,
+                                    token_id,
+                                    amount,
+                                    tokenA_reserve,
+                                    tokenB_reserve,
+                                    priceratio_ab,
+                                    priceratio_ba,
+                                    total_liquidity_token,
+                                    total_liquidity_usd,
+                                    apr_reward,
+                                    apr_commission,
+                                    volume_h24,
+                                    volume_d30,
+                                    owner_id
+                                )
+                                VALUES %s
+                             '''
+
+POSTGRESQL_INSERT_VAULTS = '''
+                              INSERT INTO vaults
+                              (
+                                  vault_id,
+                                  snapshot_id,
+                                  created_at,
+                                  collateral_ratio,
+                                  collateral_value,
+                                  loan_value,
+                                  interest_value,
+                                  owner_id
+                              )
+                              VALUES %s returning id, vault_id;
+                           '''
+
+POSTGRESQL_INSERT_VAULT_AMOUNTS = '''
+                                     INSERT INTO vault_amounts
+                                     (
+                                         vault_id,
+                                         snapshot_id,
+                                         created_at,
+                                         token_type,
+                                         token_id,
+                                         amount,
+                                         price_key_id,
+                                         active_price,
+                                         next_price,
+                                         owner_id
+                                     )
+                                     VALUES %s
+                                  '''
+
+# price keys are stored once in price_keys, vault amounts are inserted with their id
+POSTGRESQL_TEMPLATE_VAULT_AMOUNTS = '''
+                                       (%s, %s, %s, %s, %s, %s,
+                                       (SELECT id FROM price_keys WHERE price_key = %s), %s, %s, %s)
+                                    '''
+
+# only unknown keys are inserted, a conflicting insert would still use up an id
+POSTGRESQL_INSERT_PRICE_KEYS = '''
+                                  INSERT INTO price_keys (price_key)
+                                  SELECT new.price_key FROM (VALUES %s) AS new (price_key)
+                                  WHERE NOT EXISTS (SELECT 1 FROM price_keys WHERE price_key = new.price_key)
+                                  ON CONFLICT (price_key) DO NOTHING
+                               '''
+
+POSTGRESQL_INSERT_PRICES = '''
+                              INSERT INTO coin_prices
+                              (
+                                  symbol,
+                                  snapshot_id,
+                                  created_at,
+                                  pair,
+                                  price
+                              )
+                              VALUES %s
+                           '''
+
+# only unknown owners are inserted, like price keys. Configured owners get their configured portfolio
+# and are collected again if they were deactivated
+POSTGRESQL_INSERT_OWNERS = '''
+                              INSERT INTO owners (owner_type, owner_key, portfolio)
+                              SELECT new.owner_type::owner_type, new.owner_key, new.portfolio
+                              FROM (VALUES %s) AS new (owner_type, owner_key, portfolio)
+                              WHERE NOT EXISTS (SELECT 1 FROM owners WHERE owner_type = new.owner_type::owner_type
+                                                AND owner_key = new.owner_key)
+                              ON CONFLICT (owner_type, owner_key) DO NOTHING
+                           '''
+
+POSTGRESQL_UPDATE_OWNERS = '''
+                              UPDATE owners SET portfolio = new.portfolio, active = TRUE
+                              FROM (VALUES %s) AS new (owner_type, owner_key, portfolio)
+                              WHERE owners.owner_type = new.owner_type::owner_type AND owners.owner_key = new.owner_key
+                              AND (owners.portfolio <> new.portfolio OR NOT owners.active)
+                           '''
+
+POSTGRESQL_SELECT_OWNERS = '''
+                              SELECT owner_type, id, owner_key FROM owners WHERE active ORDER BY id;
+                           '''
+
+POSTGRESQL_INSERT_SNAPSHOT = '''
+                                INSERT INTO snapshots (created_at)
+                                VALUES (%s) returning id;
+                             '''
+
+
+def add_entries(sql, rows, template=None):
+    """ define function to add a batch of rows to psql database in one round trip """
+    rows = list(rows)
+    if rows:
+        # transform objects to tuples and send them as one multi-row insert
+        execute_values(cursor, sql, [tuple(row) for row in rows],
+                       template=template, page_size=len(rows))
+
+
+def add_snapshot_entry():
+    """ define function to add a snapshot to psql database, all rows of a run share its id and timestamp """
+    snapshot = models.Snapshot(dt.datetime.now(TIMEZONE))
+    cursor.execute(POSTGRESQL_INSERT_SNAPSHOT, (snapshot.created_at,))
+    snapshot.snapshot_id = cursor.fetchone()[0]
+    return snapshot
+
+
+def add_vault_entries(vaults):
+    """ define function to add the details of all vaults to psql database in one round trip,
+    returns dict with vault id as key and the id of its row as value """
+    rows = execute_values(cursor, POSTGRESQL_INSERT_VAULTS, [tuple(vault) for vault in vaults],
+                          page_size=len(vaults), fetch=True)
+    return {vault_id: row_id for row_id, vault_id in rows}
+
+
+def parse_owners(value, owner_type):
+    """ Parse comma separated, optionally <portfolio>:<id> prefixed owner ids from the configuration,
+    returns list of (owner type, owner id, portfolio) """
+    owners = []
+    for entry in value.split(","):
+        portfolio, _, key = entry.strip().rpartition(":")
+        if key:
+            owners.append((owner_type, key, portfolio or DEFAULT_PORTFOLIO))
+    return owners
+
+
+def register_owners():
+    """ Add the configured addresses and vaults to the owners table """
+    owners = parse_owners(DEFICHAIN_ADDRESSES, "address") + parse_owners(DEFICHAIN_VAULTS, "vault")
     try:
-        postgresql_insert_with_param_tokens = '''
-                                                    INSERT INTO defichain_tokens
-                                                    (
-                                                        created_at,
-                                                        token_id,
-                                                        symbol,
-                                                        name,
-                                                        isDAT,
-                                                        isLPS,
-                                                        isLoanToken,
-                                                        tokenA_id,
-                                                        tokenB_id
-                                                    )
-                                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                                    ON CONFLICT ON CONSTRAINT defichain_tokens_token_id_key
-                                                    DO NOTHING;
-                                              '''
-
-        postgresql_insert_with_param_amounts = '''
-                                                    INSERT INTO defichain_holdings
-                                                    (
-                                                        created_at,
-                                                        token_id,
-                                                        amount,
-                                                        tokenA_reserve,
-                                                        tokenB_reserve,
-                                                        priceratio_ab,
-                                                        priceratio_ba,
-                                                        total_liquidity_token,
-                                                        total_liquidity_usd,
-                                                        apr_reward,
-                                                        apr_commission,
-                                                        volume_h24,
-                                                        volume_d30
-                                                    )
-                                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                                '''
-
-        timezone = pytz.timezone('Europe/Amsterdam')
-        token.created_at = dt.datetime.now(timezone)
-        # transform token object to tuple
-        data_tuple_tokens = tuple(token)
-        cursor.execute(postgresql_insert_with_param_tokens, data_tuple_tokens)
-
-        # when saving vault tokens we don't have token holdings to save --> holding_save == False
-        if holding_save:
-            token_amount.created_at = dt.datetime.now(timezone)
-            data_tuple_amounts = tuple(token_amount)
-            cursor.execute(postgresql_insert_with_param_amounts,
-                           data_tuple_amounts)
-        return None
+        add_entries(POSTGRESQL_INSERT_OWNERS, owners)
+        add_entries(POSTGRESQL_UPDATE_OWNERS, owners)
+        con.commit()
     except OperationalError as err:
         postgresql.show_psycopg2_exception(err)
-        return None
+        if not con.closed:
+            con.rollback()
     except Exception as err:
         print(f"Error occured in postgresql transaction: \n{err}")
-        return None
+        con.rollback()
 
 
-def add_vault_entry(vault):
-    """ define function to add vault details to psql database """
+def get_owners():
+    """ Get all active owners, returns dict with owner type as key and list of (owner id, address or vault id)
+    as value, None when the database is not available """
     try:
-        postgresql_insert_with_param_vault = '''
-                                                INSERT INTO vaults
-                                                (
-                                                    vault_id,
-                                                    created_at,
-                                                    collateral_ratio,
-                                                    collateral_value,
-                                                    loan_value,
-                                                    interest_value
-                                                )
-                                                VALUES (%s, %s, %s, %s, %s, %s) returning id;
-                                            '''
-
-        timezone = pytz.timezone('Europe/Amsterdam')
-        vault.created_at = dt.datetime.now(timezone)
-        data_tuple_vaults = tuple(vault)
-        cursor.execute(postgresql_insert_with_param_vault, data_tuple_vaults)
-        # return vault_id
-        return cursor.fetchone()[0]
+        cursor.execute(POSTGRESQL_SELECT_OWNERS)
+        owners = {"address": [], "vault": []}
+        for owner_type, owner_id, owner_key in cursor.fetchall():
+            owners[owner_type].append((owner_id, owner_key))
+        con.commit()
+        return owners
     except OperationalError as err:
         postgresql.show_psycopg2_exception(err)
+        if not con.closed:
+            con.rollback()
         return None
     except Exception as err:
         print(f"Error occured in postgresql transaction: \n{err}")
+        con.rollback()
         return None
 
 
-def add_vault_amount_entry(vault_amount):
-    """ define function to add amounts to psql database """
+def save_snapshot(tokens=(), token_amounts=(), vaults=(), prices=(), owner_ids=None):
+    """ define function to save all rows of a run to psql database in a single transaction,
+    vaults is a list of (vault, vault amounts) and owner_ids are the owners collected in this run """
     try:
-        # insert developer detail
-        postgresql_insert_with_param_vault_amount = '''
-                                                        INSERT INTO vault_amounts
-                                                        (
-                                                            vault_id,
-                                                            created_at,
-                                                            token_type,
-                                                            token_id,
-                                                            amount,
-                                                            price_key,
-                                                            active_price,
-                                                            next_price
-                                                        )
-                                                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                                                    '''
-
-        timezone = pytz.timezone('Europe/Amsterdam')
-        vault_amount.created_at = dt.datetime.now(timezone)
-        data_tuple_vault_amount = tuple(vault_amount)
-        cursor.execute(postgresql_insert_with_param_vault_amount,
-                       data_tuple_vault_amount)
-        return None
-
+        snapshot = add_snapshot_entry()
+        # token details only get the timestamp of the snapshot they were first seen in
+        for token in tokens:
+            token.created_at = snapshot.created_at
+        add_entries(POSTGRESQL_INSERT_TOKENS, tokens)
+        add_entries(POSTGRESQL_INSERT_HOLDINGS,
+                    [snapshot.stamp(token_amount) for token_amount in token_amounts])
+        vault_amounts = []
+        if vaults:
+            vault_row_ids = add_vault_entries([snapshot.stamp(vault) for vault, _ in vaults])
+            for vault, amounts in vaults:
+                for vault_amount in amounts:
+                    snapshot.stamp(vault_amount).vault_id = vault_row_ids[vault.vault_id]
+                vault_amounts += amounts
+            add_entries(POSTGRESQL_INSERT_PRICE_KEYS,
+                        sorted({(vault_amount.price_key,) for vault_amount in vault_amounts}))
+            add_entries(POSTGRESQL_INSERT_VAULT_AMOUNTS, vault_amounts,
+                        template=POSTGRESQL_TEMPLATE_VAULT_AMOUNTS)
+        add_entries(POSTGRESQL_INSERT_PRICES,
+                    [snapshot.stamp(price) for price in prices])
+        # keep the current state tables on the latest rows, in the same transaction as the history;
+        # an owner without rows in this snapshot, e.g. an emptied address, loses its current rows
+        saved = {"defichain_holdings": owner_ids, "vaults": owner_ids,
+                 "vault_amounts": owner_ids, "coin_prices": prices}
+        current.update_current_state(cursor, snapshot, [table for table, rows in saved.items() if rows],
+                                     owner_ids)
+        # listeners like the dashboard are notified once the snapshot is committed, not on rollback
+        postgresql.notify(cursor, postgresql.SNAPSHOT_CHANNEL, snapshot.snapshot_id)
+        # Save (commit) the changes, once per snapshot
+        con.commit()
+        return snapshot
     except OperationalError as err:
         postgresql.show_psycopg2_exception(err)
+        # a broken connection is reopened by connect_database() on the next run
+        if not con.closed:
+            con.rollback()
         return None
     except Exception as err:
         print(f"Error occured in postgresql transaction: \n{err}")
+        con.rollback()
         return None
 
 
-def parse_token_data(req):
-    """ Parse token data retrieved from API call to Ocean API"""
-    data = json.loads(req.text)['data']
+def fan_out(function, items):
+    """ Call function for all items concurrently, returns dict with item as key and result as value.
+    Items whose Ocean API request failed are left out, one broken address does not hold up the others """
+    items = list(items)
+    if not items:
+        return {}
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(OCEAN_MAX_WORKERS, len(items))) as executor:
+        futures = {item: executor.submit(function, item) for item in items}
+        for item, future in futures.items():
+            try:
+                results[item] = future.result()
+            except OceanError as err:
+                print(f"Error occured in Ocean API request of {item}: \n{err}")
+    return results
+
+
+def get_poolpair(token_id):
+    """ Get pool info of a Liquidity Pool token from Ocean API """
+    return ocean.get("/poolpairs/{token_id}", token_id=token_id)['data']
+
+
+def get_poolpairs(token_ids):
+    """ Get pool info of all Liquidity Pool tokens concurrently, returns dict with token id as key """
+    return fan_out(get_poolpair, token_ids)
+
+
+def get_address_tokens(address):
+    """ Get all tokens of an address from Ocean API """
+    return list(ocean.paginate("/address/{address}/tokens", address=address))
+
+
+def get_vault(vault_id):
+    """ Get vault details from Ocean API """
+    return ocean.get("/loans/vaults/{vault_id}", vault_id=vault_id)['data']
+
+
+def parse_token_data(data, poolpairs):
+    """ Parse token data retrieved from API call to Ocean API with the pool info of its Liquidity Pool tokens,
+    returns token details and amounts"""
+    tokens, token_amounts = [], []
     # loop over all tokens in data
     for token in data:
         # initiate TokenDetail and TokenAmount objects with data retrieved from Ocean API
@@ -187,42 +390,34 @@ def parse_token_data(req):
                                             token["isLoanToken"])
         token_amount_instance = models.TokenAmount(
             token["id"], token["amount"])
-        # if token is a Liquidity Pool token, get pool info
+        # if token is a Liquidity Pool token, add pool info
         if token["isLPS"] is True:
-            time.sleep(0.3)
-            # get pool info from Ocean API
-            url_poolpair = f"https://Ocean.defichain.com/v0/mainnet/poolpairs/{token['id']}"
-            while True:
-                r_poolpair = requests.get(url_poolpair, timeout=10)
-
-                if r_poolpair.status_code == 200:
-                    poolpair = json.loads(r_poolpair.text)['data']
-                    token_amount_instance.token_a_reserve = poolpair["tokenA"]["reserve"]
-                    token_amount_instance.token_b_reserve = poolpair["tokenB"]["reserve"]
-                    token_amount_instance.priceratio_ab = poolpair["priceRatio"]["ab"]
-                    token_amount_instance.priceratio_ba = poolpair["priceRatio"]["ba"]
-                    token_amount_instance.total_liquidity_token = poolpair["totalLiquidity"]["token"]
-                    token_amount_instance.total_liquidity_usd = poolpair["totalLiquidity"]["usd"]
-                    token_amount_instance.apr_reward = poolpair["apr"]["reward"]
-                    token_amount_instance.apr_commission = poolpair["apr"]["commission"]
-                    token_amount_instance.volume_h24 = poolpair["volume"]["h24"]
-                    token_amount_instance.volume_d30 = poolpair["volume"]["d30"]
-                    token_instance.token_a_id = poolpair["tokenA"]["id"]
-                    token_instance.token_b_id = poolpair["tokenB"]["id"]
-                    break
-                time.sleep(1)
-        # save token info to database
-        add_token_entry(token_instance, token_amount_instance)
-    return print("All done!")
-
-
-def parse_vault_data(req):
-    """ Parse vault data retrieved from API call to Ocean API"""
-    data = json.loads(req.text)['data']
+            poolpair = poolpairs[token["id"]]
+            token_amount_instance.token_a_reserve = poolpair["tokenA"]["reserve"]
+            token_amount_instance.token_b_reserve = poolpair["tokenB"]["reserve"]
+            token_amount_instance.priceratio_ab = poolpair["priceRatio"]["ab"]
+            token_amount_instance.priceratio_ba = poolpair["priceRatio"]["ba"]
+            token_amount_instance.total_liquidity_token = poolpair["totalLiquidity"]["token"]
+            token_amount_instance.total_liquidity_usd = poolpair["totalLiquidity"]["usd"]
+            token_amount_instance.apr_reward = poolpair["apr"]["reward"]
+            token_amount_instance.apr_commission = poolpair["apr"]["commission"]
+            token_amount_instance.volume_h24 = poolpair["volume"]["h24"]
+            token_amount_instance.volume_d30 = poolpair["volume"]["d30"]
+            token_instance.token_a_id = poolpair["tokenA"]["id"]
+            token_instance.token_b_id = poolpair["tokenB"]["id"]
+        tokens.append(token_instance)
+        token_amounts.append(token_amount_instance)
+    return tokens, token_amounts
+
+
+def parse_vault_data(data):
+    """ Parse vault data retrieved from API call to Ocean API, returns vault details, collateral tokens and vault amounts"""
     vault_instance = models.VaultDetail(data["vaultId"], data["informativeRatio"],
                                         data["collateralValue"], data["loanValue"],
                                         data["interestValue"])
-    vault_id = add_vault_entry(vault_instance)
+    tokens, vault_amounts = [], []
+    # vault amounts get the database id of the vault row once it is saved
+    vault_id = None
 
     for collateral in data["collateralAmounts"]:
         token_id = collateral["id"]
@@ -231,11 +426,8 @@ def parse_vault_data(req):
         is_dat = True
         is_lps = False
         is_loan_token = False
-        token = models.TokenDetail(token_id, symbol, name,
-                                   is_dat, is_lps, is_loan_token)
-        token_amount_instance = models.TokenAmount()
-        add_token_entry(token, token_amount_instance, holding_save=False)
-        con.commit()
+        tokens.append(models.TokenDetail(token_id, symbol, name,
+                                         is_dat, is_lps, is_loan_token))
         token_type = 'collateral'
         amount = collateral["amount"]
         if collateral["id"] == '15':
@@ -246,7 +438,7 @@ def parse_vault_data(req):
             next_price = collateral["activePrice"]["next"]["amount"]
         vault_amount_instance = models.VaultAmount(
             vault_id, token_type, token_id, amount, price_key, active_price, next_price)
-        add_vault_amount_entry(vault_amount_instance)
+        vault_amounts.append(vault_amount_instance)
 
     for loan in data["loanAmounts"]:
         token_type = 'loan'
@@ -260,98 +452,233 @@ def parse_vault_data(req):
             next_price = loan["activePrice"]["next"]["amount"]
         vault_amount_instance = models.VaultAmount(
             vault_id, token_type, token_id, amount, price_key, active_price, next_price)
-        add_vault_amount_entry(vault_amount_instance)
-    return print("All done!")
+        vault_amounts.append(vault_amount_instance)
+    return vault_instance, tokens, vault_amounts
 
 
 def get_token_prices():
-    """ Get all current token prices with API call to Ocean """
+    """ Get all current token prices with API call to Ocean, returns coin prices """
+    # paginate over all prices in Ocean api
+    # dict to store results, keyed by token symbol
+    all_pool_prices = {}
+    for price in ocean.paginate("/prices"):
+        symbol = price["price"]["token"]
+        all_pool_prices[symbol] = models.CoinPrice(
+            symbol, price["id"], price["price"]["aggregated"]["amount"])
+
+    # set price of DUSD-USD to 1.0
+    all_pool_prices['DUSD'] = models.CoinPrice('DUSD', 'DUSD-USD', '1.000000')
+    return list(all_pool_prices.values())
+
+
+def collect_tokens(owners):
+    """ Collect token holdings of all addresses concurrently, the pool info of a Liquidity Pool token
+    is fetched once however many addresses hold it """
+    addresses = fan_out(get_address_tokens, [address for _, address in owners["address"]])
+    # get pool info of all Liquidity Pool tokens in one concurrent fetch stage
+    poolpairs = get_poolpairs({token["id"] for data in addresses.values()
+                               for token in data if token["isLPS"] is True})
+    tokens, token_amounts, owner_ids = [], [], []
+    for owner_id, address in owners["address"]:
+        if address not in addresses:
+            continue
+        data = addresses[address]
+        # holdings of an address are saved whole or not at all
+        missing = [token["id"] for token in data if token["isLPS"] is True and token["id"] not in poolpairs]
+        if missing:
+            print(f"Skipping address {address}, pool info of tokens {', '.join(missing)} is missing")
+            continue
+        # parse token data retrieved from Ocean API
+        address_tokens, address_amounts = parse_token_data(data, poolpairs)
+        for token_amount in address_amounts:
+            token_amount.owner_id = owner_id
+        tokens += address_tokens
+        token_amounts += address_amounts
+        owner_ids.append(owner_id)
+    return {"tokens": tokens, "token_amounts": token_amounts, "owner_ids": owner_ids}
+
+
+def collect_vault(owners):
+    """ Collect vault details of all vaults concurrently """
+    data = fan_out(get_vault, [vault_id for _, vault_id in owners["vault"]])
+    tokens, vaults, owner_ids = [], [], []
+    for owner_id, vault_id in owners["vault"]:
+        if vault_id not in data:
+            continue
+        # parse vault data retrieved from Ocean API
+        vault, vault_tokens, vault_amounts = parse_vault_data(data[vault_id])
+        vault.owner_id = owner_id
+        for vault_amount in vault_amounts:
+            vault_amount.owner_id = owner_id
+        tokens += vault_tokens
+        vaults.append((vault, vault_amounts))
+        owner_ids.append(owner_id)
+    return {"tokens": tokens, "vaults": vaults, "owner_ids": owner_ids}
+
+
+def collect_prices(owners):
+    """ Collect all current token prices """
+    return {"prices": get_token_prices()}
+
+
+# collector jobs, run by name
+COLLECTORS = {
+    "tokens": collect_tokens,
+    "vault": collect_vault,
+    "prices": collect_prices,
+}
+
+
+def run_collectors(names):
+    """ Run collector jobs for all active owners and save all their rows as one snapshot """
+    if not names or connect_database() is None:
+        return None
+    owners = get_owners()
+    if owners is None:
+        return None
+    rows = {"tokens": [], "owner_ids": []}
+    for name in names:
+        try:
+            collected = COLLECTORS[name](owners)
+        except OceanError as err:
+            # skip this job, the next run of the resident collector retries it
+            print(f"Error occured in Ocean API request of {name}: \n{err}")
+            continue
+        except Exception as err:
+            # e.g. a KeyError of an Ocean API payload whose format changed, the other jobs still save
+            print(f"Error occured in collector job {name}: \n{err}")
+            continue
+        rows["tokens"] += collected.pop("tokens", [])
+        rows["owner_ids"] += collected.pop("owner_ids", [])
+        rows.update(collected)
+    if not any(rows.values()):
+        return None
+    # token details are the same for every address and vault holding a token, keep one per token
+    tokens = {}
+    for token in rows["tokens"]:
+        tokens.setdefault(token.token_id, token)
+    rows["tokens"] = list(tokens.values())
+    # save all rows of this run as one snapshot, one round trip per table
+    snapshot = save_snapshot(**rows)
+    if snapshot is not None:
+        print(f"All done! {snapshot} ({', '.join(names)})")
+    return snapshot
+
+
+def run_rollups():
+    """ Refresh the hourly and daily rollups and drop raw partitions older than the retention period """
     try:
-        # get pool_prices from Ocean api
-        poolprices_url = "https://Ocean.defichain.com/v0/mainnet/prices"
-
-        # paginate over all prices in Ocean api
-        # dict to store results
-        all_pool_prices = []
-        # get first page
-        while True:
-            pool_prices_page_1 = requests.get(poolprices_url, timeout=10)
-            if pool_prices_page_1.status_code == 200:
-                pool_prices = json.loads(pool_prices_page_1.text)
-                break
-            time.sleep(1)
-
-        # get rest of pages, while loop will run as long as we have a next page in the dict
-        _run = True
-        while _run:
-            # merge dicts
-            all_pool_prices.append(pd.json_normalize(pool_prices["data"]))
-            if "page" in pool_prices:
-                while True:
-                    pool_prices_page_n = requests.get(
-                        f"{poolprices_url}?next={pool_prices['page']['next']}", timeout=10)
-                    if pool_prices_page_n.status_code == 200:
-                        pool_prices = json.loads(pool_prices_page_n.text)
-                        break
-                    time.sleep(1)
-            else:
-                _run = False
-
-        # concatenate all df's
-        df_prices = pd.concat(all_pool_prices, ignore_index=True)
-        # set df index to token
-        df_prices.set_index("price.token", inplace=True)
-        # condense df
-        df_prices = df_prices[['id', 'price.aggregated.amount']]
-        # set price of DUSD-USD to 1.0
-        df_prices.loc['DUSD'] = ['DUSD-USD', '1.000000']
-        timezone = pytz.timezone('Europe/Amsterdam')
-        df_prices['created_at'] = dt.datetime.now(timezone)
-        # rename column names to match database column names
-        df_prices.rename(
-            columns={'price.aggregated.amount': 'price', 'id': 'pair'}, inplace=True)
-        # save df to database inside pandas with the to_sql method
-        df_prices.to_sql('coin_prices', con=engine,
-                         if_exists='append', index=True, index_label='symbol')
+        rollup.refresh_rollups(cursor)
+        if RAW_RETENTION_DAYS > 0:
+            for name in rollup.compact_raw(cursor, RAW_RETENTION_DAYS):
+                print(f"Dropped partition {name}")
+        con.commit()
+    except OperationalError as err:
+        postgresql.show_psycopg2_exception(err)
+        if not con.closed:
+            con.rollback()
     except Exception as err:
         print(f"Error occured in postgresql transaction: \n{err}")
-        return None
+        con.rollback()
+
+
+def run_partitions():
+    """ Create the monthly partitions of the history tables for the coming months """
+    try:
+        partitions.ensure_partitions(cursor, PARTITIONS_AHEAD)
+        con.commit()
+    except OperationalError as err:
+        postgresql.show_psycopg2_exception(err)
+        if not con.closed:
+            con.rollback()
+    except Exception as err:
+        print(f"Error occured in postgresql transaction: \n{err}")
+        con.rollback()
 
-    return None
+
+def run_export():
+    """ Append the snapshots saved since the last export to the Parquet history export """
+    try:
+        for table, rows in export.export_history(cursor, HISTORY_EXPORT_DIR).items():
+            print(f"Exported {rows} rows of {table}")
+        con.commit()
+    except OperationalError as err:
+        postgresql.show_psycopg2_exception(err)
+        if not con.closed:
+            con.rollback()
+    except Exception as err:
+        print(f"Error occured in history export: \n{err}")
+        con.rollback()
+
+
+# maintenance jobs, run by name before the collector jobs
+PREPARATION = {
+    "partitions": run_partitions,
+}
+
+# maintenance jobs, run by name after the collector jobs
+MAINTENANCE = {
+    "rollup": run_rollups,
+}
+if HISTORY_EXPORT_DIR:
+    MAINTENANCE["export"] = run_export
+
+
+def run_job(name, job, *args):
+    """ Run a job, an error of any kind is shown and its transaction rolled back so the resident collector
+    keeps running the other jobs and retries this one on its next run """
+    try:
+        job(*args)
+    except Exception as err:
+        print(f"Error occured in job {name}: \n{err}")
+        if con is not None and not con.closed:
+            con.rollback()
+
+
+def run_jobs(names):
+    """ Run due preparation jobs, then due collector jobs as one snapshot, then due maintenance jobs """
+    for name in names:
+        if name in PREPARATION and connect_database() is not None:
+            run_job(name, PREPARATION[name])
+    run_job("collectors", run_collectors, [name for name in names if name in COLLECTORS])
+    for name in names:
+        if name in MAINTENANCE and connect_database() is not None:
+            run_job(name, MAINTENANCE[name])
+
+
+def run_daemon():
+    """ Keep running as a resident collector, every job at its own interval """
+    scheduler = Scheduler(COLLECTOR_INTERVALS)
+    # stop after the current cycle on SIGTERM or SIGINT
+    signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
+    signal.signal(signal.SIGINT, lambda *_: scheduler.stop())
+    print(f"Starting collector: {scheduler}")
+    scheduler.run_forever(run_jobs)
 
 
 def main():
     """Retrieving token data from Ocean API and saving to PostgreSQL database"""
-    # DeFiChain address to retrieve tokens from
-    address = "df1q9qtltnhkn3f5wnjmjddq02tw32lfk0tuu9zl8h"
-    url_tokens = f"https://Ocean.defichain.com/v0/mainnet/address/{address}/tokens"
-
-    while True:
-        req = requests.get(url_tokens, timeout=10)
-        if req.status_code == 200:
-            # parse token data retrieved from Ocean API
-            parse_token_data(req)
-            break
-        time.sleep(1)
-
-    # DeFiChain Vault id to retrieve vault details from
-    vault_id = "f8f7333cb0d81dd4293c49ce2101328ecf297678ec442f7a7131f2ed088f8601"
-
-    url_vault = f"https://Ocean.defichain.com/v0/mainnet/loans/vaults/{vault_id}"
-
-    while True:
-        req_vault = requests.get(url_vault, timeout=10)
-        if req_vault.status_code == 200:
-            # parse vault data retrieved from Ocean API
-            parse_vault_data(req_vault)
-            break
-        time.sleep(1)
-
-    # get token prices from Ocean API
-    get_token_prices()
-
-    # Save (commit) the changes
-    con.commit()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and collect at the COLLECTOR_INTERVAL_* intervals")
+    args = parser.parse_args()
+
+    # exit process if connect() returned error
+    if connect_database() is None:
+        sys.exit(0)
+    register_owners()
+
+    if args.daemon:
+        run_daemon()
+    else:
+        run_jobs(list(PREPARATION) + list(COLLECTORS) + list(MAINTENANCE))
+
+    # show Ocean API latency per endpoint
+    for endpoint, metrics in ocean.metrics.summary().items():
+        print(f"{endpoint}: {metrics['requests']} requests, {metrics['errors']} errors, "
+              f"p50 {metrics['p50']:.3f}s, p95 {metrics['p95']:.3f}s")
+    ocean.close()
+
     cursor.close()
     # Close the connection
     con.close()
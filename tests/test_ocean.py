@@ -0,0 +1,57 @@
+"""Tests of the Ocean API client retries and circuit breaker, without network"""
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.ocean import CircuitBreaker, CircuitOpenError, OceanClient, OceanError  # noqa: E402
+
+
+def response(status_code, headers=None, content=b"{}"):
+    """ Build a response, with an empty JSON body by default """
+    res = requests.Response()
+    res.status_code = status_code
+    res.headers.update(headers or {})
+    res._content = content
+    return res
+
+
+def client_answering(status_code, headers=None, failure_threshold=2, max_retries=3, content=b"{}"):
+    """ Get a client whose every request is answered with status_code, and the list of requested urls """
+    client = OceanClient("http://ocean.invalid/v0/mainnet", max_retries=max_retries, backoff_base=0,
+                         circuit_breaker=CircuitBreaker(failure_threshold=failure_threshold))
+    requested = []
+
+    def get(url, params=None, timeout=None):
+        requested.append(url)
+        return response(status_code, headers, content)
+    client.session.get = get
+    return client, requested
+
+
+def test_rate_limited_requests_do_not_open_circuit():
+    client, requested = client_answering(429, {"Retry-After": "0"})
+    for _ in range(3):
+        with pytest.raises(OceanError) as err:
+            client.get("/poolpairs/{token_id}", token_id=4)
+        assert not isinstance(err.value, CircuitOpenError)
+    # every attempt of every request reached the server, 12 throttled responses in a row
+    assert len(requested) == 3 * 4
+    assert client.circuit_breaker.state == "closed"
+
+
+def test_server_errors_open_circuit():
+    client, requested = client_answering(503)
+    with pytest.raises(CircuitOpenError):
+        client.get("/poolpairs/{token_id}", token_id=4)
+    assert len(requested) == 2
+    assert client.circuit_breaker.state == "open"
+
+
+def test_invalid_json_is_ocean_error():
+    client, requested = client_answering(200, content=b"<html>Bad Gateway</html>")
+    with pytest.raises(OceanError):
+        client.get("/poolpairs/{token_id}", token_id=4)
+    assert len(requested) == 1
@@ -67,7 +67,7 @@ def get_historical_holdings_chart(data):
     )
 
     lines = (
-        alt.Chart(data, title="Evolution of holdings against current prices.")
+        alt.Chart(data, title="Evolution of holdings at the prices of the time.")
         .mark_line()
         .encode(
             x="created_at",
@@ -0,0 +1,57 @@
+"""Current state helper functions: the latest row of every series of the history tables"""
+
+# history tables with their current state table, the columns identifying a row and the columns that are
+# copied over, the current state tables themselves are created by the schema migrations. Tables with
+# "owners" hold rows of many addresses or vaults, a snapshot only replaces the rows of the owners it collected
+CURRENT_TABLES = {
+    "defichain_holdings": {
+        "table": "current_holdings",
+        "keys": ["owner_id", "token_id"],
+        "owners": True,
+        "values": ["snapshot_id", "created_at", "amount", "tokenA_reserve", "tokenB_reserve",
+                   "priceratio_ab", "priceratio_ba", "total_liquidity_token", "total_liquidity_usd",
+                   "apr_reward", "apr_commission", "volume_h24", "volume_d30"],
+    },
+    "vaults": {
+        "table": "current_vaults",
+        "keys": ["vault_id"],
+        "owners": True,
+        "values": ["id", "snapshot_id", "created_at", "collateral_ratio", "collateral_value",
+                   "loan_value", "interest_value", "owner_id"],
+    },
+    "vault_amounts": {
+        "table": "current_vault_amounts",
+        "keys": ["owner_id", "token_type", "token_id"],
+        "owners": True,
+        "values": ["vault_id", "snapshot_id", "created_at", "amount", "price_key_id", "active_price",
+                   "next_price"],
+    },
+    "coin_prices": {
+        "table": "current_prices",
+        "keys": ["symbol"],
+        "values": ["snapshot_id", "created_at", "pair", "price"],
+    },
+}
+
+
+def update_current_state(cursor, snapshot, tables, owner_ids=None):
+    """ Upsert the rows a snapshot saved in the given history tables into their current state tables
+    and remove rows the snapshot no longer has, only of owner_ids when given. Run it in the transaction
+    of the snapshot """
+    for table in tables:
+        spec = CURRENT_TABLES[table]
+        keys = ", ".join(spec["keys"])
+        columns = ", ".join(spec["keys"] + spec["values"])
+        updates = ", ".join(f"{value} = excluded.{value}" for value in spec["values"])
+        # rows of owners that were not collected, e.g. after an Ocean API error, are kept
+        scope = "AND owner_id = ANY(%(owner_ids)s)" if spec.get("owners") and owner_ids is not None else ""
+        cursor.execute(f'''
+            INSERT INTO {spec["table"]} ({columns})
+            SELECT {columns}
+            FROM {table}
+            WHERE snapshot_id = %(snapshot_id)s AND created_at = %(created_at)s
+            ON CONFLICT ({keys})
+            DO UPDATE SET {updates};
+            DELETE FROM {spec["table"]} WHERE snapshot_id <> %(snapshot_id)s {scope};
+        ''', {"snapshot_id": snapshot.snapshot_id, "created_at": snapshot.created_at,
+              "owner_ids": list(owner_ids or [])})
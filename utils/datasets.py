@@ -0,0 +1,46 @@
+"""Dashboard dataset helper functions: DataFrames the dashboard shows computed from the results of the named
+queries. Every function takes a store with get(name, params) that returns query results and a params dict,
+query results are shared and never modified"""
+from utils import portfolio
+
+
+def vault_values(data_store, params):
+    """Get vault token amounts of a portfolio with their active and next value"""
+    df_vault = data_store.get("vault", params)
+    return df_vault.assign(active_value=df_vault["amount"] * df_vault["active_price"],
+                           next_value=df_vault["amount"] * df_vault["next_price"])
+
+
+def holdings(data_store, params):
+    """Get current holdings of a portfolio per coin valued with the latest prices: liquidity pool tokens
+    are split into their token A and B share and the vault collateral is added"""
+    df_vault = data_store.get("vault", params)
+    df_vault_coll = df_vault[df_vault["token_type"] == 'collateral'][["symbol", "amount"]]
+    df_prices = data_store.get("prices").set_index("symbol")
+    return portfolio.holdings_value(data_store.get("tokens", params), df_prices, df_vault_coll).rename(
+        columns={'symbol': 'Coin', 'amount': 'Amount', 'value': 'Amount (USD)'})
+
+
+def historical_holdings(data_store, params):
+    """Get historical holdings of a portfolio per coin and time bucket, every bucket is valued with the
+    latest price of its coin at that time, not with the current prices"""
+    df = portfolio.valuate_asof(data_store.get("historical_amounts", params),
+                                data_store.get("historical_prices", {"bucket": params["bucket"]})).rename(
+        columns={'symbol': 'Coin', 'amount': 'Amount', 'value': 'Amount (USD)'})
+    df['Amount (USD)'] = df['Amount (USD)'].round(2)
+    return df
+
+
+def rewards(data_store, params):
+    """Get reward APR% of the liquidity pool tokens of a portfolio per time bucket with their total"""
+    df_rewards = data_store.get("rewards", params)
+    return df_rewards.assign(apr_total=(df_rewards["apr_reward"] + df_rewards["apr_commission"]).round(3))
+
+
+# datasets by name, computed once per snapshot for all sessions like the queries
+DATASETS = {
+    "vault_values": vault_values,
+    "holdings": holdings,
+    "historical_holdings": historical_holdings,
+    "apr": rewards,
+}
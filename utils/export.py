@@ -0,0 +1,227 @@
+"""Export helper functions: history tables as Parquet files partitioned by month and token"""
+import io
+import json
+import os
+import re
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.fs as pa_fs
+import pyarrow.parquet as pq
+
+# history tables with the column they are partitioned by next to the month, rows are appended
+# by snapshot id. Dimension tables are small and rewritten as a whole on every export
+HISTORY_TABLES = {
+    "defichain_holdings": "token_id",
+    "vault_amounts": "token_id",
+    "coin_prices": "symbol",
+}
+DIMENSION_TABLES = ["defichain_tokens", "price_keys", "owners"]
+
+# max snapshots per COPY round trip, bounds memory use of the first export of a long history
+BATCH_SNAPSHOTS = 10000
+
+# a partition directory with more files than this is rewritten into one file
+COMPACT_FILES = 24
+
+# PostgreSQL data types with their Arrow type, other types are exported as string
+ARROW_TYPES = {
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "real": pa.float32(),
+    "double precision": pa.float64(),
+    "numeric": pa.float64(),
+    "boolean": pa.bool_(),
+    "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+}
+
+# name of the file holding the last exported snapshot id of a table, ignored by dataset discovery
+STATE_FILE = "_export.json"
+
+# exported files are named after the first and last snapshot id of their batch
+BATCH_FILE = re.compile(r"^snapshots-(-?\d+)-(-?\d+)-\d+\.parquet$")
+
+# a compacted file is written under this name with its sources recorded in COMPACT_STATE, both ignored by
+# dataset discovery, until its sources are removed
+COMPACT_TEMP = "_compacting.parquet"
+COMPACT_STATE = "_compacting.json"
+
+
+def table_schema(cursor, table):
+    """ Get Arrow schema of a table from its PostgreSQL column types """
+    cursor.execute('''
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position;
+    ''', (table,))
+    return pa.schema([(column, ARROW_TYPES.get(data_type, pa.string()))
+                      for column, data_type in cursor.fetchall()])
+
+
+def copy_arrow(cursor, sql, schema, params=None):
+    """ Stream the result of a query through COPY TO STDOUT as CSV and parse it into an Arrow table
+    with the column types of schema, no Python object is built per row or value """
+    # timestamps are sent with a +00 offset, until the end of the transaction
+    cursor.execute("SET LOCAL TIME ZONE 'UTC';")
+    buffer = io.BytesIO()
+    cursor.copy_expert(cursor.mogrify(f"COPY ({sql.strip().rstrip(';')}) TO STDOUT WITH (FORMAT csv, HEADER)",
+                                      params).decode(), buffer)
+    buffer.seek(0)
+    return pa_csv.read_csv(buffer, convert_options=pa_csv.ConvertOptions(
+        column_types={field.name: field.type for field in schema},
+        strings_can_be_null=True, true_values=["t"], false_values=["f"]))
+
+
+def read_state(directory, table):
+    """ Get last exported snapshot id of a table, None before the first export """
+    path = os.path.join(directory, table, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)["snapshot_id"]
+
+
+def write_json(path, data):
+    """ Write a JSON file under a temporary name and rename it, a reader never finds it half written """
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def write_state(directory, table, snapshot_id):
+    """ Save last exported snapshot id of a table """
+    write_json(os.path.join(directory, table, STATE_FILE), {"snapshot_id": snapshot_id})
+
+
+def partitioning(schema, column):
+    """ Get hive partitioning by month and token column of a history table """
+    return ds.partitioning(pa.schema([("month", pa.string()), schema.field(column)]), flavor="hive")
+
+
+def recover(directory, table, last_id):
+    """ Clean up after an export of a table that stopped halfway: finish its interrupted compactions and
+    remove the files of batches after the last exported snapshot, written before it saved its state.
+    Those batches are exported again """
+    for path, _, names in os.walk(os.path.join(directory, table)):
+        if COMPACT_TEMP in names or COMPACT_STATE in names:
+            finish_compaction(path)
+        for name in names:
+            match = BATCH_FILE.match(name)
+            if match and int(match.group(1)) > last_id:
+                os.remove(os.path.join(path, name))
+
+
+def finish_compaction(path):
+    """ Finish an interrupted compaction of a partition directory: remove the sources of its compacted
+    file and give the file its name, or drop the file if its sources were not recorded yet """
+    temp_path = os.path.join(path, COMPACT_TEMP)
+    state_path = os.path.join(path, COMPACT_STATE)
+    if not os.path.exists(state_path):
+        # all sources are still there
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return
+    with open(state_path, encoding="utf-8") as file:
+        state = json.load(file)
+    for name in state["sources"]:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    if os.path.exists(temp_path):
+        os.replace(temp_path, os.path.join(path, state["name"]))
+    os.remove(state_path)
+
+
+def compact(path):
+    """ Rewrite all Parquet files of a partition directory into one file. Readers never see the rows of
+    the compacted file and of its sources at the same time, an interrupted compaction is finished by the
+    next one """
+    finish_compaction(path)
+    files = sorted(name for name in os.listdir(path) if name.endswith(".parquet") and name != COMPACT_TEMP)
+    if len(files) <= COMPACT_FILES:
+        return
+    table = ds.dataset([os.path.join(path, name) for name in files], format="parquet").to_table()
+    pq.write_table(table, os.path.join(path, COMPACT_TEMP))
+    # named after the newest file, that sorts after an earlier compacted file
+    write_json(os.path.join(path, COMPACT_STATE), {"sources": files, "name": f"compacted-{files[-1]}"})
+    finish_compaction(path)
+
+
+def export_table(cursor, directory, table):
+    """ Append the rows of all snapshots saved since the last export of a history table,
+    returns the number of exported rows """
+    column = HISTORY_TABLES[table]
+    schema = table_schema(cursor, table)
+    last_id = read_state(directory, table)
+    # the first export starts before the first snapshot, snapshots of rows saved before snapshots were
+    # introduced have ids of 0 and below
+    cursor.execute("SELECT coalesce(min(id) - 1, 0), coalesce(max(id), 0) FROM snapshots;")
+    first_id, until_id = cursor.fetchone()
+    if last_id is None:
+        last_id = first_id
+    os.makedirs(os.path.join(directory, table), exist_ok=True)
+    recover(directory, table, last_id)
+    rows = 0
+    touched = set()
+
+    def visit(written):
+        touched.add(os.path.dirname(written.path))
+
+    for start in range(last_id, until_id, BATCH_SNAPSHOTS):
+        end = min(start + BATCH_SNAPSHOTS, until_id)
+        batch = copy_arrow(cursor, f"SELECT * FROM {table} "
+                                   "WHERE snapshot_id > %(start)s AND snapshot_id <= %(end)s",
+                           schema, {"start": start, "end": end})
+        if batch.num_rows:
+            batch = batch.append_column("month", pc.strftime(batch["created_at"], format="%Y-%m"))
+            # every batch gets its own file names, earlier exports are never overwritten. Files of a batch
+            # whose state was not saved are removed by recover before the batch is written again
+            ds.write_dataset(batch, os.path.join(directory, table), format="parquet",
+                             partitioning=partitioning(schema, column),
+                             basename_template=f"snapshots-{start + 1:010d}-{end:010d}-{{i}}.parquet",
+                             existing_data_behavior="overwrite_or_ignore", file_visitor=visit)
+            rows += batch.num_rows
+        write_state(directory, table, end)
+    for path in touched:
+        compact(path)
+    return rows
+
+
+def export_dimensions(cursor, directory):
+    """ Rewrite the dimension tables as one Parquet file each """
+    for table in DIMENSION_TABLES:
+        schema = table_schema(cursor, table)
+        os.makedirs(os.path.join(directory, table), exist_ok=True)
+        ds.write_dataset(copy_arrow(cursor, f"SELECT * FROM {table}", schema),
+                         os.path.join(directory, table), format="parquet", basename_template="part-{i}.parquet",
+                         existing_data_behavior="delete_matching")
+
+
+def export_history(cursor, directory):
+    """ Export the dimension tables and append new snapshots of all history tables,
+    returns dict with the number of exported rows per history table """
+    export_dimensions(cursor, directory)
+    return {table: export_table(cursor, directory, table) for table in HISTORY_TABLES}
+
+
+def dataset(directory, table):
+    """ Open an exported table as memory mapped Arrow dataset, history tables get their
+    month and token partition columns back """
+    path = os.path.join(directory, table)
+    filesystem = pa_fs.LocalFileSystem(use_mmap=True)
+    if table in HISTORY_TABLES:
+        return ds.dataset(path, format="parquet", filesystem=filesystem, partitioning="hive")
+    return ds.dataset(path, format="parquet", filesystem=filesystem)
+
+
+def read_history(directory, table, columns=None, since=None):
+    """ Read an exported table as DataFrame, optionally only some columns and rows created since
+    a point in time; only month partitions that can hold such rows are read """
+    data = dataset(directory, table)
+    condition = None
+    if since is not None:
+        condition = (ds.field("month") >= since.strftime("%Y-%m")) & (ds.field("created_at") >= since)
+    return data.to_table(columns=columns, filter=condition).to_pandas()
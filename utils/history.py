@@ -0,0 +1,42 @@
+"""History helper functions: bucketed results of the whole history queries kept in memory and brought up
+to date with the buckets of new snapshots only"""
+import threading
+
+import pandas as pd
+
+
+class History():
+    """ Thread-safe result of a named history query with a since parameter, e.g. historical_amounts.
+    New snapshots and rollup refreshes only change the last bucket a result holds and add later ones,
+    so a refresh reads the buckets from the start of the last bucket onwards and replaces them.
+    The DataFrame is shared by all callers and must not be modified """
+
+    def __init__(self, name, params, time_column="created_at"):
+        self.name = name
+        self.params = dict(params)
+        self.time_column = time_column
+        self.df = None
+        self.snapshot_id = None
+        # rows read by the last refresh, the whole result on the first one
+        self.rows_read = 0
+        self.lock = threading.Lock()
+
+    def refresh(self, read, snapshot_id):
+        """ Bring the result up to date with snapshot_id and return it, read(name, params) runs the query.
+        The query is not run again while snapshot_id stays the same """
+        with self.lock:
+            if self.df is not None and self.snapshot_id == snapshot_id:
+                return self.df
+            if self.df is None or self.df.empty:
+                df = read(self.name, self.params)
+                self.rows_read = len(df)
+            else:
+                since = self.df[self.time_column].max()
+                new = read(self.name, {**self.params, "since": since})
+                self.rows_read = len(new)
+                df = pd.concat([self.df[self.df[self.time_column] < since], new], ignore_index=True)
+            self.df, self.snapshot_id = df, snapshot_id
+            return df
+
+    def __str__(self):
+        return f"[History] {self.name} {self.params} at snapshot {self.snapshot_id}"
@@ -0,0 +1,525 @@
+"""Versioned PostgreSQL schema migrations"""
+import re
+
+from psycopg2 import OperationalError
+
+from utils import postgresql
+
+# migrations as (version, description, sql), applied in order and recorded in schema_migrations.
+# Applied migrations are never edited, schema changes are added as a new migration
+MIGRATIONS = [
+    (1, "baseline schema", '''
+        CREATE TABLE IF NOT EXISTS snapshots
+        (
+            id INTEGER UNIQUE GENERATED ALWAYS AS IDENTITY,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS defichain_tokens
+        (
+            token_id SMALLINT UNIQUE,
+            created_at TIMESTAMP WITH TIME ZONE,
+            symbol VARCHAR, name VARCHAR,
+            isdAT BOOL DEFAULT FALSE,
+            isLPS BOOL DEFAULT FALSE,
+            isLoanToken BOOL DEFAULT FALSE,
+            tokenA_id SMALLINT REFERENCES defichain_tokens(token_id),
+            tokenB_id SMALLINT REFERENCES defichain_tokens(token_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS defichain_holdings
+        (
+            snapshot_id INTEGER REFERENCES snapshots(id),
+            token_id SMALLINT REFERENCES defichain_tokens(token_id),
+            created_at TIMESTAMP WITH TIME ZONE,
+            amount REAL,
+            tokenA_reserve REAL,
+            tokenB_reserve REAL,
+            priceratio_ab REAL,
+            priceratio_ba REAL,
+            total_liquidity_token REAL,
+            total_liquidity_usd REAL,
+            apr_reward REAL,
+            apr_commission REAL,
+            volume_h24 REAL,
+            volume_d30 REAL
+        );
+
+        CREATE TABLE IF NOT EXISTS vaults
+        (   id INTEGER UNIQUE GENERATED ALWAYS AS IDENTITY,
+            vault_id VARCHAR,
+            snapshot_id INTEGER REFERENCES snapshots(id),
+            created_at TIMESTAMP WITH TIME ZONE,
+            collateral_ratio REAL,
+            collateral_value REAL,
+            loan_value REAL,
+            interest_value REAL
+        );
+
+        CREATE TABLE IF NOT EXISTS vault_amounts
+        (
+            vault_id INTEGER REFERENCES vaults(id),
+            snapshot_id INTEGER REFERENCES snapshots(id),
+            created_at TIMESTAMP WITH TIME ZONE,
+            token_id SMALLINT REFERENCES defichain_tokens(token_id),
+            token_type VARCHAR,
+            amount REAL,
+            price_key VARCHAR,
+            active_price REAL,
+            next_price REAL
+        );
+
+        CREATE TABLE IF NOT EXISTS coin_prices
+        (
+            symbol VARCHAR,
+            snapshot_id INTEGER REFERENCES snapshots(id),
+            created_at TIMESTAMP WITH TIME ZONE,
+            pair VARCHAR,
+            price REAL
+        );
+
+        -- databases created before snapshots were introduced
+        ALTER TABLE defichain_holdings ADD COLUMN IF NOT EXISTS snapshot_id INTEGER REFERENCES snapshots(id);
+        ALTER TABLE vaults ADD COLUMN IF NOT EXISTS snapshot_id INTEGER REFERENCES snapshots(id);
+        ALTER TABLE vault_amounts ADD COLUMN IF NOT EXISTS snapshot_id INTEGER REFERENCES snapshots(id);
+        ALTER TABLE coin_prices ADD COLUMN IF NOT EXISTS snapshot_id INTEGER REFERENCES snapshots(id);
+
+        CREATE INDEX IF NOT EXISTS idx_defichain_tokens_symbol
+        ON defichain_tokens(symbol);
+    '''),
+    (2, "hourly and daily rollup tables", '''
+        CREATE TABLE IF NOT EXISTS defichain_holdings_hourly
+        (
+            bucket TIMESTAMP WITH TIME ZONE,
+            token_id SMALLINT,
+            samples INTEGER,
+            amount_min REAL, amount_max REAL, amount_avg REAL, amount_last REAL,
+            tokenA_reserve_min REAL, tokenA_reserve_max REAL, tokenA_reserve_avg REAL, tokenA_reserve_last REAL,
+            tokenB_reserve_min REAL, tokenB_reserve_max REAL, tokenB_reserve_avg REAL, tokenB_reserve_last REAL,
+            total_liquidity_token_min REAL, total_liquidity_token_max REAL,
+            total_liquidity_token_avg REAL, total_liquidity_token_last REAL,
+            apr_reward_min REAL, apr_reward_max REAL, apr_reward_avg REAL, apr_reward_last REAL,
+            apr_commission_min REAL, apr_commission_max REAL, apr_commission_avg REAL, apr_commission_last REAL,
+            PRIMARY KEY (bucket, token_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS defichain_holdings_daily
+        (LIKE defichain_holdings_hourly INCLUDING ALL);
+
+        CREATE TABLE IF NOT EXISTS vault_amounts_hourly
+        (
+            bucket TIMESTAMP WITH TIME ZONE,
+            token_id SMALLINT,
+            token_type VARCHAR,
+            samples INTEGER,
+            amount_min REAL, amount_max REAL, amount_avg REAL, amount_last REAL,
+            active_price_min REAL, active_price_max REAL, active_price_avg REAL, active_price_last REAL,
+            PRIMARY KEY (bucket, token_id, token_type)
+        );
+
+        CREATE TABLE IF NOT EXISTS vault_amounts_daily
+        (LIKE vault_amounts_hourly INCLUDING ALL);
+
+        CREATE TABLE IF NOT EXISTS coin_prices_hourly
+        (
+            bucket TIMESTAMP WITH TIME ZONE,
+            symbol VARCHAR,
+            samples INTEGER,
+            price_min REAL, price_max REAL, price_avg REAL, price_last REAL,
+            PRIMARY KEY (bucket, symbol)
+        );
+
+        CREATE TABLE IF NOT EXISTS coin_prices_daily
+        (LIKE coin_prices_hourly INCLUDING ALL);
+    '''),
+    (3, "composite and BRIN indexes for the hot queries", '''
+        -- redundant with the UNIQUE constraint on token_id
+        DROP INDEX IF EXISTS idx_defichain_tokens_token_id;
+
+        -- latest snapshot lookups: max(snapshot_id) and snapshot_id = ...
+        CREATE INDEX IF NOT EXISTS idx_defichain_holdings_snapshot_id ON defichain_holdings(snapshot_id);
+        CREATE INDEX IF NOT EXISTS idx_vaults_snapshot_id ON vaults(snapshot_id);
+        CREATE INDEX IF NOT EXISTS idx_vault_amounts_snapshot_id ON vault_amounts(snapshot_id);
+        CREATE INDEX IF NOT EXISTS idx_coin_prices_snapshot_id ON coin_prices(snapshot_id);
+
+        -- per token time series, e.g. token_id = 0 and created_at > ...
+        CREATE INDEX IF NOT EXISTS idx_defichain_holdings_token_id_created_at
+        ON defichain_holdings(token_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_vault_amounts_token_id_created_at
+        ON vault_amounts(token_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_coin_prices_symbol_created_at
+        ON coin_prices(symbol, created_at);
+
+        -- join from the latest vault to its amounts
+        CREATE INDEX IF NOT EXISTS idx_vault_amounts_vault_id ON vault_amounts(vault_id);
+        CREATE INDEX IF NOT EXISTS idx_vaults_created_at ON vaults(created_at);
+
+        -- append-only tables are physically ordered by created_at, so a BRIN index
+        -- covers time range scans (rollup refresh, compaction, history) at a fraction of the size
+        CREATE INDEX IF NOT EXISTS brin_defichain_holdings_created_at
+        ON defichain_holdings USING BRIN (created_at);
+        CREATE INDEX IF NOT EXISTS brin_vault_amounts_created_at
+        ON vault_amounts USING BRIN (created_at);
+        CREATE INDEX IF NOT EXISTS brin_coin_prices_created_at
+        ON coin_prices USING BRIN (created_at);
+    '''),
+    (4, "monthly range partitioning of the history tables", '''
+        -- create the monthly partitions of a table that cover from_ts up to and including to_ts,
+        -- partitions are named <table>_YYYY_MM and bounded by UTC month starts
+        CREATE OR REPLACE FUNCTION create_monthly_partitions(parent TEXT, from_ts TIMESTAMPTZ, to_ts TIMESTAMPTZ)
+        RETURNS VOID AS $$
+        DECLARE
+            month TIMESTAMP := date_trunc('month', from_ts AT TIME ZONE 'UTC');
+        BEGIN
+            WHILE month <= to_ts AT TIME ZONE 'UTC' LOOP
+                EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               parent || '_' || to_char(month, 'YYYY_MM'), parent,
+                               month AT TIME ZONE 'UTC', (month + interval '1 month') AT TIME ZONE 'UTC');
+                month := month + interval '1 month';
+            END LOOP;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- move every table into a partitioned table with the same columns,
+        -- with partitions from its oldest row up to two months ahead
+        DO $$
+        DECLARE
+            t TEXT;
+        BEGIN
+            FOREACH t IN ARRAY ARRAY['defichain_holdings', 'vault_amounts', 'coin_prices'] LOOP
+                EXECUTE format('ALTER TABLE %I RENAME TO %I', t, t || '_unpartitioned');
+                EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)',
+                               t, t || '_unpartitioned');
+                EXECUTE format('SELECT create_monthly_partitions(%L, coalesce(min(created_at), now()), '
+                               'now() + interval ''2 months'') FROM %I', t, t || '_unpartitioned');
+                EXECUTE format('INSERT INTO %I SELECT * FROM %I', t, t || '_unpartitioned');
+                EXECUTE format('DROP TABLE %I', t || '_unpartitioned');
+            END LOOP;
+        END $$;
+
+        ALTER TABLE defichain_holdings ALTER COLUMN created_at SET NOT NULL;
+        ALTER TABLE vault_amounts ALTER COLUMN created_at SET NOT NULL;
+        ALTER TABLE coin_prices ALTER COLUMN created_at SET NOT NULL;
+
+        ALTER TABLE defichain_holdings
+            ADD FOREIGN KEY (snapshot_id) REFERENCES snapshots(id),
+            ADD FOREIGN KEY (token_id) REFERENCES defichain_tokens(token_id);
+        ALTER TABLE vault_amounts
+            ADD FOREIGN KEY (vault_id) REFERENCES vaults(id),
+            ADD FOREIGN KEY (snapshot_id) REFERENCES snapshots(id),
+            ADD FOREIGN KEY (token_id) REFERENCES defichain_tokens(token_id);
+        ALTER TABLE coin_prices
+            ADD FOREIGN KEY (snapshot_id) REFERENCES snapshots(id);
+
+        -- indexes on the partitioned tables are created on every partition
+        CREATE INDEX idx_defichain_holdings_snapshot_id ON defichain_holdings(snapshot_id);
+        CREATE INDEX idx_vault_amounts_snapshot_id ON vault_amounts(snapshot_id);
+        CREATE INDEX idx_coin_prices_snapshot_id ON coin_prices(snapshot_id);
+        CREATE INDEX idx_defichain_holdings_token_id_created_at ON defichain_holdings(token_id, created_at);
+        CREATE INDEX idx_vault_amounts_token_id_created_at ON vault_amounts(token_id, created_at);
+        CREATE INDEX idx_coin_prices_symbol_created_at ON coin_prices(symbol, created_at);
+        CREATE INDEX idx_vault_amounts_vault_id ON vault_amounts(vault_id);
+        CREATE INDEX brin_defichain_holdings_created_at ON defichain_holdings USING BRIN (created_at);
+        CREATE INDEX brin_vault_amounts_created_at ON vault_amounts USING BRIN (created_at);
+        CREATE INDEX brin_coin_prices_created_at ON coin_prices USING BRIN (created_at);
+    '''),
+    (5, "current state tables", '''
+        -- latest row of every series, upserted by the collector in the transaction of each snapshot
+        CREATE TABLE current_holdings (LIKE defichain_holdings INCLUDING DEFAULTS, PRIMARY KEY (token_id));
+        CREATE TABLE current_vaults (LIKE vaults, PRIMARY KEY (vault_id));
+        CREATE TABLE current_vault_amounts (LIKE vault_amounts INCLUDING DEFAULTS, PRIMARY KEY (token_type, token_id));
+        CREATE TABLE current_prices (LIKE coin_prices INCLUDING DEFAULTS, PRIMARY KEY (symbol));
+
+        INSERT INTO current_holdings
+        SELECT * FROM defichain_holdings WHERE snapshot_id = (SELECT max(snapshot_id) FROM defichain_holdings);
+        INSERT INTO current_vaults
+        SELECT * FROM vaults WHERE snapshot_id = (SELECT max(snapshot_id) FROM vaults);
+        INSERT INTO current_vault_amounts
+        SELECT * FROM vault_amounts WHERE snapshot_id = (SELECT max(snapshot_id) FROM vault_amounts);
+        INSERT INTO current_prices
+        SELECT * FROM coin_prices WHERE snapshot_id = (SELECT max(snapshot_id) FROM coin_prices);
+    '''),
+    (6, "exact amounts, token type enum and price key dimension", '''
+        CREATE TYPE vault_token_type AS ENUM ('collateral', 'loan');
+
+        CREATE TABLE price_keys
+        (
+            id SMALLINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+            price_key VARCHAR UNIQUE NOT NULL
+        );
+        INSERT INTO price_keys (price_key)
+        SELECT DISTINCT price_key FROM vault_amounts WHERE price_key IS NOT NULL ORDER BY 1;
+
+        -- lookup for the price key conversions below, USING clauses cannot hold subqueries
+        CREATE FUNCTION price_key_id(key VARCHAR) RETURNS SMALLINT AS $$
+            SELECT id FROM price_keys WHERE price_key = key;
+        $$ LANGUAGE sql STABLE;
+
+        -- on chain amounts and oracle prices have 8 decimals and are stored exactly, ratios, APR and
+        -- USD values are derived by Ocean and stay REAL. Every table is rewritten once
+        ALTER TABLE defichain_holdings
+            ALTER COLUMN amount TYPE NUMERIC,
+            ALTER COLUMN tokenA_reserve TYPE NUMERIC,
+            ALTER COLUMN tokenB_reserve TYPE NUMERIC,
+            ALTER COLUMN total_liquidity_token TYPE NUMERIC;
+        ALTER TABLE current_holdings
+            ALTER COLUMN amount TYPE NUMERIC,
+            ALTER COLUMN tokenA_reserve TYPE NUMERIC,
+            ALTER COLUMN tokenB_reserve TYPE NUMERIC,
+            ALTER COLUMN total_liquidity_token TYPE NUMERIC;
+        ALTER TABLE vault_amounts
+            ALTER COLUMN token_type TYPE vault_token_type USING token_type::vault_token_type,
+            ALTER COLUMN price_key TYPE SMALLINT USING price_key_id(price_key),
+            ALTER COLUMN amount TYPE NUMERIC,
+            ALTER COLUMN active_price TYPE NUMERIC,
+            ALTER COLUMN next_price TYPE NUMERIC;
+        ALTER TABLE current_vault_amounts
+            ALTER COLUMN token_type TYPE vault_token_type USING token_type::vault_token_type,
+            ALTER COLUMN price_key TYPE SMALLINT USING price_key_id(price_key),
+            ALTER COLUMN amount TYPE NUMERIC,
+            ALTER COLUMN active_price TYPE NUMERIC,
+            ALTER COLUMN next_price TYPE NUMERIC;
+        ALTER TABLE coin_prices ALTER COLUMN price TYPE NUMERIC;
+        ALTER TABLE current_prices ALTER COLUMN price TYPE NUMERIC;
+        ALTER TABLE vault_amounts_hourly
+            ALTER COLUMN token_type TYPE vault_token_type USING token_type::vault_token_type;
+        ALTER TABLE vault_amounts_daily
+            ALTER COLUMN token_type TYPE vault_token_type USING token_type::vault_token_type;
+
+        ALTER TABLE vault_amounts RENAME COLUMN price_key TO price_key_id;
+        ALTER TABLE current_vault_amounts RENAME COLUMN price_key TO price_key_id;
+        ALTER TABLE vault_amounts ADD FOREIGN KEY (price_key_id) REFERENCES price_keys(id);
+        ALTER TABLE current_vault_amounts ADD FOREIGN KEY (price_key_id) REFERENCES price_keys(id);
+        DROP FUNCTION price_key_id(VARCHAR);
+
+        -- history tables are append only and keep the default fillfactor of 100, the current state
+        -- tables are updated every snapshot and the rollup tables every refresh, free space in their
+        -- pages lets the updates stay on the same page (HOT)
+        ALTER TABLE current_holdings SET (fillfactor = 50);
+        ALTER TABLE current_vaults SET (fillfactor = 50);
+        ALTER TABLE current_vault_amounts SET (fillfactor = 50);
+        ALTER TABLE current_prices SET (fillfactor = 50);
+        ALTER TABLE defichain_holdings_hourly SET (fillfactor = 90);
+        ALTER TABLE defichain_holdings_daily SET (fillfactor = 90);
+        ALTER TABLE vault_amounts_hourly SET (fillfactor = 90);
+        ALTER TABLE vault_amounts_daily SET (fillfactor = 90);
+        ALTER TABLE coin_prices_hourly SET (fillfactor = 90);
+        ALTER TABLE coin_prices_daily SET (fillfactor = 90);
+    '''),
+    (7, "owner dimension for multiple addresses and vaults", '''
+        CREATE TYPE owner_type AS ENUM ('address', 'vault');
+
+        -- addresses and vaults the collector tracks, grouped into portfolios for the dashboard filter
+        CREATE TABLE owners
+        (
+            id SMALLINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+            owner_type owner_type NOT NULL,
+            owner_key VARCHAR NOT NULL,
+            portfolio VARCHAR NOT NULL DEFAULT 'default',
+            active BOOL NOT NULL DEFAULT TRUE,
+            UNIQUE (owner_type, owner_key)
+        );
+
+        -- rows saved before owners were tracked belong to the address and vault the collector was hardcoded to
+        INSERT INTO owners (owner_type, owner_key)
+        SELECT 'address', 'df1q9qtltnhkn3f5wnjmjddq02tw32lfk0tuu9zl8h'
+        WHERE EXISTS (SELECT 1 FROM defichain_holdings);
+        INSERT INTO owners (owner_type, owner_key)
+        SELECT DISTINCT 'vault'::owner_type, vault_id FROM vaults WHERE vault_id IS NOT NULL ORDER BY 2;
+
+        ALTER TABLE defichain_holdings ADD COLUMN owner_id SMALLINT REFERENCES owners(id);
+        ALTER TABLE current_holdings ADD COLUMN owner_id SMALLINT REFERENCES owners(id);
+        ALTER TABLE vaults ADD COLUMN owner_id SMALLINT REFERENCES owners(id);
+        ALTER TABLE current_vaults ADD COLUMN owner_id SMALLINT REFERENCES owners(id);
+        ALTER TABLE vault_amounts ADD COLUMN owner_id SMALLINT REFERENCES owners(id);
+        ALTER TABLE current_vault_amounts ADD COLUMN owner_id SMALLINT REFERENCES owners(id);
+        ALTER TABLE defichain_holdings_hourly ADD COLUMN owner_id SMALLINT;
+        ALTER TABLE defichain_holdings_daily ADD COLUMN owner_id SMALLINT;
+        ALTER TABLE vault_amounts_hourly ADD COLUMN owner_id SMALLINT;
+        ALTER TABLE vault_amounts_daily ADD COLUMN owner_id SMALLINT;
+
+        UPDATE defichain_holdings SET owner_id = (SELECT id FROM owners WHERE owner_type = 'address');
+        UPDATE current_holdings SET owner_id = (SELECT id FROM owners WHERE owner_type = 'address');
+        UPDATE defichain_holdings_hourly SET owner_id = (SELECT id FROM owners WHERE owner_type = 'address');
+        UPDATE defichain_holdings_daily SET owner_id = (SELECT id FROM owners WHERE owner_type = 'address');
+        UPDATE vaults SET owner_id = owners.id
+        FROM owners WHERE owner_type = 'vault' AND owner_key = vaults.vault_id;
+        UPDATE current_vaults SET owner_id = owners.id
+        FROM owners WHERE owner_type = 'vault' AND owner_key = current_vaults.vault_id;
+        UPDATE vault_amounts SET owner_id = vaults.owner_id FROM vaults WHERE vaults.id = vault_amounts.vault_id;
+        UPDATE current_vault_amounts SET owner_id = vaults.owner_id
+        FROM vaults WHERE vaults.id = current_vault_amounts.vault_id;
+        -- rollup buckets do not know their vault, there was only one
+        UPDATE vault_amounts_hourly SET owner_id = (SELECT min(id) FROM owners WHERE owner_type = 'vault');
+        UPDATE vault_amounts_daily SET owner_id = (SELECT min(id) FROM owners WHERE owner_type = 'vault');
+
+        ALTER TABLE defichain_holdings ALTER COLUMN owner_id SET NOT NULL;
+        ALTER TABLE vault_amounts ALTER COLUMN owner_id SET NOT NULL;
+
+        -- every owner has its own series, a current row and a rollup bucket per owner and token
+        ALTER TABLE current_holdings DROP CONSTRAINT current_holdings_pkey,
+            ADD PRIMARY KEY (owner_id, token_id);
+        ALTER TABLE current_vault_amounts DROP CONSTRAINT current_vault_amounts_pkey,
+            ADD PRIMARY KEY (owner_id, token_type, token_id);
+        ALTER TABLE defichain_holdings_hourly DROP CONSTRAINT defichain_holdings_hourly_pkey,
+            ADD PRIMARY KEY (bucket, owner_id, token_id);
+        ALTER TABLE defichain_holdings_daily DROP CONSTRAINT defichain_holdings_daily_pkey,
+            ADD PRIMARY KEY (bucket, owner_id, token_id);
+        ALTER TABLE vault_amounts_hourly DROP CONSTRAINT vault_amounts_hourly_pkey,
+            ADD PRIMARY KEY (bucket, owner_id, token_id, token_type);
+        ALTER TABLE vault_amounts_daily DROP CONSTRAINT vault_amounts_daily_pkey,
+            ADD PRIMARY KEY (bucket, owner_id, token_id, token_type);
+
+        -- history of the owners of one portfolio, e.g. owner_id in (...) and created_at > ...
+        CREATE INDEX idx_defichain_holdings_owner_id_created_at ON defichain_holdings(owner_id, created_at);
+        CREATE INDEX idx_vault_amounts_owner_id_created_at ON vault_amounts(owner_id, created_at);
+    '''),
+    (8, "snapshots of the rows saved before snapshots were introduced", '''
+        -- the collector used to stamp every row with its own time, rows less than a minute apart belong to
+        -- the same run and become one snapshot. Their ids come before the snapshots saved since, or start
+        -- at 1 in a database without any, so the latest snapshot stays the one with the highest id
+        CREATE TEMPORARY TABLE legacy_rows ON COMMIT DROP AS
+        SELECT created_at FROM defichain_holdings WHERE snapshot_id IS NULL AND created_at IS NOT NULL
+        UNION SELECT created_at FROM vaults WHERE snapshot_id IS NULL AND created_at IS NOT NULL
+        UNION SELECT created_at FROM vault_amounts WHERE snapshot_id IS NULL AND created_at IS NOT NULL
+        UNION SELECT created_at FROM coin_prices WHERE snapshot_id IS NULL AND created_at IS NOT NULL;
+
+        CREATE TEMPORARY TABLE legacy_runs ON COMMIT DROP AS
+        SELECT created_at, sum(new_run) OVER (ORDER BY created_at) AS run
+        FROM (
+            SELECT created_at,
+                   (lag(created_at) OVER (ORDER BY created_at) IS NULL
+                    OR created_at - lag(created_at) OVER (ORDER BY created_at) > interval '1 minute')::INTEGER
+                   AS new_run
+            FROM legacy_rows
+        ) AS gaps;
+
+        CREATE TEMPORARY TABLE legacy_snapshots ON COMMIT DROP AS
+        SELECT run + coalesce((SELECT min(id) FROM snapshots) - (SELECT max(run) FROM legacy_runs) - 1, 0) AS id,
+               min(created_at) AS created_at, max(created_at) AS until
+        FROM legacy_runs
+        GROUP BY run;
+
+        INSERT INTO snapshots (id, created_at) OVERRIDING SYSTEM VALUE
+        SELECT id, created_at FROM legacy_snapshots ORDER BY id;
+        SELECT setval(pg_get_serial_sequence('snapshots', 'id'), max(id))
+        FROM snapshots HAVING max(id) = (SELECT max(id) FROM legacy_snapshots);
+
+        UPDATE defichain_holdings h SET snapshot_id = s.id FROM legacy_snapshots s
+        WHERE h.snapshot_id IS NULL AND h.created_at BETWEEN s.created_at AND s.until;
+        UPDATE vaults v SET snapshot_id = s.id FROM legacy_snapshots s
+        WHERE v.snapshot_id IS NULL AND v.created_at BETWEEN s.created_at AND s.until;
+        UPDATE vault_amounts va SET snapshot_id = s.id FROM legacy_snapshots s
+        WHERE va.snapshot_id IS NULL AND va.created_at BETWEEN s.created_at AND s.until;
+        UPDATE coin_prices cp SET snapshot_id = s.id FROM legacy_snapshots s
+        WHERE cp.snapshot_id IS NULL AND cp.created_at BETWEEN s.created_at AND s.until;
+
+        -- a database that only has rows of before snapshots gets its current state from its last run
+        INSERT INTO current_holdings
+        SELECT * FROM defichain_holdings WHERE snapshot_id = (SELECT max(snapshot_id) FROM defichain_holdings)
+        AND NOT EXISTS (SELECT 1 FROM current_holdings);
+        INSERT INTO current_vaults
+        SELECT * FROM vaults WHERE snapshot_id = (SELECT max(snapshot_id) FROM vaults)
+        AND NOT EXISTS (SELECT 1 FROM current_vaults);
+        INSERT INTO current_vault_amounts
+        SELECT * FROM vault_amounts WHERE snapshot_id = (SELECT max(snapshot_id) FROM vault_amounts)
+        AND NOT EXISTS (SELECT 1 FROM current_vault_amounts);
+        INSERT INTO current_prices
+        SELECT * FROM coin_prices WHERE snapshot_id = (SELECT max(snapshot_id) FROM coin_prices)
+        AND NOT EXISTS (SELECT 1 FROM current_prices);
+    '''),
+]
+
+# hot queries with a pattern of the index name their plan is expected to use,
+# indexes of partitions are named <partition>_<columns>_idx
+EXPLAIN_CHECKS = [
+    ("latest holdings snapshot",
+     "select * from defichain_holdings where (snapshot_id, created_at) = "
+     "(select id, created_at from snapshots where id = (select max(snapshot_id) from defichain_holdings))",
+     r"defichain_holdings\w*_snapshot_id"),
+    ("latest vault",
+     "select * from vaults where snapshot_id = (select max(snapshot_id) from vaults)",
+     r"idx_vaults_snapshot_id"),
+    ("amounts of the latest vault",
+     "select * from vault_amounts where vault_id = 1",
+     r"vault_amounts\w*_vault_id"),
+    ("latest coin prices",
+     "select * from coin_prices where (snapshot_id, created_at) = "
+     "(select id, created_at from snapshots where id = (select max(snapshot_id) from coin_prices))",
+     r"coin_prices\w*_snapshot_id"),
+    ("24h DFI price",
+     "select created_at, price from coin_prices "
+     "where symbol = 'DFI' and created_at > now() - interval '1 day' order by created_at desc",
+     r"coin_prices\w*_symbol_created_at"),
+    ("holdings time range",
+     "select * from defichain_holdings where created_at >= now() - interval '1 hour'",
+     r"defichain_holdings\w*_created_at"),
+    ("portfolio holdings time range",
+     "select * from defichain_holdings where owner_id in (1, 2) and created_at >= now() - interval '1 day'",
+     r"defichain_holdings\w*_owner_id_created_at"),
+]
+
+
+def applied_versions(cursor):
+    """ Get versions of all migrations applied to the database """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations
+        (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        );
+    ''')
+    cursor.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(con):
+    """ Apply all pending migrations, each in its own transaction; returns list of applied versions.
+    A failing migration is rolled back and its error raised, the migrations after it are not applied """
+    cur = con.cursor()
+    applied = []
+    try:
+        done = applied_versions(cur)
+        con.commit()
+        for version, description, sql in MIGRATIONS:
+            if version in done:
+                continue
+            print(f"Applying migration {version}: {description}")
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                        (version, description))
+            con.commit()
+            applied.append(version)
+    except OperationalError as err:
+        postgresql.show_psycopg2_exception(err)
+        con.rollback()
+        raise
+    except Exception as err:
+        print(f"Error occured in postgresql transaction: \n{err}")
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+    return applied
+
+
+def check_indexes(con):
+    """ EXPLAIN the hot queries and check their plans use the expected index;
+    sequential scans are disabled so the check also holds on small tables """
+    cur = con.cursor()
+    passed = True
+    try:
+        cur.execute("SET LOCAL enable_seqscan = off;")
+        for name, sql, index in EXPLAIN_CHECKS:
+            cur.execute(f"EXPLAIN {sql}")
+            plan = "\n".join(row[0] for row in cur.fetchall())
+            ok = re.search(index, plan) is not None and "Seq Scan" not in plan
+            passed = passed and ok
+            print(f"{'ok' if ok else 'FAILED'}: {name} (expects {index})")
+            if not ok:
+                print(plan)
+    finally:
+        con.rollback()
+        cur.close()
+    return passed
@@ -0,0 +1,216 @@
+"""Ocean API client with pooled keep-alive connections, retries and a circuit breaker"""
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+OCEAN_URL = "https://ocean.defichain.com/v0/mainnet"
+
+# responses worth retrying, every other non-200 status fails right away
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# rate limited responses, retried after Retry-After without counting as a circuit breaker failure:
+# the server is healthy, only asking to slow down
+THROTTLE_STATUS_CODES = {429}
+
+
+class OceanError(Exception):
+    """ Raised when an Ocean API request failed after all retries """
+
+
+class CircuitOpenError(OceanError):
+    """ Raised when requests are refused because the circuit breaker is open """
+
+
+class CircuitBreaker():
+    """ Circuit breaker: opens after `failure_threshold` failures in a row and lets
+    a single trial request through once `reset_timeout` seconds have passed """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        """ 'closed', 'open' or 'half-open' """
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def allow(self):
+        """ Return True when a request may be sent """
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def success(self):
+        """ Close the circuit after a successful request """
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def failure(self):
+        """ Count a failed request, open the circuit when the threshold is reached """
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def __str__(self):
+        return f"[CircuitBreaker] {self.state} after {self.failures} failures"
+
+
+class LatencyMetrics():
+    """ Request latency per endpoint, keeps the most recent `window` samples for percentiles """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.samples = defaultdict(lambda: deque(maxlen=self.window))
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, latency, error=False):
+        """ Save latency in seconds of one request to an endpoint """
+        with self.lock:
+            self.samples[endpoint].append(latency)
+            self.requests[endpoint] += 1
+            if error:
+                self.errors[endpoint] += 1
+
+    def summary(self):
+        """ Return dict with request count, error count and latency percentiles per endpoint """
+        with self.lock:
+            summary = {}
+            for endpoint, samples in self.samples.items():
+                latencies = sorted(samples)
+                summary[endpoint] = {
+                    "requests": self.requests[endpoint],
+                    "errors": self.errors[endpoint],
+                    "mean": sum(latencies) / len(latencies),
+                    "p50": latencies[int(0.50 * (len(latencies) - 1))],
+                    "p95": latencies[int(0.95 * (len(latencies) - 1))],
+                    "max": latencies[-1],
+                }
+            return summary
+
+
+class OceanClient():
+    """ Client for the Ocean API sharing one pooled keep-alive session between threads """
+
+    def __init__(self, base_url=OCEAN_URL, timeout=10, max_retries=5, backoff_base=0.5,
+                 backoff_max=30, pool_size=10, rate_limiter=None, circuit_breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.metrics = LatencyMetrics()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def backoff(self, attempt, response=None):
+        """ Seconds to wait before the next attempt: Retry-After if the server sent it,
+        otherwise exponential backoff with full jitter """
+        if response is not None and "Retry-After" in response.headers:
+            retry_after = retry_after_seconds(
+                response.headers["Retry-After"])
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get(self, endpoint, params=None, **path_params):
+        """ GET an endpoint like '/poolpairs/{token_id}' and return the decoded JSON body,
+        latency metrics are grouped by the endpoint template """
+        url = self.base_url + endpoint.format(**path_params)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if not self.circuit_breaker.allow():
+                raise CircuitOpenError(
+                    f"Ocean API circuit is open, refusing {url}")
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            response = None
+            start = time.perf_counter()
+            try:
+                response = self.session.get(
+                    url, params=params, timeout=self.timeout)
+            except requests.RequestException as err:
+                last_error = err
+            self.metrics.record(endpoint, time.perf_counter() - start,
+                                error=response is None or response.status_code != 200)
+
+            if response is not None and response.status_code == 200:
+                self.circuit_breaker.success()
+                try:
+                    return response.json()
+                except ValueError as err:
+                    # the API is up but sent a body that is not JSON, e.g. an error page of a proxy
+                    raise OceanError(f"Ocean API returned invalid JSON for {url}: {err}") from err
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                # the API is up but refused this request, retrying will not help
+                self.circuit_breaker.success()
+                raise OceanError(
+                    f"Ocean API returned {response.status_code} for {url}")
+            if response is not None and response.status_code in THROTTLE_STATUS_CODES:
+                # the API is up, only 5xx responses and connection errors open the circuit
+                self.circuit_breaker.success()
+            else:
+                self.circuit_breaker.failure()
+            if response is not None:
+                last_error = OceanError(
+                    f"Ocean API returned {response.status_code} for {url}")
+            if attempt < self.max_retries:
+                time.sleep(self.backoff(attempt, response))
+        raise OceanError(
+            f"Ocean API request failed after {self.max_retries + 1} attempts: {last_error}")
+
+    def paginate(self, endpoint, **path_params):
+        """ Yield all items of a paginated endpoint, following the 'next' page token """
+        params = None
+        while True:
+            page = self.get(endpoint, params=params, **path_params)
+            yield from page["data"]
+            if "page" not in page:
+                return
+            params = {"next": page["page"]["next"]}
+
+    def close(self):
+        """ Close all pooled connections """
+        self.session.close()
+
+    def __str__(self):
+        return f"[OceanClient] {self.base_url} ({self.circuit_breaker})"
+
+
+def retry_after_seconds(value):
+    """ Parse a Retry-After header, given either in seconds or as HTTP date """
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
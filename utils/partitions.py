@@ -0,0 +1,41 @@
+"""Partition helper functions: monthly range partitions of the history tables"""
+import datetime as dt
+
+# history tables partitioned by month on created_at, see migration 4
+PARTITIONED_TABLES = ["defichain_holdings", "vault_amounts", "coin_prices"]
+
+
+def ensure_partitions(cursor, months_ahead=2):
+    """ Create the partitions of the current month and `months_ahead` months after it
+    if they do not exist yet, an insert into a month without partition fails """
+    for table in PARTITIONED_TABLES:
+        cursor.execute("SELECT create_monthly_partitions(%s, now(), now() + make_interval(months => %s));",
+                       (table, months_ahead))
+
+
+def list_partitions(cursor, table):
+    """ Return list of (partition name, first day of its month) of a table, oldest first """
+    cursor.execute('''
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = %s::regclass;
+    ''', (table,))
+    partitions = []
+    for (name,) in cursor.fetchall():
+        month = dt.datetime.strptime(name[-len("YYYY_MM"):], "%Y_%m").replace(tzinfo=dt.timezone.utc)
+        partitions.append((name, month))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def drop_partitions_before(cursor, table, cutoff):
+    """ Drop all partitions of a table that only hold rows older than cutoff,
+    returns the names of the dropped partitions """
+    dropped = []
+    for name, month in list_partitions(cursor, table):
+        next_month = (month + dt.timedelta(days=32)).replace(day=1)
+        if next_month > cutoff:
+            break
+        cursor.execute(f"DROP TABLE {name};")
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,177 @@
+"""Portfolio valuation helper functions: per-token exposure and USD value of wallet holdings and vault
+collateral, vectorized with NumPy. Liquidity pool tokens count as their share of the pool's token A and
+B reserves, the pool tokens themselves are not valued"""
+import numpy as np
+import pandas as pd
+
+# nanoseconds per unit of a timestamp column
+NANOSECONDS = {"s": 10**9, "ms": 10**6, "us": 10**3, "ns": 1}
+
+
+def _floats(series):
+    """ Get a column as float array, missing values as NaN """
+    return series.to_numpy(dtype="float64", na_value=np.nan)
+
+
+def split_exposure(codes, amount, is_lps, total_liquidity, reserve_a, reserve_b, codes_a, codes_b,
+                   n_symbols, times=None, n_times=1):
+    """ Sum the exposure of holdings rows per time and symbol in one pass.
+    All arguments are arrays with one element per row: symbols are integer codes below n_symbols and times
+    integer codes below n_times, all rows belong to a single snapshot when times is None.
+    Returns the (n_times, n_symbols) exposure array and a boolean array of the same shape that marks
+    the symbols held at each time """
+    times = np.zeros(len(amount), dtype=np.int64) if times is None else times
+    offset = times * n_symbols
+    size = n_times * n_symbols
+    # plain tokens and collateral add their own amount, pool tokens go to a spare last bin
+    index = np.where(is_lps, size, offset + codes)
+    exposure = np.bincount(index, weights=np.where(is_lps | np.isnan(amount), 0, amount), minlength=size + 1)
+    held = np.bincount(index, minlength=size + 1)
+    # pools without liquidity, reserves or known tokens A and B have no share to split
+    rows = np.flatnonzero(is_lps & (total_liquidity > 0) & (reserve_a >= 0) & (reserve_b >= 0)
+                          & (codes_a >= 0) & (codes_b >= 0))
+    share = amount[rows] / total_liquidity[rows]
+    for pool_codes, reserve in ((codes_a, reserve_a), (codes_b, reserve_b)):
+        index = offset[rows] + pool_codes[rows]
+        exposure += np.bincount(index, weights=share * reserve[rows], minlength=size + 1)
+        held += np.bincount(index, minlength=size + 1)
+    return exposure[:size].reshape(n_times, n_symbols), (held[:size] > 0).reshape(n_times, n_symbols)
+
+
+def value(exposure, prices):
+    """ USD value of an exposure array, prices per symbol or per time and symbol """
+    return exposure * prices
+
+
+def _exposure(tokens, collateral, time_column):
+    """ Encode symbols and times of tokens and collateral and sum their exposure,
+    returns exposure and held arrays with the symbols and times of their columns and rows """
+    if collateral is None:
+        # empty collateral with the column types of the tokens
+        columns = ["token_symbol", "amount"] + ([time_column] if time_column else [])
+        collateral = tokens[columns].iloc[:0].rename(columns={"token_symbol": "symbol"})
+    # pool tokens A and B are attributes of the token: only the token symbols of all rows are encoded,
+    # the symbols of the pool tokens A and B are looked up once per token
+    token_codes, token_symbols = pd.factorize(tokens["token_symbol"])
+    # any row of each token, without sorting all rows
+    rows = np.empty(len(token_symbols), dtype=np.intp)
+    rows[token_codes] = np.arange(len(token_codes))
+    collateral_codes, collateral_symbols = pd.factorize(collateral["symbol"])
+    codes, symbols = pd.factorize(pd.concat([pd.Series(token_symbols), tokens["tokena_symbol"].take(rows),
+                                             tokens["tokenb_symbol"].take(rows),
+                                             pd.Series(collateral_symbols)], ignore_index=True), sort=True)
+    n_tokens = len(token_symbols)
+    token_a = codes[n_tokens:2 * n_tokens][token_codes]
+    token_b = codes[2 * n_tokens:3 * n_tokens][token_codes]
+    token_codes = codes[:n_tokens][token_codes]
+    collateral_codes = codes[3 * n_tokens:][collateral_codes]
+    # collateral rows are appended as plain tokens without reserves
+    padding = np.zeros(len(collateral))
+    times, n_times, time_values = None, 1, None
+    if time_column is not None:
+        times, time_values = pd.factorize(pd.concat([tokens[time_column], collateral[time_column]],
+                                                    ignore_index=True), sort=True)
+        n_times = len(time_values)
+    result, held = split_exposure(
+        np.concatenate([token_codes, collateral_codes]),
+        np.concatenate([_floats(tokens["amount"]), _floats(collateral["amount"])]),
+        np.concatenate([tokens["islps"].to_numpy(dtype="bool"), padding.astype("bool")]),
+        np.concatenate([_floats(tokens["total_liquidity_token"]), padding]),
+        np.concatenate([_floats(tokens["tokena_reserve"]), padding]),
+        np.concatenate([_floats(tokens["tokenb_reserve"]), padding]),
+        np.concatenate([token_a, np.full(len(collateral), -1)]),
+        np.concatenate([token_b, np.full(len(collateral), -1)]),
+        len(symbols), times, n_times)
+    return result, held, symbols, time_values
+
+
+def _frame(columns, held, symbols, time_values, time_column):
+    """ Get the held cells of (n_times, n_symbols) arrays as rows of a DataFrame, sorted by time and symbol """
+    time_index, symbol_index = np.nonzero(held)
+    df = pd.DataFrame({"symbol": pd.array(symbols.take(symbol_index), dtype="string")})
+    if time_column is not None:
+        df.insert(0, time_column, time_values.take(time_index))
+    for name, values in columns.items():
+        df[name] = values[time_index, symbol_index] if values.ndim == 2 else values[symbol_index]
+    return df
+
+
+def exposure(tokens, collateral=None, time_column=None):
+    """ Get the exposure per symbol of wallet tokens and vault collateral as DataFrame with symbol and
+    amount columns, sorted by symbol.
+    tokens has the columns of the tokens query, collateral symbol and amount columns. With time_column
+    both are a time-indexed batch, the exposure is summed per time and symbol and the time column
+    comes first """
+    result, held, symbols, time_values = _exposure(tokens, collateral, time_column)
+    return _frame({"amount": result}, held, symbols, time_values, time_column)
+
+
+def holdings_value(tokens, prices, collateral=None, time_column=None):
+    """ Get exposure and USD value per symbol of wallet tokens and vault collateral in one pass,
+    as DataFrame with symbol, amount, pair, price and value columns. Prices are indexed by symbol,
+    symbols without a price are left out. Arguments are the same as for exposure """
+    result, held, symbols, time_values = _exposure(tokens, collateral, time_column)
+    # prices are looked up once per symbol instead of once per row
+    position = prices.index.get_indexer(symbols)
+    held &= position >= 0
+    pair = prices["pair"].array.take(position, allow_fill=True)
+    price = np.where(position >= 0, _floats(prices["price"])[position], np.nan)
+    return _frame({"amount": result, "pair": pair, "price": price, "value": value(result, price)},
+                  held, symbols, time_values, time_column)
+
+
+def valuate(exposure, prices):
+    """ Add pair, price and USD value columns to an exposure DataFrame, prices are indexed by symbol.
+    Symbols without a price are left out """
+    position = prices.index.get_indexer(exposure["symbol"])
+    priced = position >= 0
+    df = exposure[priced].reset_index(drop=True)
+    position = position[priced]
+    df["pair"] = prices["pair"].to_numpy()[position]
+    df["price"] = _floats(prices["price"])[position]
+    df["value"] = value(df["amount"].to_numpy(), df["price"].to_numpy())
+    return df
+
+
+def _nanoseconds(series):
+    """ Get a timestamp column as int64 epoch nanoseconds, whatever its unit """
+    return series.array.asi8 * NANOSECONDS[series.dt.unit]
+
+
+def asof(codes, times, price_codes, price_times):
+    """ As-of join of rows with prices over sorted arrays: for every row the position of the latest price
+    of the same symbol at or before its time, -1 if there is none. Codes are integer symbol codes, times
+    integers like epoch nanoseconds, prices are sorted by code and time. Rows are looked up with a binary
+    search in the prices of their symbol, so they are never paired with all prices of their symbol """
+    position = np.full(len(codes), -1)
+    n_codes = max(codes.max(initial=-1), price_codes.max(initial=-1)) + 1
+    # boundaries of the prices and of the rows, grouped by code, of every code
+    price_bounds = np.searchsorted(price_codes, np.arange(n_codes + 1))
+    order = np.argsort(codes, kind="stable")
+    row_bounds = np.searchsorted(codes[order], np.arange(n_codes + 1))
+    for code in range(n_codes):
+        rows = order[row_bounds[code]:row_bounds[code + 1]]
+        start, end = price_bounds[code], price_bounds[code + 1]
+        found = np.searchsorted(price_times[start:end], times[rows], side="right") - 1
+        position[rows] = np.where(found >= 0, start + found, -1)
+    return position
+
+
+def valuate_asof(exposure, prices, time_column="created_at"):
+    """ Add price and USD value columns to a time-indexed exposure DataFrame with the price in effect at
+    the time of each row: prices has time_column, symbol and price columns, every row is valued with the
+    latest price of its symbol at or before its time. Rows without an earlier price are left out """
+    # prices are coded first, so prices sorted by symbol and time need no sorting here
+    codes = pd.factorize(pd.concat([prices["symbol"], exposure["symbol"]], ignore_index=True))[0]
+    n_prices = len(prices)
+    price_codes, price_times = codes[:n_prices], _nanoseconds(prices[time_column])
+    price = _floats(prices["price"])
+    if np.any((np.diff(price_codes) < 0) | ((np.diff(price_codes) == 0) & (np.diff(price_times) < 0))):
+        order = np.lexsort((price_times, price_codes))
+        price_codes, price_times, price = price_codes[order], price_times[order], price[order]
+    position = asof(codes[n_prices:], _nanoseconds(exposure[time_column]), price_codes, price_times)
+    priced = position >= 0
+    df = exposure[priced].reset_index(drop=True)
+    df["price"] = price[position[priced]]
+    df["value"] = value(df["amount"].to_numpy(), df["price"].to_numpy())
+    return df
@@ -1,9 +1,13 @@
 """PostgreSQL helper functions"""
+import select
 import sys
 import psycopg2
 # import the error handling libraries for psycopg2
 from psycopg2 import OperationalError
 
+# channel the collector notifies when a snapshot is committed, the payload is the id of the snapshot
+SNAPSHOT_CHANNEL = "snapshots"
+
 
 def show_psycopg2_exception(err):
     """ Define a function that handles and parses psycopg2 exceptions """
@@ -35,3 +39,42 @@ def connect(conn_params_dic):
         # set the connection to 'None' in case of error
         conn = None
     return conn
+
+
+def notify(cursor, channel, payload):
+    """ Notify the listeners of a channel, PostgreSQL delivers it when the transaction commits """
+    cursor.execute("SELECT pg_notify(%s, %s);", (channel, str(payload)))
+
+
+class Listener():
+    """ LISTEN on a channel over a connection of its own, connect() opens a new psycopg2 connection.
+    The connection is opened on the first wait and again after it broke, notifications sent while it
+    was closed are lost """
+
+    def __init__(self, connect, channel):
+        self.connect = connect
+        self.channel = channel
+        self.conn = None
+
+    def wait(self, timeout):
+        """ Wait at most timeout seconds for notifications, returns their payloads in the order they were sent """
+        if self.conn is None or self.conn.closed:
+            self.conn = self.connect()
+            self.conn.autocommit = True
+            with self.conn.cursor() as cur:
+                cur.execute(f"LISTEN {self.channel};")
+        try:
+            if select.select([self.conn], [], [], timeout) != ([], [], []):
+                self.conn.poll()
+        except (OperationalError, OSError):
+            self.close()
+            raise
+        payloads = [notification.payload for notification in self.conn.notifies]
+        self.conn.notifies.clear()
+        return payloads
+
+    def close(self):
+        """ Close the connection, the next wait opens a new one """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,304 @@
+"""Query helper functions: named, parameterized statements shared by the dashboard and notebooks"""
+import datetime as dt
+import re
+import zlib
+
+import pandas as pd
+import pyarrow as pa
+
+from utils import export, rollup
+
+try:
+    import duckdb
+except ImportError:
+    # only needed to run history queries on a Parquet export, see read_cache()
+    duckdb = None
+
+# start of the whole history, the default since of the history queries
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+
+# named queries with %(name)s parameters and the dtypes of their result columns. History queries name
+# the tables they read in "history", {placeholders} of these are filled with the coarsest rollup table
+# that still has buckets of at most the "bucket" parameter, see rollup.history_source().
+# Queries with long results set "copy", they are streamed through COPY instead of being prepared.
+# Parameters in "defaults" may be left out, queries of a portfolio sum over all active owners when
+# the portfolio parameter is None and whole history queries read all buckets unless a later since is given
+QUERIES = {
+    # id of the latest snapshot saved by the collector
+    "latest_snapshot_id": {
+        "sql": """
+            select max(id) as id from snapshots;
+            """,
+        "dtypes": {"id": "Int64"},
+    },
+    # time range of all snapshots
+    "snapshot_range": {
+        "sql": """
+            select
+                (select created_at from snapshots where id = (select min(id) from snapshots)) as first_created_at,
+                (select created_at from snapshots where id = (select max(id) from snapshots)) as last_created_at;
+            """,
+        "dtypes": {"first_created_at": "datetime64[ns, UTC]", "last_created_at": "datetime64[ns, UTC]"},
+    },
+    # latest coin prices
+    "prices": {
+        "sql": """
+            select symbol, pair, price
+            from current_prices;
+            """,
+        "dtypes": {"symbol": "string", "pair": "string", "price": "float64"},
+    },
+    # portfolios of the active owners
+    "portfolios": {
+        "sql": """
+            select distinct portfolio
+            from owners
+            where active
+            order by portfolio;
+            """,
+        "dtypes": {"portfolio": "string"},
+    },
+    # latest vault details, summed over the vaults of a portfolio
+    "vault_details": {
+        "sql": """
+            select 100 * sum(collateral_value) / nullif(sum(loan_value), 0) as collateral_ratio,
+            sum(collateral_value) as collateral_value, sum(loan_value) as loan_value
+            from current_vaults
+            where owner_id in (select id from owners where active and (cast(%(portfolio)s as varchar) is null or portfolio = %(portfolio)s));
+            """,
+        "defaults": {"portfolio": None},
+        "dtypes": {"collateral_ratio": "float64", "collateral_value": "float64", "loan_value": "float64"},
+    },
+    # token amounts of the latest vault snapshot, summed over the vaults of a portfolio
+    "vault": {
+        "sql": """
+            select va.token_id, name, symbol, token_type, sum(amount) as amount, max(active_price) as active_price, max(next_price) as next_price
+            from current_vault_amounts va
+            inner join defichain_tokens dt on va.token_id=dt.token_id
+            where va.owner_id in (select id from owners where active and (cast(%(portfolio)s as varchar) is null or portfolio = %(portfolio)s))
+            group by va.token_id, name, symbol, token_type
+            order by token_type, va.token_id;
+            """,
+        "defaults": {"portfolio": None},
+        "dtypes": {"token_id": "int64", "name": "string", "symbol": "string", "token_type": "string",
+                   "amount": "float64", "active_price": "float64", "next_price": "float64"},
+    },
+    # 24 hours worth of DFI prices the collector saved, newest first, one per snapshot whether or not a
+    # vault holds DFI. The time window is computed by the server so the parameters stay the same between
+    # reruns and the result can be cached
+    "dfi_prices_24h": {
+        "sql": """
+            select created_at, price
+            from coin_prices
+            where symbol = 'DFI' and created_at > now() - interval '1 day'
+            order by created_at desc;
+            """,
+        "dtypes": {"created_at": "datetime64[ns, UTC]", "price": "float64"},
+    },
+    # current token holdings in the wallets of a portfolio
+    "tokens": {
+        "sql": """
+            select dt1.token_id, dt1.symbol as token_symbol, dt1.islps, sum(amount) as amount, dt2.symbol as tokena_symbol, dt3.symbol as tokenb_symbol, max(tokena_reserve) as tokena_reserve, max(tokenb_reserve) as tokenb_reserve, max(total_liquidity_token) as total_liquidity_token
+            from defichain_tokens dt1
+            left join defichain_tokens dt2 on dt1.tokena_id=dt2.token_id
+            left join defichain_tokens dt3 on dt1.tokenb_id=dt3.token_id
+            inner join current_holdings dh on dh.token_id=dt1.token_id
+            where dh.owner_id in (select id from owners where active and (cast(%(portfolio)s as varchar) is null or portfolio = %(portfolio)s))
+            group by dt1.token_id, dt1.symbol, dt1.islps, dt2.symbol, dt3.symbol
+            order by dt1.token_id;
+            """,
+        "defaults": {"portfolio": None},
+        "dtypes": {"token_id": "int64", "token_symbol": "string", "islps": "bool", "amount": "float64",
+                   "tokena_symbol": "string", "tokenb_symbol": "string", "tokena_reserve": "float64",
+                   "tokenb_reserve": "float64", "total_liquidity_token": "float64"},
+    },
+    # historical token amounts of a portfolio per time bucket since a bucket start: liquidity pool tokens are
+    # split into their token A and B share, summed per snapshot, averaged per bucket and summed over wallet and vault
+    "historical_amounts": {
+        "sql": """
+            with portfolio_owners as (select id from owners where active and (cast(%(portfolio)s as varchar) is null or portfolio = %(portfolio)s)),
+            exposure (source, created_at, symbol, amount)
+            as
+            (
+                select 'wallet', dh.created_at, dt2.symbol, dh.amount / dh.total_liquidity_token * dh.tokena_reserve
+                from {holdings} dh
+                inner join defichain_tokens dt1 on dh.token_id=dt1.token_id
+                inner join defichain_tokens dt2 on dt1.tokena_id=dt2.token_id
+                where dt1.islps and dh.owner_id in (select id from portfolio_owners) and dh.created_at >= %(since)s
+                union all
+                select 'wallet', dh.created_at, dt3.symbol, dh.amount / dh.total_liquidity_token * dh.tokenb_reserve
+                from {holdings} dh
+                inner join defichain_tokens dt1 on dh.token_id=dt1.token_id
+                inner join defichain_tokens dt3 on dt1.tokenb_id=dt3.token_id
+                where dt1.islps and dh.owner_id in (select id from portfolio_owners) and dh.created_at >= %(since)s
+                union all
+                select 'wallet', dh.created_at, dt1.symbol, dh.amount
+                from {holdings} dh
+                inner join defichain_tokens dt1 on dh.token_id=dt1.token_id
+                where not dt1.islps and dh.owner_id in (select id from portfolio_owners) and dh.created_at >= %(since)s
+                union all
+                select 'vault', va.created_at, dt.symbol, va.amount
+                from {vault_amounts} va
+                inner join defichain_tokens dt on va.token_id=dt.token_id
+                where va.token_type='collateral' and va.owner_id in (select id from portfolio_owners) and va.created_at >= %(since)s
+            ),
+            per_snapshot as
+            (
+                select source, created_at, symbol, sum(amount) as amount
+                from exposure
+                group by source, created_at, symbol
+            ),
+            per_bucket as
+            (
+                select source, to_timestamp(floor(extract(epoch from created_at) / %(bucket)s) * %(bucket)s) as created_at,
+                symbol, avg(amount) as amount
+                from per_snapshot
+                group by 1, 2, 3
+            )
+            select created_at, symbol, sum(amount) as amount
+            from per_bucket
+            group by created_at, symbol
+            order by created_at desc;
+            """,
+        "history": {"holdings": "defichain_holdings", "vault_amounts": "vault_amounts"},
+        "copy": True,
+        "defaults": {"portfolio": None, "since": EPOCH},
+        "dtypes": {"created_at": "datetime64[ns, UTC]", "symbol": "string", "amount": "float64"},
+    },
+    # coin prices per time bucket since a bucket start, averaged per bucket like the historical amounts
+    "historical_prices": {
+        "sql": """
+            select to_timestamp(floor(extract(epoch from cp.created_at) / %(bucket)s) * %(bucket)s) as created_at,
+            cp.symbol, avg(cp.price) as price
+            from {prices} cp
+            where cp.created_at >= %(since)s
+            group by 1, 2
+            order by 2, 1;
+            """,
+        "history": {"prices": "coin_prices"},
+        "copy": True,
+        "defaults": {"since": EPOCH},
+        "dtypes": {"created_at": "datetime64[ns, UTC]", "symbol": "string", "price": "float64"},
+    },
+    # reward APR% of the liquidity pool tokens of a portfolio per time bucket since a point in time
+    "rewards": {
+        "sql": """
+            select to_timestamp(floor(extract(epoch from dh.created_at) / %(bucket)s) * %(bucket)s) as created_at,
+            dt.symbol, avg(dh.apr_reward) as apr_reward, avg(dh.apr_commission) as apr_commission
+            from {holdings} dh
+            inner join defichain_tokens dt on dh.token_id=dt.token_id
+            where dt.isLPS = True and dh.created_at >= %(since)s
+            and dh.owner_id in (select id from owners where active and (cast(%(portfolio)s as varchar) is null or portfolio = %(portfolio)s))
+            group by 1, 2
+            order by 1;
+            """,
+        "history": {"holdings": "defichain_holdings"},
+        "copy": True,
+        "defaults": {"portfolio": None},
+        "dtypes": {"created_at": "datetime64[ns, UTC]", "symbol": "string", "apr_reward": "float64",
+                   "apr_commission": "float64"},
+    },
+}
+
+# key of the set of prepared statement names in the info dict of a pooled connection
+PREPARED_KEY = "prepared_queries"
+
+# Arrow types that COPY results are parsed into, per result dtype
+ARROW_TYPES = {
+    "int64": pa.int64(),
+    "Int64": pa.int64(),
+    "float64": pa.float64(),
+    "bool": pa.bool_(),
+    "string": pa.string(),
+    "datetime64[ns, UTC]": pa.timestamp("us", tz="UTC"),
+}
+
+
+def statement(name, params=None):
+    """ Get (statement name, sql) of a named query, history tables are filled in from the bucket parameter,
+    the statement name changes with the sql text so every rollup source gets its own statement """
+    query = QUERIES[name]
+    sql = query["sql"]
+    if "history" in query:
+        sql = sql.format(**{placeholder: rollup.history_source(table, params["bucket"])
+                            for placeholder, table in query["history"].items()})
+    return f"{name}_{zlib.crc32(sql.encode()):08x}", sql
+
+
+def parameter_names(sql):
+    """ Get names of the %(name)s parameters of a sql text in order of first appearance """
+    return list(dict.fromkeys(re.findall(r"%\((\w+)\)s", sql)))
+
+
+def typed(df, dtypes):
+    """ Cast the columns of a query result to their dtypes, timestamps are converted to UTC """
+    for column, dtype in dtypes.items():
+        if dtype.startswith("datetime64"):
+            df[column] = pd.to_datetime(df[column], utc=True)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def read_prepared(cursor, info, name, params):
+    """ Run a named query as prepared statement and return its result as DataFrame. The query is
+    prepared once per pooled connection, later runs only send the name and the parameter values """
+    statement_name, sql = statement(name, params)
+    names = parameter_names(sql)
+    prepared = info.setdefault(PREPARED_KEY, set())
+    if statement_name not in prepared:
+        # server side placeholders are numbered, $1 is the first parameter name and so on
+        cursor.execute(f"PREPARE {statement_name} AS "
+                       + sql.strip().rstrip(";") % {param: f"${i}" for i, param in enumerate(names, 1)})
+        prepared.add(statement_name)
+    if names:
+        cursor.execute(f"EXECUTE {statement_name} ({', '.join(['%s'] * len(names))});",
+                       [params[param] for param in names])
+    else:
+        cursor.execute(f"EXECUTE {statement_name};")
+    return pd.DataFrame(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+
+
+def read_copy(cursor, name, params):
+    """ Run a named query through COPY TO STDOUT and return its result as DataFrame, the columns
+    are parsed by Arrow straight into their dtypes """
+    _, sql = statement(name, params)
+    schema = pa.schema([(column, ARROW_TYPES[dtype]) for column, dtype in QUERIES[name]["dtypes"].items()])
+    return export.copy_arrow(cursor, sql, schema, params).to_pandas()
+
+
+def read(sqlalchemy_engine, name, params=None):
+    """ Run a named query and return its typed result as DataFrame """
+    params = {**QUERIES[name].get("defaults", {}), **(params or {})}
+    con = sqlalchemy_engine.raw_connection()
+    try:
+        cursor = con.cursor()
+        if QUERIES[name].get("copy"):
+            df = read_copy(cursor, name, params)
+        else:
+            df = read_prepared(cursor, con.info, name, params)
+        cursor.close()
+        con.commit()
+    finally:
+        # return connection to the pool, it keeps its prepared statements
+        con.close()
+    return typed(df, QUERIES[name]["dtypes"])
+
+
+def read_cache(directory, name, params=None):
+    """ Run a named history query with DuckDB on the Parquet export in directory instead of PostgreSQL,
+    the exported tables are memory mapped and the raw history is read in place of the rollup tables """
+    if duckdb is None:
+        raise ImportError("duckdb is required to query the Parquet history export")
+    query = QUERIES[name]
+    sql = query["sql"].format(**{placeholder: table for placeholder, table in query["history"].items()})
+    # DuckDB takes named parameters as $name
+    sql = re.sub(r"%\((\w+)\)s", r"$\1", sql)
+    con = duckdb.connect()
+    try:
+        for table in list(export.HISTORY_TABLES) + export.DIMENSION_TABLES:
+            con.register(table, export.dataset(directory, table))
+        df = con.execute(sql, {**query.get("defaults", {}), **(params or {})}).df()
+    finally:
+        con.close()
+    return typed(df, query["dtypes"])
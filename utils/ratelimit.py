@@ -0,0 +1,45 @@
+"""Rate limiting helper functions"""
+import threading
+import time
+
+
+class TokenBucket():
+    """ Thread-safe token bucket: refills `rate` tokens per second up to `capacity` """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        """ Add the tokens earned since the last refill """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, tokens=1):
+        """ Block until `tokens` are available and take them from the bucket """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                # time until enough tokens are refilled
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self, tokens=1):
+        """ Take `tokens` from the bucket if they are available, returns False otherwise """
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def __str__(self):
+        return f"[TokenBucket] {self.rate} tokens/s with capacity {self.capacity}"
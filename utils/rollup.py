@@ -0,0 +1,88 @@
+"""Rollup helper functions: hourly and daily aggregates of the history tables"""
+from utils import partitions
+
+# raw history tables with the columns that identify a series and the columns that are aggregated,
+# the rollup tables themselves are created by the schema migrations
+ROLLUP_TABLES = {
+    "defichain_holdings": {
+        "keys": ["owner_id", "token_id"],
+        "values": ["amount", "tokenA_reserve", "tokenB_reserve", "total_liquidity_token",
+                   "apr_reward", "apr_commission"],
+    },
+    "vault_amounts": {
+        "keys": ["owner_id", "token_id", "token_type"],
+        "values": ["amount", "active_price"],
+    },
+    "coin_prices": {
+        "keys": ["symbol"],
+        "values": ["price"],
+    },
+}
+
+# rollup resolutions with their bucket size in seconds, from fine to coarse
+RESOLUTIONS = [
+    ("hourly", "hour", 60 * 60),
+    ("daily", "day", 24 * 60 * 60),
+]
+
+# aggregates kept for every value column
+AGGREGATES = ["min", "max", "avg", "last"]
+
+
+def rollup_table(table, resolution):
+    """ Get name of the rollup table of a raw table, e.g. defichain_holdings_hourly """
+    return f"{table}_{resolution}"
+
+
+def refresh_rollups(cursor):
+    """ Recompute all rollup buckets from the newest bucket already rolled up onwards,
+    earlier buckets are complete and are left untouched """
+    for table, spec in ROLLUP_TABLES.items():
+        keys = ", ".join(spec["keys"])
+        for resolution, unit, _ in RESOLUTIONS:
+            target = rollup_table(table, resolution)
+            aggregates = ",\n".join(
+                f"min({value}), max({value}), avg({value}), "
+                f"(array_agg({value} order by created_at desc))[1]"
+                for value in spec["values"])
+            columns = ", ".join(f"{value}_{aggregate}" for value in spec["values"]
+                                for aggregate in AGGREGATES)
+            updates = ", ".join(f"{column} = excluded.{column}"
+                                for column in ["samples"] + columns.split(", "))
+            cursor.execute(f'''
+                INSERT INTO {target} (bucket, {keys}, samples, {columns})
+                SELECT date_trunc('{unit}', created_at, 'UTC') AS bucket, {keys}, count(*),
+                {aggregates}
+                FROM {table}
+                WHERE created_at >= coalesce((SELECT max(bucket) FROM {target}), '-infinity')
+                GROUP BY 1, {keys}
+                ON CONFLICT (bucket, {keys})
+                DO UPDATE SET {updates};
+            ''')
+
+
+def compact_raw(cursor, retention_days):
+    """ Drop the monthly partitions of raw rows older than retention_days that are covered
+    by the daily rollup, returns the names of the dropped partitions """
+    dropped = []
+    for table in ROLLUP_TABLES:
+        cursor.execute(f'''
+            SELECT least(now() - make_interval(days => %s),
+                         (SELECT max(bucket) FROM {rollup_table(table, RESOLUTIONS[-1][0])}));
+        ''', (retention_days,))
+        cutoff = cursor.fetchone()[0]
+        if cutoff is not None:
+            dropped += partitions.drop_partitions_before(cursor, table, cutoff)
+    return dropped
+
+
+def history_source(table, bucket):
+    """ Get the coarsest source of a history table that still has buckets of at most `bucket`
+    seconds: a rollup table with its averages under the raw column names, or the raw table """
+    spec = ROLLUP_TABLES[table]
+    for resolution, _, seconds in reversed(RESOLUTIONS):
+        if bucket >= seconds:
+            values = ", ".join(f"{value}_avg AS {value}" for value in spec["values"])
+            return (f"(SELECT bucket AS created_at, {', '.join(spec['keys'])}, {values} "
+                    f"FROM {rollup_table(table, resolution)})")
+    return table
@@ -0,0 +1,53 @@
+"""Scheduler helper functions for the resident collector"""
+import threading
+import time
+
+
+class Scheduler():
+    """ Interval scheduler, jobs that are due at the same moment are run together """
+
+    def __init__(self, intervals):
+        # dict with job name as key and interval in seconds as value
+        self.intervals = dict(intervals)
+        now = time.monotonic()
+        # run every job right away on start
+        self.next_run = {name: now for name in self.intervals}
+        self.stopped = threading.Event()
+
+    def due(self, now=None):
+        """ Return names of all jobs that are due """
+        now = time.monotonic() if now is None else now
+        return [name for name, next_run in self.next_run.items() if next_run <= now]
+
+    def done(self, names, now=None):
+        """ Reschedule jobs after they ran, skipping runs that were missed while busy """
+        now = time.monotonic() if now is None else now
+        for name in names:
+            next_run = self.next_run[name] + self.intervals[name]
+            self.next_run[name] = next_run if next_run > now else now + self.intervals[name]
+
+    def wait(self):
+        """ Sleep until the next job is due """
+        delay = min(self.next_run.values()) - time.monotonic()
+        if delay > 0:
+            self.stopped.wait(delay)
+
+    def run_forever(self, run_jobs):
+        """ Call run_jobs with the names of all due jobs until stop() is called """
+        while not self.stopped.is_set():
+            names = self.due()
+            if names:
+                try:
+                    run_jobs(names)
+                except Exception as err:
+                    # keep running, the jobs are due again at their next interval
+                    print(f"Error occured in scheduled jobs {', '.join(names)}: \n{err}")
+                self.done(names)
+            self.wait()
+
+    def stop(self):
+        """ Stop the run_forever loop after the current cycle """
+        self.stopped.set()
+
+    def __str__(self):
+        return f"[Scheduler] {len(self.intervals)} jobs: {self.intervals}"
@@ -0,0 +1,186 @@
+"""Shared data store helper functions: datasets computed once per collector snapshot and served to every
+dashboard session of the process"""
+import threading
+import time
+
+
+def _key(name, params):
+    """ Get hashable key of a dataset and its parameters """
+    return name, tuple(sorted((params or {}).items()))
+
+
+def _snapshot_id(value):
+    """ Get a snapshot id as int, None if there is no snapshot yet, e.g. pd.NA of an empty snapshots table """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _current(entry, snapshot_id):
+    """ Check if a result entry is computed at snapshot_id or at a later snapshot """
+    return entry is not None and (entry[0] == snapshot_id or (
+        entry[0] is not None and snapshot_id is not None and entry[0] > snapshot_id))
+
+
+class SnapshotStore():
+    """ Thread-safe, process-wide store of datasets, a dataset is a registered function of a params dict
+    that returns a DataFrame. Each dataset is computed once per snapshot: the first session that asks for
+    it computes it while the other sessions wait for the same result. Results are shared by all sessions
+    and must not be modified. A refresher thread checks for a new snapshot every `poll` seconds and
+    computes the datasets that were asked for since the previous snapshot, so sessions find them ready.
+    With `wait` it refreshes as soon as the collector announces a snapshot and only checks itself when
+    nothing was announced for `poll` seconds. A failed refresh is retried after `retry` seconds """
+
+    def __init__(self, latest_snapshot_id, poll=10, max_entries=256, wait=None, retry=5):
+        # function that returns the id of the latest snapshot saved by the collector
+        self.latest_snapshot_id = latest_snapshot_id
+        # function that blocks at most timeout seconds until the collector announces a snapshot,
+        # returns its id or None
+        self.wait = wait
+        self.poll = poll
+        self.retry = retry
+        self.max_entries = max_entries
+        self.datasets = {}
+        # dict with key as key and (snapshot id, result, last access) as value
+        self.results = {}
+        # keys asked for since the previous snapshot, they are computed again on a new snapshot
+        self.used = {}
+        self.key_locks = {}
+        self.lock = threading.Lock()
+        self.snapshot_id = None
+        # snapshot whose used datasets are all computed, sessions showing an older one can rerun
+        self.ready_snapshot_id = None
+        self.checked_at = None
+        self.stats = {"computed": 0, "served": 0, "waited": 0, "refreshes": 0}
+        self.stopped = threading.Event()
+        self.thread = None
+        # snapshot the refresher computes datasets at, before the store moves to it
+        self.computing = threading.local()
+
+    def register(self, name, function):
+        """ Add a dataset, function(params) returns its DataFrame """
+        self.datasets[name] = function
+
+    def current_snapshot_id(self):
+        """ Get id of the latest snapshot, checked at most every `poll` seconds without refresher thread.
+        Datasets computed by a refresh, and the datasets they get, are at the snapshot being refreshed to """
+        computing = getattr(self.computing, "snapshot_id", None)
+        if computing is not None:
+            return computing
+        if self.thread is None and (self.checked_at is None or time.monotonic() - self.checked_at >= self.poll):
+            self.set_snapshot_id(self.latest_snapshot_id())
+        return self.snapshot_id
+
+    def set_snapshot_id(self, snapshot_id):
+        """ Move the store to a snapshot, returns True if it is a new one """
+        snapshot_id = _snapshot_id(snapshot_id)
+        with self.lock:
+            self.checked_at = time.monotonic()
+            if not self._is_new(snapshot_id):
+                return False
+            self.snapshot_id = snapshot_id
+            return True
+
+    def _is_new(self, snapshot_id):
+        """ Check if snapshot_id is later than the current snapshot, the lock must be held """
+        # an announcement can arrive after a check already found a later snapshot
+        return snapshot_id is not None and (self.snapshot_id is None or snapshot_id > self.snapshot_id)
+
+    def get(self, name, params=None, track=True):
+        """ Get the result of a dataset at the current snapshot, computed once for all sessions.
+        A result of a later snapshot a refresh already computed is served as well.
+        Tracked datasets are computed again by the refresher on the next snapshot """
+        key = _key(name, params)
+        snapshot_id = self.current_snapshot_id()
+        with self.lock:
+            if track:
+                self.used[key] = params
+            entry = self.results.get(key)
+            if _current(entry, snapshot_id):
+                self.results[key] = (entry[0], entry[1], time.monotonic())
+                self.stats["served"] += 1
+                return entry[1]
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # another session may have computed it while this one waited for the lock
+            with self.lock:
+                entry = self.results.get(key)
+                if _current(entry, snapshot_id):
+                    self.stats["waited"] += 1
+                    return entry[1]
+            result = self.datasets[name](dict(params or {}))
+            with self.lock:
+                self.results[key] = (snapshot_id, result, time.monotonic())
+                self.stats["computed"] += 1
+                self._evict()
+            return result
+
+    def _evict(self):
+        """ Drop the least recently used results beyond max_entries, the lock must be held """
+        for key, _ in sorted(self.results.items(), key=lambda item: item[1][2])[:-self.max_entries]:
+            del self.results[key]
+            self.used.pop(key, None)
+
+    def refresh(self, snapshot_id=None):
+        """ Compute the datasets used since the previous snapshot at the latest one and move the store to it
+        once all of them are computed, returns True if there was a new snapshot. If a dataset fails the store
+        stays at the previous snapshot and the next refresh computes them again """
+        snapshot_id = _snapshot_id(self.latest_snapshot_id() if snapshot_id is None else snapshot_id)
+        with self.lock:
+            self.checked_at = time.monotonic()
+            if not self._is_new(snapshot_id):
+                return False
+            used, self.used = self.used, {}
+        self.computing.snapshot_id = snapshot_id
+        try:
+            for (name, _), params in used.items():
+                self.get(name, params, track=False)
+        except Exception:
+            with self.lock:
+                self.used = {**used, **self.used}
+            raise
+        finally:
+            self.computing.snapshot_id = None
+        with self.lock:
+            # never move the store back to an earlier snapshot
+            if self._is_new(snapshot_id):
+                self.snapshot_id = self.ready_snapshot_id = snapshot_id
+            self.stats["refreshes"] += 1
+        return True
+
+    def start(self):
+        """ Start the refresher thread, it waits for announced snapshots or checks every `poll` seconds """
+        self.refresh()
+        self.thread = threading.Thread(target=self._run, name="snapshot-store", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        failed = False
+        while not self.stopped.is_set():
+            try:
+                if failed:
+                    # a snapshot is announced only once, the retry checks for the latest one itself
+                    self.stopped.wait(self.retry)
+                    snapshot_id = None
+                elif self.wait is None:
+                    self.stopped.wait(self.poll)
+                    snapshot_id = None
+                else:
+                    snapshot_id = self.wait(self.poll)
+                if not self.stopped.is_set():
+                    self.refresh(snapshot_id)
+                failed = False
+            except Exception as err:
+                # sessions keep the results of the previous snapshot until the next refresh succeeds
+                print(f"Error occured in snapshot store refresh: \n{err}")
+                failed = True
+
+    def stop(self):
+        """ Stop the refresher thread, a waiting one stops after its wait """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __str__(self):
+        return f"[SnapshotStore] {len(self.results)} results at snapshot {self.snapshot_id}, {self.stats}"
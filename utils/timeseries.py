@@ -0,0 +1,30 @@
+"""Time series helper functions"""
+import math
+
+import pandas as pd
+
+# bucket sizes in seconds that charts are aggregated to, smallest is the collector interval
+BUCKET_SIZES = [
+    5 * 60,
+    15 * 60,
+    30 * 60,
+    60 * 60,
+    3 * 60 * 60,
+    6 * 60 * 60,
+    12 * 60 * 60,
+    24 * 60 * 60,
+    7 * 24 * 60 * 60,
+]
+
+
+def bucket_seconds(start, end, max_points=500):
+    """ Get the smallest bucket size that keeps a time range from start to end under max_points buckets """
+    # no snapshots yet, e.g. NaT of an empty snapshots table
+    if pd.isna(start) or pd.isna(end):
+        return BUCKET_SIZES[0]
+    span = (end - start).total_seconds()
+    needed = math.ceil(span / max_points)
+    for size in BUCKET_SIZES:
+        if size >= needed:
+            return size
+    return BUCKET_SIZES[-1]